@@ -0,0 +1,296 @@
+from argparse import ArgumentParser
+from binascii import hexlify
+from hashlib import sha256
+from json import dumps, load
+from os import remove
+from platform import python_version
+from sys import exit
+from timeit import Timer
+
+from ecdsa import SigningKey, SECP256k1
+
+from bitcoin_tools import CFG
+from bitcoin_tools.analysis.leveldb import MIN_FEE_PER_BYTE, MAX_FEE_PER_BYTE, FEE_STEP
+from bitcoin_tools.analysis.leveldb.utils import decode_utxo, deobfuscate_value, b128_encode, b128_decode, \
+    accumulate_dust_lm
+from bitcoin_tools.core.block import Block
+from bitcoin_tools.core.hashing import merkle_root
+from bitcoin_tools.core.keys import serialize_pk, generate_keys, generate_keys_batch
+from bitcoin_tools.core.script import InputScript, OutputScript, Script
+from bitcoin_tools.core.transaction import TX
+from bitcoin_tools.utils import pack_varint, UINT32
+from bitcoin_tools.wallet import hash_160, generate_btc_addr, generate_btc_addr_batch
+
+#################################################
+#               Benchmark suite                 #
+#################################################
+# ---------------------------------------------------------------------------------------------------------------------
+# The following script times the hot paths of the library using fixed (deterministic) inputs, so results from different
+# runs (and different versions of the code) can be compared against each other.
+# - Results are printed (and optionally stored) as json: one entry per benchmark with the best, mean and worst time per
+# call (in seconds).
+# - A previous result file can be passed as baseline. Every benchmark that got slower than the baseline by more than the
+# given tolerance is reported as a regression, and the script exits with a non-zero status.
+#
+# e.g:
+#   python benchmarks/run_benchmarks.py --output baseline.json
+#   python benchmarks/run_benchmarks.py --baseline baseline.json --tolerance 0.1
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Number of inputs of the synthetic transactions used to benchmark (de)serialization and signing.
+TX_INPUTS = 50
+SIGNED_INPUTS = 5
+# Number of transactions of the synthetic block used to benchmark block validation.
+BLOCK_TXS = 500
+
+# Serialized UTXOs (as stored in the chainstate) taken from the Bitcoin Core source examples:
+# https://github.com/bitcoin/bitcoin/blob/v0.13.2/src/coins.h#L35#L76
+UTXOS = ["0104835800816115944e077fe7c803cfa57f29b36bf87c1d358bb85e",
+         "0109044086ef97d5790061b01caab50f1b8e9c50a5057eb43c2d9563a4eebbd123008c988f1a4a4de2161e0f50aac7f17e7f9555caa"
+         "486af3b"]
+
+OBFUSCATION_KEY = "b12dcefd8f872536"
+HEX_TX = "01000000013ca58d2f6fac36602d831ee0cf2bc80031c7472e80a322b57f614c5ce9142b71000000006b483045022100f0331d85cb7f7e" \
+         "c1bedc41f50c695d654489458e88aec0076fbad5d8aeda1673022009e8ca2dda1d6a16bfd7133b0008720145dacccb35c0d5c9fc567e" \
+         "52f26ca5f7012103a164209a7c23227fcd6a71c51efc5b6eb25407f4faf06890f57908425255e42bffffffff0241a2000000000000197" \
+         "6a914e44839239ab36f5bc67b2079de00ecf587233ebe88ac74630000000000001976a914dc7016484646168d99e49f907c86c271299" \
+         "441c088ac00000000"
+
+
+def deterministic_key(seed):
+    """ Builds an elliptic curve private key from a given seed, so every run uses the very same keys.
+
+    :param seed: Seed from which the key is derived.
+    :type seed: int
+    :return: The private key derived from the seed.
+    :rtype: SigningKey
+    """
+
+    return SigningKey.from_string(sha256("bitcoin_tools_bench_" + str(seed)).digest(), curve=SECP256k1)
+
+
+def build_inputs():
+    """ Builds all the (fixed) inputs used along the benchmarks.
+
+    :return: Dictionary with all the benchmark inputs.
+    :rtype: dict
+    """
+
+    data = dict()
+
+    data['sks'] = [deterministic_key(i) for i in range(SIGNED_INPUTS)]
+    data['pks'] = [serialize_pk(sk.get_verifying_key()) for sk in data['sks']]
+    data['btc_addrs'] = [generate_btc_addr(sk.get_verifying_key()) for sk in data['sks']]
+    data['vks'] = [deterministic_key(i).get_verifying_key() for i in range(100)]
+
+    data['prev_tx_ids'] = [sha256(str(i)).hexdigest() for i in range(TX_INPUTS)]
+
+    # A transaction with TX_INPUTS P2PKH signed inputs (all of them with the same signature, since it is only used to
+    # benchmark (de)serialization) and two outputs.
+    sig = "3045022100f0331d85cb7f7ec1bedc41f50c695d654489458e88aec0076fbad5d8aeda1673022009e8ca2dda1d6a16bfd7133b0008" \
+          "720145dacccb35c0d5c9fc567e52f26ca5f701"
+    iscripts = [InputScript.P2PKH(sig, data['pks'][0]) for _ in range(TX_INPUTS)]
+    oscripts = [OutputScript.P2PKH(data['btc_addrs'][0]), OutputScript.P2PKH(data['btc_addrs'][1])]
+    tx = TX.build_from_scripts(data['prev_tx_ids'], range(TX_INPUTS), [1000, 2000], iscripts, oscripts)
+    data['tx'] = tx
+    data['hex_tx'] = tx.serialize()
+
+    # A block with BLOCK_TXS copies of the transaction above (and a valid merkle root).
+    tx_ids = [tx.get_txid(rtype=bin)] * BLOCK_TXS
+    header = UINT32.pack(1) + "\x00" * 32 + merkle_root(tx_ids) + UINT32.pack(0) * 3
+    data['block'] = Block(header + pack_varint(BLOCK_TXS) + tx.serialize(rtype=bin) * BLOCK_TXS)
+
+    # Obfuscated versions of the sample UTXOs (they will be deobfuscated during the benchmark).
+    key = OBFUSCATION_KEY
+    data['o_values'] = [deobfuscate_value(key, utxo.decode('hex')).decode('hex') for utxo in UTXOS]
+    data['b128'] = [b128_encode(n) for n in [0, 127, 255, 2 ** 32, 6 * 10 ** 10, 21 * 10 ** 14]]
+
+    data['human_script'] = "OP_DUP OP_HASH160 <" + "0fabc0a138da76bea3502f0b7e84550ccc484c4a" + \
+                           "> OP_EQUALVERIFY OP_CHECKSIG"
+    data['hex_script'] = Script.serialize(data['human_script'])
+
+    return data
+
+
+def write_dust_input(fout_name, n=1000):
+    """ Creates a fake parsed utxo file (with the same format as the utxo_dump output) in the data dir, used to
+    benchmark accumulate_dust_lm.
+
+    :param fout_name: Name of the file that will be created.
+    :type fout_name: str
+    :param n: Number of utxos to be written.
+    :type n: int
+    :return: None
+    :rtype: None
+    """
+
+    fee_range = range(MIN_FEE_PER_BYTE, MAX_FEE_PER_BYTE, FEE_STEP)
+    fout = open(CFG.data_path + fout_name, 'w')
+    for i in range(n):
+        fout.write(dumps({"amount": i * 1000, "utxo_data_len": 20 + i % 20, "dust": fee_range[i % len(fee_range)],
+                          "loss_making": fee_range[(i * 7) % len(fee_range)]}) + '\n')
+    fout.close()
+
+
+def sign_tx(data):
+    """ Builds and signs a transaction with SIGNED_INPUTS P2PKH orphan inputs.
+
+    :param data: Benchmark inputs (from build_inputs).
+    :type data: dict
+    :return: The signed transaction.
+    :rtype: TX
+    """
+
+    n = SIGNED_INPUTS
+    tx = TX.build_from_io(data['prev_tx_ids'][:n], range(n), 1000, data['btc_addrs'][0])
+    orphan = {i: OutputScript.P2PKH(data['btc_addrs'][i]) for i in range(n)}
+    tx.sign(data['sks'], range(n), orphan=orphan)
+
+    return tx
+
+
+def sign_segwit_tx(data):
+    """ Builds and signs a transaction with SIGNED_INPUTS P2WPKH orphan inputs.
+
+    :param data: Benchmark inputs (from build_inputs).
+    :type data: dict
+    :return: The signed transaction.
+    :rtype: TX
+    """
+
+    n = SIGNED_INPUTS
+    tx = TX.build_from_io(data['prev_tx_ids'][:n], range(n), 1000, data['btc_addrs'][0])
+    orphan = {i: OutputScript.P2WPKH(hexlify(hash_160(data['pks'][i]))) for i in range(n)}
+    tx.sign(data['sks'], range(n), orphan=orphan, amounts={i: 2000 for i in range(n)})
+
+    return tx
+
+
+def get_benchmarks(data, dust_file):
+    """ Defines the benchmarks to be run, as a list of (name, callable, number of calls per repetition).
+
+    :param data: Benchmark inputs (from build_inputs).
+    :type data: dict
+    :param dust_file: Name of the file used to benchmark accumulate_dust_lm.
+    :type dust_file: str
+    :return: List of benchmarks.
+    :rtype: list
+    """
+
+    tx = data['tx']
+    hex_tx = data['hex_tx']
+    pk = data['pks'][0]
+    signed_tx = sign_tx(data)
+    orphan = {i: OutputScript.P2PKH(data['btc_addrs'][i]) for i in range(SIGNED_INPUTS)}
+
+    return [("decode_utxo", lambda: [decode_utxo(u) for u in UTXOS], 1000),
+            ("deobfuscate_value", lambda: [deobfuscate_value(OBFUSCATION_KEY, v) for v in data['o_values']], 1000),
+            ("b128_decode", lambda: [b128_decode(v) for v in data['b128']], 10000),
+            ("tx_deserialize", lambda: TX.deserialize(HEX_TX), 1000),
+            ("tx_deserialize_" + str(TX_INPUTS) + "_inputs", lambda: TX.deserialize(hex_tx), 50),
+            # The transaction caches its serialization (and id), so they are dropped to benchmark computing them.
+            ("tx_serialize_" + str(TX_INPUTS) + "_inputs", lambda: (tx.clear_cache(), tx.serialize()), 200),
+            ("tx_get_txid_" + str(TX_INPUTS) + "_inputs", lambda: (tx.clear_cache(), tx.get_txid()), 200),
+            ("tx_serialize_" + str(TX_INPUTS) + "_inputs_cached", lambda: tx.serialize(), 200),
+            ("tx_get_txid_" + str(TX_INPUTS) + "_inputs_cached", lambda: tx.get_txid(), 200),
+            ("block_check_merkle_root_" + str(BLOCK_TXS) + "_txs", lambda: data['block'].check_merkle_root(), 20),
+            ("tx_sign_" + str(SIGNED_INPUTS) + "_orphan_inputs", lambda: sign_tx(data), 1),
+            ("tx_sign_" + str(SIGNED_INPUTS) + "_p2wpkh_orphan_inputs", lambda: sign_segwit_tx(data), 1),
+            ("tx_verify_" + str(SIGNED_INPUTS) + "_orphan_inputs", lambda: signed_tx.verify(prevouts=orphan), 1),
+            ("script_serialize", lambda: Script.serialize(data['human_script']), 5000),
+            ("script_deserialize", lambda: Script.deserialize(data['hex_script']), 5000),
+            ("script_type", lambda: OutputScript.from_hex(data['hex_script']).type, 5000),
+            ("generate_keys", generate_keys, 200),
+            ("generate_keys_batch_100", lambda: generate_keys_batch(100), 5),
+            ("hash_160", lambda: hash_160(pk), 10000),
+            ("generate_btc_addr", lambda: generate_btc_addr(data['sks'][0].get_verifying_key()), 1000),
+            ("generate_btc_addr_batch_100", lambda: generate_btc_addr_batch(data['vks']), 10),
+            ("accumulate_dust_lm", lambda: accumulate_dust_lm(dust_file, fout_name=dust_file + ".out"), 1)]
+
+
+def run_benchmarks(selected=None, repeat=5):
+    """ Runs the benchmark suite.
+
+    :param selected: Names of the benchmarks to run (every benchmark is run by default).
+    :type selected: list of str
+    :param repeat: Number of times every benchmark is repeated (the best one is used for comparisons).
+    :type repeat: int
+    :return: The benchmark results.
+    :rtype: dict
+    """
+
+    data = build_inputs()
+    dust_file = "bench_parsed_utxos.txt"
+    write_dust_input(dust_file)
+
+    results = dict()
+    try:
+        for name, f, number in get_benchmarks(data, dust_file):
+            if selected and name not in selected:
+                continue
+            times = [t / number for t in Timer(f).repeat(repeat=repeat, number=number)]
+            results[name] = {"min": min(times), "mean": sum(times) / len(times), "max": max(times),
+                             "number": number, "repeat": repeat}
+    finally:
+        remove(CFG.data_path + dust_file)
+        try:
+            remove(CFG.data_path + dust_file + ".out")
+        except OSError:
+            pass
+
+    return {"python": python_version(), "benchmarks": results}
+
+
+def compare_results(results, baseline, tolerance=0.1):
+    """ Compares some benchmark results with a given baseline.
+
+    :param results: Current benchmark results (from run_benchmarks).
+    :type results: dict
+    :param baseline: Baseline benchmark results (from run_benchmarks).
+    :type baseline: dict
+    :param tolerance: Allowed slowdown ratio before a benchmark is considered a regression (0.1 means 10% slower).
+    :type tolerance: float
+    :return: Comparison for each benchmark present in both results, and the list of regressions.
+    :rtype: dict, list
+    """
+
+    comparison = dict()
+    regressions = []
+    for name, r in results["benchmarks"].items():
+        b = baseline["benchmarks"].get(name)
+        if b is None:
+            continue
+        ratio = r["min"] / b["min"]
+        comparison[name] = {"baseline": b["min"], "current": r["min"], "ratio": ratio}
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+
+    return comparison, sorted(regressions)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="bitcoin_tools benchmark suite.")
+    parser.add_argument("-o", "--output", help="File where the results will be stored (json).")
+    parser.add_argument("-b", "--baseline", help="Results file (json) to compare against.")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.1,
+                        help="Allowed slowdown ratio before reporting a regression (default 0.1).")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Repetitions per benchmark (default 5).")
+    parser.add_argument("benchmarks", nargs="*", help="Benchmarks to run (all of them by default).")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.benchmarks, args.repeat)
+
+    if args.baseline:
+        comparison, regressions = compare_results(results, load(open(args.baseline, 'r')), args.tolerance)
+        results["comparison"] = comparison
+        results["regressions"] = regressions
+
+    print dumps(results, indent=4, sort_keys=True)
+
+    if args.output:
+        fout = open(args.output, 'w')
+        fout.write(dumps(results, indent=4, sort_keys=True))
+        fout.close()
+
+    if args.baseline and results["regressions"]:
+        exit(1)
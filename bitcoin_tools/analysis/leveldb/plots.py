@@ -4,38 +4,26 @@ from json import loads
 
 from collections import Counter
 
-def plot_from_file(x_attribute, y="tx", xlabel=False, log_axis=False, save_fig=False, legend=None,
-                   legend_loc=1, font_size=20):
+YLABELS = {"tx": "Number of tx.", "utxo": "Number of UTXOs"}
+
+
+def get_cdf_from_file(x_attribute, y="tx"):
     """
-    Generates plots from utxo/tx data extracted from utxo_dump.
+    Computes the (normalized) cumulative distribution of a given attribute from the utxo/tx data extracted from
+    utxo_dump.
 
-    :param x_attribute: Attribute to plot (must be a key in the dictionary of the dumped data).
+    :param x_attribute: Attribute to compute the distribution of (must be a key in the dictionary of the dumped data).
     :type x_attribute: str
     :param y: Either "tx" or "utxo"
     :type y: str
-    :param xlabel: Label on the x axis
-    :type xlabel: str
-    :param log_axis: Determines which axis are plotted using (accepted values are False, "x", "y" or "xy").
-    logarithmic scale
-    :type log_axis: str
-    :param save_fig: Figure's filename or False (to show the interactive plot)
-    :type save_fig: str
-    :param legend: List of strings with legend entries or None (if no legend is needed)
-    :type legend: str list
-    :param legend_loc: Indicates the location of the legend (if present)
-    :type legend_loc: int
-    :param font_size: Title, xlabel and ylabel font size
-    :type font_size: int
-    :return: None
-    :rtype: None
+    :return: list of two lists: x values (unique values of the attribute) and cumulative (normalized) counts.
+    :rtype: list
     """
 
     if y == "tx":
         fin = open(CFG.data_path + 'parsed_txs.txt', 'r')
-        ylabel = "Number of tx."
     elif y == "utxo":
         fin = open(CFG.data_path + 'parsed_utxos.txt', 'r')
-        ylabel = "Number of UTXOs"
     else:
         raise ValueError('Unrecognized y value')
 
@@ -46,28 +34,47 @@ def plot_from_file(x_attribute, y="tx", xlabel=False, log_axis=False, save_fig=F
 
     fin.close()
 
-    [xs, ys] = get_cdf(samples, normalize=True)
-    title = ""
-    if not xlabel:
-        xlabel = x_attribute
+    return get_cdf(samples, normalize=True)
 
-    plot_distribution(xs, ys, title, xlabel, ylabel, log_axis, save_fig, legend, legend_loc, font_size)
 
+def count_from_file(x_attribute, y="tx"):
+    """
+    Counts the occurrences of every value of a given attribute in the utxo/tx data extracted from utxo_dump. The file is
+    streamed, so only the counts are kept in memory.
+
+    :param x_attribute: Attribute to count (must be a key in the dictionary of the dumped data).
+    :type x_attribute: str
+    :param y: Either "tx" or "utxo"
+    :type y: str
+    :return: Number of occurrences of every value.
+    :rtype: Counter
+    """
+
+    if y == "tx":
+        fin = open(CFG.data_path + 'parsed_txs.txt', 'r')
+    elif y == "utxo":
+        fin = open(CFG.data_path + 'parsed_utxos.txt', 'r')
+    else:
+        raise ValueError('Unrecognized y value')
+
+    ctr = Counter()
+    for line in fin:
+        ctr[loads(line[:-1])[x_attribute]] += 1
+
+    fin.close()
+
+    return ctr
 
-def plot_from_file_dict(x_attribute, y="dust", fin_name=None, percentage=False, xlabel=False,
-                        log_axis=False, save_fig=False, legend=None, legend_loc=1, font_size=20):
 
+def plot_from_file(x_attribute, y="tx", xlabel=False, log_axis=False, save_fig=False, legend=None,
+                   legend_loc=1, font_size=20):
     """
-    Generate plots from files in which the loaded data is a dictionary, such as dust.txt.
+    Generates plots from utxo/tx data extracted from utxo_dump.
 
     :param x_attribute: Attribute to plot (must be a key in the dictionary of the dumped data).
     :type x_attribute: str
     :param y: Either "tx" or "utxo"
     :type y: str
-    :param fin_name: Name of the file containing the data to be plotted.
-    :type fin_name: str
-    :param percentage: Whether the data is plot as percentage or not.
-    :type percentage: bool
     :param xlabel: Label on the x axis
     :type xlabel: str
     :param log_axis: Determines which axis are plotted using (accepted values are False, "x", "y" or "xy").
@@ -85,8 +92,32 @@ def plot_from_file_dict(x_attribute, y="dust", fin_name=None, percentage=False,
     :rtype: None
     """
 
+    [xs, ys] = get_cdf_from_file(x_attribute, y)
+    ylabel = YLABELS[y]
+    title = ""
+    if not xlabel:
+        xlabel = x_attribute
+
+    plot_distribution(xs, ys, title, xlabel, ylabel, log_axis, save_fig, legend, legend_loc, font_size)
+
+
+def get_series_from_file_dict(y="dust", fin_name=None, percentage=False):
+    """
+    Loads the dust / loss making series from files in which the loaded data is a dictionary, such as dust.txt.
+
+    :param y: Either "dust", "value" or "data_len"
+    :type y: str
+    :param fin_name: Name of the file containing the data to be plotted.
+    :type fin_name: str
+    :param percentage: Whether the data is returned as percentage or not.
+    :type percentage: bool
+    :return: x values and y values (one list for dust and one for loss making) and the corresponding y label.
+    :rtype: list, list, str
+    """
+
     fin = open(CFG.data_path + fin_name, 'r')
     data = loads(fin.read())
+    fin.close()
 
     # Decides the type of chart to be plot.
     if y == "dust":
@@ -120,10 +151,6 @@ def plot_from_file_dict(x_attribute, y="dust", fin_name=None, percentage=False,
         xs.append(sorted(data[i].keys(), key=int))
         ys.append(sorted(data[i].values(), key=int))
 
-    title = ""
-    if not xlabel:
-        xlabel = x_attribute
-
     # If percentage is set, a chart with y axis as a percentage (dividing every single y value by the
     # corresponding total value) is created.
     if percentage:
@@ -133,65 +160,119 @@ def plot_from_file_dict(x_attribute, y="dust", fin_name=None, percentage=False,
             elif isinstance(ys[i], int):
                 ys[i] = ys[i] / float(data[total]) * 100
 
-    # And finally plots the chart.
-    plot_distribution(xs, ys, title, xlabel, ylabel, log_axis, save_fig, legend, legend_loc, font_size)
+    return xs, ys, ylabel
 
 
-def plot_pie_chart_from_file(x_attribute, y="tx", title="", labels=[], groups=[], colors=[], save_fig=False, font_size=20):
+def plot_from_file_dict(x_attribute, y="dust", fin_name=None, percentage=False, xlabel=False,
+                        log_axis=False, save_fig=False, legend=None, legend_loc=1, font_size=20):
+
     """
-    Generates pie charts from UTXO/tx data extracted from utxo_dump.
+    Generate plots from files in which the loaded data is a dictionary, such as dust.txt.
 
     :param x_attribute: Attribute to plot (must be a key in the dictionary of the dumped data).
     :type x_attribute: str
     :param y: Either "tx" or "utxo"
     :type y: str
-    :param labels: List of labels (one label for each piece of the pie)
-    :type labels: str list
-    :param groups: List of group keys (one list for each piece of the pie).
-    :type groups: list of lists
-    :param colors: List of colors (one color for each piece of the pie)
-    :type colors: str lit
+    :param fin_name: Name of the file containing the data to be plotted.
+    :type fin_name: str
+    :param percentage: Whether the data is plot as percentage or not.
+    :type percentage: bool
+    :param xlabel: Label on the x axis
+    :type xlabel: str
+    :param log_axis: Determines which axis are plotted using (accepted values are False, "x", "y" or "xy").
+    logarithmic scale
+    :type log_axis: str
     :param save_fig: Figure's filename or False (to show the interactive plot)
     :type save_fig: str
+    :param legend: List of strings with legend entries or None (if no legend is needed)
+    :type legend: str list
+    :param legend_loc: Indicates the location of the legend (if present)
+    :type legend_loc: int
     :param font_size: Title, xlabel and ylabel font size
     :type font_size: int
     :return: None
     :rtype: None
     """
 
-    if y == "tx":
-        fin = open(CFG.data_path + 'parsed_txs.txt', 'r')
-        ylabel = "Number of tx."
-    elif y == "utxo":
-        fin = open(CFG.data_path + 'parsed_utxos.txt', 'r')
-        ylabel = "Number of UTXOs"
-    else:
-        raise ValueError('Unrecognized y value')
+    xs, ys, ylabel = get_series_from_file_dict(y, fin_name, percentage)
 
-    samples = []
-    for line in fin:
-        data = loads(line[:-1])
-        samples.append(data[x_attribute])
+    title = ""
+    if not xlabel:
+        xlabel = x_attribute
 
-    fin.close()
+    # And finally plots the chart.
+    plot_distribution(xs, ys, title, xlabel, ylabel, log_axis, save_fig, legend, legend_loc, font_size)
+
+
+def get_pie_values(counts, labels, groups):
+    """
+    Sums up the occurrences of the values that belong to each piece of a pie chart.
+
+    :param counts: Number of occurrences of every value, either as a dictionary or as an iterable of (value, count)
+    pairs.
+    :type counts: dict or iterable
+    :param labels: List of labels (one label for each piece of the pie). If there is one label more than groups, the
+    last piece is considered "others" (every value not included in any group).
+    :type labels: str list
+    :param groups: List of group keys (one list for each piece of the pie).
+    :type groups: list of lists
+    :return: The value of every piece of the pie.
+    :rtype: list
+    """
 
-    # Count occurences
-    ctr = Counter(samples)
+    if isinstance(counts, dict):
+        ctr = counts
+    else:
+        ctr = Counter()
+        for v, count in counts:
+            ctr[v] += count
 
-    # Sum occurences that belong to the same pie group
+    # Sum occurrences that belong to the same pie group
     values = []
     for group in groups:
-        group_value = 0
-        for v in group:
-            if v in ctr.keys():
-                group_value += ctr[v]
-        values.append(group_value)
+        values.append(sum([ctr.get(v, 0) for v in group]))
 
     # Should we have an "others" section?
     if len(labels) == len(groups) + 1:
         # We assume the last group is "others"
-        current_sum = sum(values)
-        values.append(len(samples)-current_sum)
+        values.append(sum(ctr.values()) - sum(values))
+
+    return values
+
+
+def plot_pie_chart_from_file(x_attribute, y="tx", title="", labels=[], groups=[], colors=[], save_fig=False, font_size=20,
+                             counts=None):
+    """
+    Generates pie charts from UTXO/tx data extracted from utxo_dump. The data file is streamed and only the count of
+    every value is kept, unless the counts are already provided (in which case the file is not read at all).
+
+    :param x_attribute: Attribute to plot (must be a key in the dictionary of the dumped data).
+    :type x_attribute: str
+    :param y: Either "tx" or "utxo"
+    :type y: str
+    :param labels: List of labels (one label for each piece of the pie)
+    :type labels: str list
+    :param groups: List of group keys (one list for each piece of the pie).
+    :type groups: list of lists
+    :param colors: List of colors (one color for each piece of the pie)
+    :type colors: str lit
+    :param save_fig: Figure's filename or False (to show the interactive plot)
+    :type save_fig: str
+    :param font_size: Title, xlabel and ylabel font size
+    :type font_size: int
+    :param counts: Precomputed number of occurrences of every value of x_attribute, either as a dictionary or as an
+    iterable of (value, count) pairs (e.g. the output of count_from_file or any other aggregation). If provided, the
+    data file is not read.
+    :type counts: dict or iterable
+    :return: None
+    :rtype: None
+    """
+
+    # Count occurrences (streaming the data file if counts have not been provided).
+    if counts is None:
+        counts = count_from_file(x_attribute, y)
+
+    values = get_pie_values(counts, labels, groups)
 
     plot_pie(values, labels, title, colors, save_fig=save_fig, font_size=font_size)
 
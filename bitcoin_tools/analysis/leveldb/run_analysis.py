@@ -1,6 +1,8 @@
 from data_dump import transaction_dump, utxo_dump
 from bitcoin_tools.analysis.leveldb.utils import parse_ldb, accumulate_dust_lm
-from bitcoin_tools.analysis.leveldb.plots import plot_from_file, plot_from_file_dict, plot_pie_chart_from_file
+from bitcoin_tools.analysis.leveldb.plots import get_cdf_from_file, get_series_from_file_dict, count_from_file, \
+    get_pie_values, YLABELS
+from bitcoin_tools.analysis.plots import render_figures
 
 # The following analysis reads/writes from/to large data files. Some of the steps can be ignored if those files have
 # already been created (if more updated data is not requited). Otherwise lot of time will be put in re-parsing large
@@ -21,45 +23,84 @@ utxo_dump(f_utxos, f_parsed_utxos)
 # Non-standard utxos can be parsed separately by setting the flag.
 utxo_dump(f_utxos, "parsed_non_std_utxos.txt", non_std_only=True)
 
+# Generate the dust accumulation file (if requited).
+accumulate_dust_lm(f_parsed_utxos, fout_name=f_dust)
+
+# Figures are rendered in batch (in parallel and without an interactive backend). First, all the data series are
+# computed (every attribute is read just once even if it is used in more than one figure), then every figure is defined
+# by a spec with the series to be used and the plot arguments. Figures whose spec and series have not changed since the
+# last run are not rendered again.
+series = dict()
+specs = []
+
+
+def cdf_spec(x_attribute, y="tx", xlabel=False, log_axis=False, save_fig=False):
+    name = y + "_" + x_attribute
+    if name not in series:
+        series[name] = get_cdf_from_file(x_attribute, y)
+    return {"kind": "distribution", "series": name, "title": "", "xlabel": xlabel if xlabel else x_attribute,
+            "ylabel": YLABELS[y], "log_axis": log_axis, "save_fig": save_fig}
+
+
+def dust_spec(x_attribute, y="dust", percentage=False, save_fig=False):
+    name = y + ("_perc" if percentage else "")
+    xs, ys, ylabel = get_series_from_file_dict(y, f_dust, percentage)
+    series[name] = (xs, ys)
+    return {"kind": "distribution", "series": name, "title": "", "xlabel": x_attribute, "ylabel": ylabel,
+            "save_fig": save_fig}
+
+
+def pie_spec(x_attribute, y="utxo", title="", labels=None, groups=None, colors=None, save_fig=False, font_size=20):
+    labels = labels if labels is not None else []
+    groups = groups if groups is not None else []
+    name = y + "_" + x_attribute + "_counts"
+    if name not in series:
+        series[name] = count_from_file(x_attribute, y)
+    # Pie values only depend on the counts, the groups and whether there is an "others" piece (see get_pie_values).
+    pie_name = name + "_pie_" + str(groups) + ("_others" if len(labels) > len(groups) else "")
+    series[pie_name] = get_pie_values(series[name], labels, groups)
+    return {"kind": "pie", "series": pie_name, "title": title, "labels": labels, "colors": colors,
+            "save_fig": save_fig, "font_size": font_size}
+
+
 # Generate plots from tx data (from f_parsed_txs)
-plot_from_file("height", save_fig="tx_height")
-plot_from_file("num_utxos", xlabel="Number of utxos per tx", save_fig="tx_num_utxos")
-plot_from_file("num_utxos", xlabel="Number of utxos per tx", log_axis="x", save_fig="tx_num_utxos_logx")
-plot_from_file("total_len", xlabel="Total length (bytes)", save_fig="tx_total_len")
-plot_from_file("total_len", xlabel="Total length (bytes)",  log_axis="x", save_fig="tx_total_len_logx")
-plot_from_file("version", save_fig="tx_version")
-plot_from_file("total_value", log_axis="x", save_fig="tx_total_value_logx")
+specs.append(cdf_spec("height", save_fig="tx_height"))
+specs.append(cdf_spec("num_utxos", xlabel="Number of utxos per tx", save_fig="tx_num_utxos"))
+specs.append(cdf_spec("num_utxos", xlabel="Number of utxos per tx", log_axis="x", save_fig="tx_num_utxos_logx"))
+specs.append(cdf_spec("total_len", xlabel="Total length (bytes)", save_fig="tx_total_len"))
+specs.append(cdf_spec("total_len", xlabel="Total length (bytes)",  log_axis="x", save_fig="tx_total_len_logx"))
+specs.append(cdf_spec("version", save_fig="tx_version"))
+specs.append(cdf_spec("total_value", log_axis="x", save_fig="tx_total_value_logx"))
 
 # Generate plots from utxo data (from f_parsec_utxos)
-plot_from_file("tx_height", y="utxo", save_fig="utxo_tx_height")
-plot_from_file("amount", y="utxo", log_axis="x", save_fig="utxo_amount_logx")
-plot_from_file("index", y="utxo", save_fig="utxo_index")
-plot_from_file("index", y="utxo", log_axis="x", save_fig="utxo_index_logx")
-plot_from_file("out_type", y="utxo", save_fig="utxo_out_type")
-plot_from_file("out_type", y="utxo", log_axis="x", save_fig="utxo_out_type_logx")
-plot_from_file("utxo_data_len", y="utxo", save_fig="utxo_utxo_data_len")
-plot_from_file("utxo_data_len", y="utxo", log_axis="x", save_fig="utxo_utxo_data_len_logx")
-
-plot_pie_chart_from_file("out_type", y="utxo", title="",
-                         labels=['C-even', 'C-odd', 'U-even', 'U-odd'], groups=[[2], [3], [4], [5]],
-                         colors=["#165873", "#428C5C", "#4EA64B", "#ADD96C"],
-                         save_fig="utxo_pk_types", font_size=20)
-
-plot_pie_chart_from_file("out_type", y="utxo", title="",
-                         labels=['P2PKH', 'P2PK', 'P2SH', 'Other'], groups=[[0], [2, 3, 4, 5], [1]],
-                         colors=["#165873", "#428C5C", "#4EA64B", "#ADD96C"],
-                         save_fig="utxo_types", font_size=20)
+specs.append(cdf_spec("tx_height", y="utxo", save_fig="utxo_tx_height"))
+specs.append(cdf_spec("amount", y="utxo", log_axis="x", save_fig="utxo_amount_logx"))
+specs.append(cdf_spec("index", y="utxo", save_fig="utxo_index"))
+specs.append(cdf_spec("index", y="utxo", log_axis="x", save_fig="utxo_index_logx"))
+specs.append(cdf_spec("out_type", y="utxo", save_fig="utxo_out_type"))
+specs.append(cdf_spec("out_type", y="utxo", log_axis="x", save_fig="utxo_out_type_logx"))
+specs.append(cdf_spec("utxo_data_len", y="utxo", save_fig="utxo_utxo_data_len"))
+specs.append(cdf_spec("utxo_data_len", y="utxo", log_axis="x", save_fig="utxo_utxo_data_len_logx"))
+
+specs.append(pie_spec("out_type", y="utxo", title="",
+                      labels=['C-even', 'C-odd', 'U-even', 'U-odd'], groups=[[2], [3], [4], [5]],
+                      colors=["#165873", "#428C5C", "#4EA64B", "#ADD96C"],
+                      save_fig="utxo_pk_types", font_size=20))
+
+specs.append(pie_spec("out_type", y="utxo", title="",
+                      labels=['P2PKH', 'P2PK', 'P2SH', 'Other'], groups=[[0], [2, 3, 4, 5], [1]],
+                      colors=["#165873", "#428C5C", "#4EA64B", "#ADD96C"],
+                      save_fig="utxo_types", font_size=20))
 
 # Generate plots for dust analysis (including percentage scale).
-# First, the dust accumulation file is generated (if requited).
-accumulate_dust_lm(f_parsed_utxos, fout_name=f_dust)
+specs.append(dust_spec("fee_per_byte", "dust", save_fig="dust_utxos"))
+specs.append(dust_spec("fee_per_byte", "dust", percentage=True, save_fig="perc_dust_utxos"))
 
-# Finally, we can plot the data.
-plot_from_file_dict("fee_per_byte", "dust", fin_name=f_dust, save_fig="dust_utxos")
-plot_from_file_dict("fee_per_byte", "dust", fin_name=f_dust, percentage=True, save_fig="perc_dust_utxos")
+specs.append(dust_spec("fee_per_byte", "value", save_fig="dust_value"))
+specs.append(dust_spec("fee_per_byte", "value", percentage=True, save_fig="perc_dust_value"))
 
-plot_from_file_dict("fee_per_byte", "value", fin_name=f_dust, save_fig="dust_value")
-plot_from_file_dict("fee_per_byte", "value", fin_name=f_dust, percentage=True, save_fig="perc_dust_value")
+specs.append(dust_spec("fee_per_byte", "data_len", save_fig="dust_data_len"))
+specs.append(dust_spec("fee_per_byte", "data_len", percentage=True, save_fig="perc_dust_data_len"))
 
-plot_from_file_dict("fee_per_byte", "data_len", fin_name=f_dust, save_fig="dust_data_len")
-plot_from_file_dict("fee_per_byte", "data_len", fin_name=f_dust, percentage=True, save_fig="perc_dust_data_len")
\ No newline at end of file
+# Finally, all the figures are rendered.
+render_figures(specs, series)
@@ -5,8 +5,15 @@ from math import ceil
 from copy import deepcopy
 from json import loads
 from bitcoin_tools.analysis.leveldb import *
+from bitcoin_tools.core.keys import decompress_pk
+from bitcoin_tools.core.prevouts import get_outpoint_key, encode_prevout
+from bitcoin_tools.core.script import match_output_script
+from bitcoin_tools.profiling import region
 from bitcoin_tools.utils import change_endianness, txout_decompress
 
+# Number of prevouts written at once while building the local prevout store (see build_prevout_store).
+BATCH_SIZE = 100000
+
 
 def b128_encode(n):
     """ Performs the MSB base-128 encoding of a given value. Used to store variable integers (varints) in the LevelDB.
@@ -254,6 +261,26 @@ def display_decoded_utxo(decoded_utxo):
     print "Block height: " + str(decoded_utxo['height'])
 
 
+def deobfuscate_value(o_key, o_value):
+    """ Removes the obfuscation of a value read from the chainstate LevelDB.
+
+    UTXOs are obfuscated using the obfuscation key (o_key), in order to get them non-obfuscated, a XOR between the
+    value and the key (concatenated until the length of the value is reached) if performed).
+
+    :param o_key: Obfuscation key, as stored in the chainstate (without the leading length byte).
+    :type o_key: hex str
+    :param o_value: Obfuscated value, as read from the LevelDB.
+    :type o_value: bytes
+    :return: The non-obfuscated value.
+    :rtype: hex str
+    """
+
+    value = "".join([format(int(v, 16) ^ int(o_key[i % len(o_key)], 16), 'x') for i, v in enumerate(hexlify(o_value))])
+    assert len(hexlify(o_value)) == len(value)
+
+    return value
+
+
 def parse_ldb(fout_name):
     """
     Parsed data from the chainstate LevelDB and stores it in a output file.
@@ -279,11 +306,9 @@ def parse_ldb(fout_name):
         o_key = "0000000000000000"
 
     # For every UTXO (identified with a leading 'c'), the key (tx_id) and the value (encoded utxo) is displayed.
-    # UTXOs are obfuscated using the obfuscation key (o_key), in order to get them non-obfuscated, a XOR between the
-    # value and the key (concatenated until the length of the value is reached) if performed).
     for key, o_value in db.iterator(prefix=b'c'):
-        value = "".join([format(int(v, 16) ^ int(o_key[i % len(o_key)], 16), 'x') for i, v in enumerate(hexlify(o_value))])
-        assert len(hexlify(o_value)) == len(value)
+        with region("deobfuscate"):
+            value = deobfuscate_value(o_key, o_value)
         fout.write(dumps({"key":  hexlify(key), "value": value}) + "\n")
 
     db.close()
@@ -320,19 +345,20 @@ def accumulate_dust_lm(fin_name, fout_name="dust.txt"):
     for line in fin:
         data = loads(line[:-1])
 
-        for fee_per_byte in range(MIN_FEE_PER_BYTE, MAX_FEE_PER_BYTE, FEE_STEP):
-            if fee_per_byte >= data["dust"] != 0:
-                dust[str(fee_per_byte)] += 1
-                value_dust[str(fee_per_byte)] += data["amount"]
-                data_len_dust[str(fee_per_byte)] += data["utxo_data_len"]
-            if fee_per_byte >= data["loss_making"] != 0:
-                lm[str(fee_per_byte)] += 1
-                value_lm[str(fee_per_byte)] += data["amount"]
-                data_len_lm[str(fee_per_byte)] += data["utxo_data_len"]
-
-        total_utxo = total_utxo + 1
-        total_value += data["amount"]
-        total_data_len += data["utxo_data_len"]
+        with region("aggregate"):
+            for fee_per_byte in range(MIN_FEE_PER_BYTE, MAX_FEE_PER_BYTE, FEE_STEP):
+                if fee_per_byte >= data["dust"] != 0:
+                    dust[str(fee_per_byte)] += 1
+                    value_dust[str(fee_per_byte)] += data["amount"]
+                    data_len_dust[str(fee_per_byte)] += data["utxo_data_len"]
+                if fee_per_byte >= data["loss_making"] != 0:
+                    lm[str(fee_per_byte)] += 1
+                    value_lm[str(fee_per_byte)] += data["amount"]
+                    data_len_lm[str(fee_per_byte)] += data["utxo_data_len"]
+
+            total_utxo = total_utxo + 1
+            total_value += data["amount"]
+            total_data_len += data["utxo_data_len"]
 
     fin.close()
 
@@ -450,3 +476,71 @@ def get_min_input_size(out, height, count_p2sh=False):
     var_size = scriptSig_len + scriptSig
 
     return fixed_size + var_size
+
+
+def decompress_script(out_type, data):
+    """ Rebuilds the ScriptPubKey of an output decoded from the chainstate (see decode_utxo), which is stored compressed
+    for the most common script types.
+
+    :param out_type: Output type, as found in the chainstate (0-5 special scripts, otherwise the script size + 6).
+    :type out_type: int
+    :param data: Output data (hash160 / public key / whole script, depending on the type).
+    :type data: hex str
+    :return: The ScriptPubKey and its type.
+    :rtype: hex str, str
+    """
+
+    if out_type == 0:
+        return "76a914" + data + "88ac", "P2PKH"
+    elif out_type == 1:
+        return "a914" + data + "87", "P2SH"
+    elif out_type in [2, 3]:
+        return "21" + data + "ac", "P2PK"
+    elif out_type in [4, 5]:
+        # Uncompressed public keys are stored compressed, with 4 and 5 as prefix (instead of 2 and 3).
+        return "41" + decompress_pk("0" + str(out_type - 2) + data[2:]) + "ac", "P2PK"
+    elif check_multisig(data) or check_multisig(data, std=False):
+        return data, "P2MS"
+    else:
+        # Witness programs are not compressed, so they are matched from the whole script.
+        out_type = match_output_script(unhexlify(data))[0]
+        return data, out_type if out_type in ["P2WPKH", "P2WSH"] else "unknown"
+
+
+def build_prevout_store(fin_name, db_path=None):
+    """ Builds the local prevout store (used by core.prevouts.LocalResolver) from the UTXOs dumped from the chainstate
+    (see parse_ldb).
+
+    :param fin_name: Name of the file (in the data path) with the dumped chainstate.
+    :type fin_name: str
+    :param db_path: Path to the prevout store. CFG.data_path + "prevouts" by default.
+    :type db_path: str
+    :return: Number of stored prevouts.
+    :rtype: int
+    """
+
+    if db_path is None:
+        db_path = CFG.data_path + "prevouts"
+
+    db = plyvel.DB(db_path, create_if_missing=True)
+    wb = db.write_batch()
+
+    n = 0
+    fin = open(CFG.data_path + fin_name, 'r')
+    for line in fin:
+        data = loads(line[:-1])
+        # Keys are made of a leading 'c' followed by the transaction id (LE).
+        tx_id = change_endianness(data["key"][2:])
+        for out in decode_utxo(data["value"])["outs"]:
+            wb.put(get_outpoint_key(tx_id, out["index"]), encode_prevout(*decompress_script(out["out_type"],
+                                                                                            out["data"])))
+            n += 1
+            if n % BATCH_SIZE == 0:
+                wb.write()
+                wb = db.write_batch()
+    fin.close()
+
+    wb.write()
+    db.close()
+
+    return n
@@ -1,13 +1,21 @@
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import numpy as np
+from hashlib import sha1
+from json import dumps, loads
+from multiprocessing import Pool
+from os import path
 from bitcoin_tools import CFG
+from bitcoin_tools.profiling import profiled
 
 label_size = 12
 mpl.rcParams['xtick.labelsize'] = label_size
 mpl.rcParams['ytick.labelsize'] = label_size
 mpl.rcParams['legend.numpoints'] = 1
 
+# Maximum number of points of every plotted series. Larger series are reduced (preserving their shape) before plotting.
+MAX_PLOT_POINTS = 2000
+
 
 def get_counts(samples, normalize=False):
     """
@@ -44,8 +52,72 @@ def get_cdf(samples, normalize=False):
     return [xs, ys]
 
 
+def reduce_series(xs, ys, max_points=MAX_PLOT_POINTS, log_axis=False):
+    """
+    Reduces a series (xs, ys) to, at most, max_points points, preserving its shape. Only numeric and sorted xs
+    (such as the output of get_cdf) are reduced, any other series is returned untouched.
+
+    If the x axis is plotted using a logarithmic scale, points are picked at log-spaced x values (every chosen point
+    belongs to the original series), and points with x <= 0 (that can't be shown on such axis) are dropped.
+    Otherwise, the Largest-Triangle-Three-Buckets algorithm is used: the series is split in max_points - 2 buckets and
+    the point of each bucket that forms the largest triangle with the previous chosen point and the average of the next
+    bucket is kept. First and last points are always kept.
+
+    :param xs: x values (sorted).
+    :type xs: list or numpy array
+    :param ys: y values.
+    :type ys: list or numpy array
+    :param max_points: Maximum number of points of the reduced series (at least 3, so some point is kept along with the
+    first and last ones). None means no reduction.
+    :type max_points: int
+    :param log_axis: Which axis are plotted using logarithmic scale (False, "x", "y" or "xy").
+    :type log_axis: str
+    :return: The reduced series.
+    :rtype: numpy array, numpy array
+    """
+
+    xs = np.asarray(xs)
+    ys = np.asarray(ys)
+
+    if max_points is None or len(xs) <= max(max_points, 3) or xs.dtype.kind not in "iuf" or \
+            ys.dtype.kind not in "iuf":
+        return xs, ys
+    max_points = max(max_points, 3)
+
+    x = xs.astype(float)
+    y = ys.astype(float)
+
+    if log_axis in ["x", "xy"] and x[-1] > 0:
+        # Log-spaced resampling of the positive part of the series: for every point of the log grid, the last point of
+        # the series at or before it is chosen.
+        first = int(np.searchsorted(x, 0, side='right'))
+        grid = np.logspace(np.log10(x[first]), np.log10(x[-1]), max_points)
+        idx = np.unique(np.concatenate(([first], np.searchsorted(x, grid, side='right') - 1, [len(x) - 1])))
+    else:
+        # Largest-Triangle-Three-Buckets
+        every = (len(x) - 2) / float(max_points - 2)
+        idx = np.zeros(max_points, dtype=int)
+        a = 0
+        for i in range(max_points - 2):
+            start = int(i * every) + 1
+            end = int((i + 1) * every) + 1
+            next_end = min(int((i + 2) * every) + 1, len(x))
+
+            avg_x = x[end:next_end].mean()
+            avg_y = y[end:next_end].mean()
+            area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+
+            a = start + int(np.argmax(area))
+            idx[i + 1] = a
+
+        idx[-1] = len(x) - 1
+
+    return xs[idx], ys[idx]
+
+
+@profiled("plot")
 def plot_distribution(xs, ys, title, xlabel, ylabel, log_axis=False, save_fig=False, legend=None, legend_loc=1,
-                      font_size=20):
+                      font_size=20, max_points=MAX_PLOT_POINTS):
     """
     Plots a set of values (xs, ys) with matplotlib.
 
@@ -61,17 +133,21 @@ def plot_distribution(xs, ys, title, xlabel, ylabel, log_axis=False, save_fig=Fa
     :param legend: list of strings with legend entries or None (if no legend is needed)
     :param legend_loc: integer, indicates the location of the legend (if present)
     :param font_size: integer, title, xlabel and ylabel font size
+    :param max_points: integer, maximum number of points plotted per sample set. Larger sets are reduced (preserving
+    their shape) using reduce_series. None to plot every single point.
     """
 
-    plt.figure()
+    fig = plt.figure()
     ax = plt.subplot(111)
 
     # Plot data
     if not isinstance(xs[0], list):
+        xs, ys = reduce_series(xs, ys, max_points, log_axis)
         plt.plot(xs, ys)  # marker='o'
     else:
         for i in range(len(xs)):
-            plt.plot(xs[i], ys[i], ' ', linestyle='solid')  # marker='o'
+            x, y = reduce_series(xs[i], ys[i], max_points, log_axis)
+            plt.plot(x, y, ' ', linestyle='solid')  # marker='o'
 
     # Plot title and xy labels
     plt.title(title, {'color': 'k', 'fontsize': font_size})
@@ -96,7 +172,11 @@ def plot_distribution(xs, ys, title, xlabel, ylabel, log_axis=False, save_fig=Fa
     else:
         plt.show()
 
+    # Figures are closed once done, otherwise they are kept in memory by pyplot.
+    plt.close(fig)
+
 
+@profiled("plot")
 def plot_pie(values, labels, title, colors, save_fig=False, font_size=20):
     """
     Plots a set of values in a pie chart with matplotlib.
@@ -113,7 +193,7 @@ def plot_pie(values, labels, title, colors, save_fig=False, font_size=20):
     :param font_size: integer, title, xlabel and ylabel font size
     """
 
-    plt.figure()
+    fig = plt.figure()
     ax = plt.subplot(111)
 
     ax.pie(values, labels=labels, colors=colors,
@@ -128,4 +208,143 @@ def plot_pie(values, labels, title, colors, save_fig=False, font_size=20):
     if save_fig:
         plt.savefig(CFG.figs_path + save_fig + '.pdf', format='pdf', dpi=600)
     else:
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+    # Figures are closed once done, otherwise they are kept in memory by pyplot.
+    plt.close(fig)
+
+
+def get_series_hash(spec, data):
+    """
+    Computes the hash of a figure specification together with the data series it is plotted from. Used to identify
+    which figures have changed since the last time they were rendered.
+
+    :param spec: Figure specification (see render_figures).
+    :type spec: dict
+    :param data: Data series of the figure: either a (xs, ys) pair for distributions, or a list of values for pies.
+    :type data: tuple or list
+    :return: The hash of the figure.
+    :rtype: hex str
+    """
+
+    h = sha1(dumps(spec, sort_keys=True))
+
+    def update(d):
+        if isinstance(d, (list, tuple)) and len(d) > 0 and isinstance(d[0], (list, tuple, np.ndarray)):
+            for e in d:
+                update(e)
+        else:
+            a = np.asarray(d)
+            h.update(str(a.dtype) + str(a.shape))
+            h.update(a.tostring())
+
+    update(data)
+
+    return h.hexdigest()
+
+
+def _init_render_worker():
+    """
+    Initializes a rendering process, setting the non-interactive Agg backend.
+    """
+
+    plt.switch_backend('Agg')
+
+
+def _render_figure(task):
+    """
+    Renders a single figure from a rendering task (kind, data, plot arguments).
+
+    :param task: Rendering task.
+    :type task: tuple
+    :return: The name of the rendered figure.
+    :rtype: str
+    """
+
+    kind, data, kwargs = task
+
+    if kind == "distribution":
+        plot_distribution(data[0], data[1], **kwargs)
+    else:
+        plot_pie(data, **kwargs)
+
+    return kwargs["save_fig"]
+
+
+def render_figures(specs, series, processes=None, force=False):
+    """
+    Renders a batch of figures in parallel (using a process pool) with the non-interactive Agg backend. Figures whose
+    specification and input series have not changed since the last run (and whose output file still exists) are
+    skipped.
+
+    Every figure specification is a dictionary containing the kind of figure ("distribution" or "pie"), the name of the
+    series to be plotted (key in series) and the arguments of the corresponding plot function (plot_distribution or
+    plot_pie). save_fig is mandatory (and unique).
+
+    e.g:
+        specs = [{"kind": "distribution", "series": "height", "title": "", "xlabel": "height", "ylabel": "Number of tx.",
+                  "save_fig": "tx_height"},
+                 {"kind": "pie", "series": "types", "title": "", "labels": ["P2PKH", "P2PK"], "colors": None,
+                  "save_fig": "utxo_types"}]
+        series = {"height": get_cdf(heights, normalize=True), "types": [10, 20]}
+
+    :param specs: List of figure specifications.
+    :type specs: list of dict
+    :param series: Precomputed data series, either (xs, ys) for distributions or a list of values for pies.
+    :type series: dict
+    :param processes: Number of worker processes (number of cpus by default). If set to 1, figures are rendered in the
+    current process.
+    :type processes: int
+    :param force: Whether to render every figure, even if it has not changed.
+    :type force: bool
+    :return: The names of the rendered figures.
+    :rtype: list
+    """
+
+    # Hashes of the last rendered version of each figure.
+    cache_file = CFG.figs_path + ".render_cache.json"
+    cache = loads(open(cache_file, 'r').read()) if path.isfile(cache_file) else dict()
+
+    tasks = []
+    hashes = dict()
+    for spec in specs:
+        kwargs = {k: v for k, v in spec.items() if k not in ["kind", "series"]}
+        if spec["kind"] not in ["distribution", "pie"]:
+            raise Exception("Unrecognized figure kind: " + str(spec["kind"]))
+        elif not kwargs.get("save_fig"):
+            raise Exception("Figures rendered in batch must set save_fig.")
+
+        name = kwargs["save_fig"]
+        if name in hashes:
+            # Figures are cached (and saved) by name.
+            raise Exception("Figures rendered in batch must have different save_fig names: " + name)
+        data = series[spec["series"]]
+        hashes[name] = get_series_hash(spec, data)
+
+        if force or cache.get(name) != hashes[name] or not path.isfile(CFG.figs_path + name + '.pdf'):
+            tasks.append((spec["kind"], data, kwargs))
+
+    if processes == 1:
+        # The caller's backend (e.g. an interactive one) is restored once the figures are rendered.
+        backend = mpl.get_backend()
+        _init_render_worker()
+        try:
+            rendered = map(_render_figure, tasks)
+        finally:
+            plt.switch_backend(backend)
+    else:
+        pool = Pool(processes, initializer=_init_render_worker)
+        try:
+            rendered = pool.map(_render_figure, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    # Finally, the cache is updated with the figures that have been rendered.
+    for name in rendered:
+        cache[name] = hashes[name]
+    fout = open(cache_file, 'w')
+    fout.write(dumps(cache))
+    fout.close()
+
+    return rendered
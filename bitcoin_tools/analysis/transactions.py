@@ -0,0 +1,217 @@
+from binascii import hexlify, unhexlify
+from collections import deque
+from itertools import islice
+from json import dumps
+from mmap import mmap, ACCESS_READ
+from multiprocessing import Pool, cpu_count
+from struct import error as struct_error
+
+from bitcoin_tools import CFG
+from bitcoin_tools.core.hashing import double_sha256, strip_witness
+from bitcoin_tools.core.transaction import TX
+from bitcoin_tools.profiling import region
+from bitcoin_tools.utils import Reader, skip_tx
+
+# Number of transactions sent to a worker at once. Bigger chunks reduce the inter-process communication overhead, at the
+# cost of a higher memory usage.
+CHUNK_SIZE = 500
+
+# Number of chunks (per worker) that can be sent to the workers and not yet consumed. It bounds how far ahead of the
+# consumer the input is read.
+PENDING_CHUNKS = 2
+
+
+def get_tx_summary(raw_tx):
+    """ Builds a compact summary of a (binary) serialized transaction.
+
+    :param raw_tx: Serialized transaction.
+    :type raw_tx: bytes
+    :return: Transaction summary: transaction id (BE, as shown by block explorers), size, version, number of inputs and
+    outputs, and type and value of every output.
+    :rtype: dict
+    """
+
+    tx = TX.from_bytes(raw_tx)
+
+    # The id is computed straight from the given bytes (with no witness data, see strip_witness), so the transaction
+    # is not serialized again.
+    return {"txid": hexlify(double_sha256(strip_witness(raw_tx))[::-1]),
+            "size": len(raw_tx),
+            "version": tx.version,
+            "inputs": tx.inputs,
+            "outputs": tx.outputs,
+            "values": list(tx.value),
+            "output_types": [script.type for script in tx.scriptPubKey]}
+
+
+def _summarize_chunk(args):
+    """ Decodes a chunk of serialized transactions. Used by decode_txs workers. Only the summaries are sent back to the
+    parent process (instead of the full TX objects).
+
+    :param args: List of serialized transactions and whether they are binary or hex encoded.
+    :type args: tuple
+    :return: List of summaries, in the same order as the given transactions.
+    :rtype: list of dict
+    """
+
+    chunk, binary = args
+
+    with region("decode"):
+        if binary:
+            return [get_tx_summary(raw_tx) for raw_tx in chunk]
+        else:
+            return [get_tx_summary(unhexlify(hex_tx)) for hex_tx in chunk]
+
+
+def _get_chunks(txs, binary, chunk_size):
+    """ Splits an iterable of transactions into chunks.
+
+    :param txs: Serialized transactions.
+    :type txs: iterable
+    :param binary: Whether transactions are binary or hex encoded.
+    :type binary: bool
+    :param chunk_size: Number of transactions per chunk.
+    :type chunk_size: int
+    :return: Generator of chunks (ready to be sent to _summarize_chunk).
+    :rtype: generator
+    """
+
+    txs = iter(txs)
+    while True:
+        chunk = list(islice(txs, chunk_size))
+        if not chunk:
+            break
+        yield chunk, binary
+
+
+def decode_txs(txs, binary=False, processes=None, chunk_size=CHUNK_SIZE):
+    """ Decodes a (possibly huge) number of serialized transactions in parallel, using a pool of processes. Transactions
+    are sent to the workers in chunks, and only a compact summary of every transaction is sent back (see
+    get_tx_summary). The given iterable is consumed lazily (no more than PENDING_CHUNKS chunks per worker are read
+    ahead of the consumer), so it can be as large as needed.
+
+    :param txs: Serialized transactions.
+    :type txs: iterable of hex str or bytes
+    :param binary: Whether transactions are binary (True) or hex encoded (False).
+    :type binary: bool
+    :param processes: Number of worker processes (number of cpus by default). If set to 1, transactions are decoded in
+    the calling process.
+    :type processes: int
+    :param chunk_size: Number of transactions sent to a worker at once.
+    :type chunk_size: int
+    :return: Generator of transaction summaries, in the same order as the given transactions.
+    :rtype: generator of dict
+    """
+
+    chunks = _get_chunks(txs, binary, chunk_size)
+
+    if processes == 1:
+        for chunk in chunks:
+            for summary in _summarize_chunk(chunk):
+                yield summary
+    else:
+        if processes is None:
+            processes = cpu_count()
+        pool = Pool(processes)
+        pending = deque()
+        try:
+            # Pool.imap would read the whole input as fast as it can, so chunks are only sent to the workers as the
+            # results of the previous ones are consumed.
+            for chunk in chunks:
+                pending.append(pool.apply_async(_summarize_chunk, (chunk,)))
+                if len(pending) >= PENDING_CHUNKS * processes:
+                    for summary in pending.popleft().get():
+                        yield summary
+            while pending:
+                for summary in pending.popleft().get():
+                    yield summary
+        finally:
+            pool.close()
+            pool.join()
+
+
+def _get_tx_size(data, offset):
+    """ Computes the size of a serialized transaction starting at a given offset, skipping over its fields (without
+    decoding them).
+
+    :param data: Buffer containing the serialized transaction.
+    :type data: memoryview
+    :param offset: Offset of the buffer where the transaction starts.
+    :type offset: int
+    :return: The size of the transaction.
+    :rtype: int
+    """
+
+    reader = Reader(data, offset)
+    skip_tx(reader)
+
+    return reader.offset - offset
+
+
+def read_raw_txs(fin_name, binary=False):
+    """ Reads serialized transactions from a file in the data dir. Hex encoded transactions are expected one per line,
+    while binary ones are expected one right after the other (with no separator, as in a block).
+
+    :param fin_name: Input file name.
+    :type fin_name: str
+    :param binary: Whether transactions are binary (True) or hex encoded (False).
+    :type binary: bool
+    :return: Generator of serialized transactions.
+    :rtype: generator of hex str or bytes
+    """
+
+    fin = open(CFG.data_path + fin_name, 'rb' if binary else 'r')
+
+    if binary:
+        try:
+            data = mmap(fin.fileno(), 0, access=ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped.
+            fin.close()
+            return
+        reader = Reader(buffer(data))
+        while reader.remaining():
+            offset = reader.offset
+            try:
+                size = _get_tx_size(reader.data, offset)
+            except struct_error:
+                raise Exception("There is some error in the serialized transaction found at offset " + str(offset) +
+                                " of " + fin_name)
+            yield reader.read_bytes(size)
+    else:
+        for line in fin:
+            line = line.strip()
+            if line:
+                yield line
+
+    fin.close()
+
+
+def tx_dump(fin_name, fout_name, binary=False, processes=None, chunk_size=CHUNK_SIZE):
+    """ Decodes all the transactions in a file (see read_raw_txs) and stores their summaries (see get_tx_summary), one
+    json per line and in the same order, in the output file.
+
+    :param fin_name: Input file name (in the data dir).
+    :type fin_name: str
+    :param fout_name: Output file name (in the data dir).
+    :type fout_name: str
+    :param binary: Whether transactions are binary (True) or hex encoded (False).
+    :type binary: bool
+    :param processes: Number of worker processes (number of cpus by default).
+    :type processes: int
+    :param chunk_size: Number of transactions sent to a worker at once.
+    :type chunk_size: int
+    :return: Number of decoded transactions.
+    :rtype: int
+    """
+
+    fout = open(CFG.data_path + fout_name, 'w')
+
+    n = 0
+    for summary in decode_txs(read_raw_txs(fin_name, binary), binary, processes, chunk_size):
+        fout.write(dumps(summary) + '\n')
+        n += 1
+
+    fout.close()
+
+    return n
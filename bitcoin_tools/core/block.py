@@ -0,0 +1,422 @@
+from binascii import hexlify, unhexlify
+from glob import glob
+from json import dumps
+from mmap import mmap, ACCESS_READ
+from multiprocessing import Pool
+from os import path
+from struct import error as struct_error
+
+from bitcoin_tools import CFG
+from bitcoin_tools.core.hashing import double_sha256, double_sha256_batch, merkle_root
+from bitcoin_tools.core.transaction import TX
+from bitcoin_tools.utils import Reader, skip_tx
+
+# Network magic bytes, leading every block stored in the block files (blk*.dat).
+MAINNET_MAGIC = unhexlify("f9beb4d9")
+TESTNET_MAGIC = unhexlify("0b110907")
+REGTEST_MAGIC = unhexlify("fabfb5da")
+
+HEADER_SIZE = 80
+
+
+class BlockHeader:
+    """ Defines a class BlockHeader that holds all the fields of a Bitcoin block header (version, previous block hash,
+    merkle root, time, bits and nonce).
+    """
+
+    def __init__(self):
+        self.version = None
+        self.prev_block_hash = None
+        self.merkle_root = None
+        self.time = None
+        self.bits = None
+        self.nonce = None
+
+        self.raw = None
+
+    @classmethod
+    def from_bytes(cls, raw, offset=0):
+        """ Builds a block header from its binary serialization (80 bytes).
+
+        :param raw: Buffer containing the serialized header.
+        :type raw: bytes or memoryview
+        :param offset: Offset of the buffer where the header starts.
+        :type offset: int
+        :return: The block header.
+        :rtype: BlockHeader
+        """
+
+        reader = Reader(raw, offset)
+        if reader.remaining() < HEADER_SIZE:
+            raise Exception("Wrong block header length: " + str(max(reader.remaining(), 0)))
+
+        return cls.read(reader)
+
+    @classmethod
+    def read(cls, reader):
+        """ Reads a block header from a reader, leaving it right after the header.
+
+        :param reader: Reader positioned where the header starts.
+        :type reader: Reader
+        :return: The block header.
+        :rtype: BlockHeader
+        """
+
+        header = cls()
+        start = reader.offset
+
+        try:
+            header.version = reader.read_uint32()
+            # Hashes are stored in BE (the same way as prev_tx_id in transactions).
+            header.prev_block_hash = hexlify(reader.read_bytes(32)[::-1])
+            header.merkle_root = hexlify(reader.read_bytes(32)[::-1])
+            header.time = reader.read_uint32()
+            header.bits = reader.read_uint32()
+            header.nonce = reader.read_uint32()
+        except struct_error:
+            raise Exception("Wrong block header length: " + str(reader.size - start))
+
+        header.raw = reader.data[start:reader.offset].tobytes()
+
+        return header
+
+    def get_hash(self, rtype=hex, endianness="LE"):
+        """ Computes the block hash (double-sha256 of the serialized header).
+
+        :param rtype: Defines the type of return, either hex str or bytes.
+        :type rtype: str or bin
+        :param endianness: Whether the hash is returned in BE (Big endian) or LE (Little Endian) (default one)
+        :type endianness: str
+        :return: The hash of the block.
+        :rtype: hex str or bin, depending on rtype parameter.
+        """
+
+        if rtype not in [hex, bin]:
+            raise Exception("Invalid return type (rtype). It should be either hex or bin.")
+        if endianness not in ["BE", "LE"]:
+            raise Exception("Invalid endianness type. It should be either BE or LE.")
+
+        block_hash = double_sha256(self.raw)
+        if endianness == "BE":
+            block_hash = block_hash[::-1]
+
+        return hexlify(block_hash) if rtype is hex else block_hash
+
+
+class Block:
+    """ Defines a class Block, built from a serialized block (e.g. read from a block file). Transactions are not parsed
+    when the block is built but lazily, while iterating over them.
+    """
+
+    def __init__(self, raw, file_name=None, offset=None):
+        """
+        :param raw: Serialized block (header + transactions).
+        :type raw: bytes or memoryview
+        :param file_name: Block file where the block is stored (if read from disk).
+        :type file_name: str
+        :param offset: Offset of the block within the block file (position of the network magic).
+        :type offset: int
+        """
+
+        self.raw = memoryview(raw)
+        self.file_name = file_name
+        self.offset = offset
+
+        reader = Reader(self.raw)
+        self.header = BlockHeader.read(reader)
+        self.tx_count = reader.read_varint()
+        self.tx_offset = reader.offset
+
+    def get_hash(self, rtype=hex, endianness="LE"):
+        """ Computes the block hash. See BlockHeader.get_hash.
+        """
+
+        return self.header.get_hash(rtype, endianness)
+
+    def iter_txs(self):
+        """ Parses the transactions of the block one by one.
+
+        :return: Generator of transactions.
+        :rtype: generator of TX
+        """
+
+        reader = Reader(self.raw, self.tx_offset)
+        for i in range(self.tx_count):
+            yield TX.read(reader)
+
+        if reader.remaining():
+            raise Exception("There is some error in the serialized block. " + str(reader.remaining()) +
+                            " bytes remain unparsed.")
+
+    def get_txs(self):
+        """ Parses all the transactions of the block.
+
+        :return: List of transactions.
+        :rtype: list of TX
+        """
+
+        return list(self.iter_txs())
+
+    def get_txids(self, rtype=hex, endianness="LE"):
+        """ Computes the ids of all the transactions of the block, all at once and with no need to decode them (see
+        hashing.get_txids).
+
+        :param rtype: Defines the type of return, either hex str or bytes.
+        :type rtype: str or bin
+        :param endianness: Whether the ids are returned in BE (Big endian) or LE (Little Endian) (default one)
+        :type endianness: str
+        :return: The id of every transaction of the block, in the same order.
+        :rtype: list of hex str or bin, depending on rtype parameter.
+        """
+
+        if rtype not in [hex, bin]:
+            raise Exception("Invalid return type (rtype). It should be either hex or bin.")
+        if endianness not in ["BE", "LE"]:
+            raise Exception("Invalid endianness type. It should be either BE or LE.")
+
+        # Legacy transactions are hashed straight from the block buffer, while the witness-free serialization of segwit
+        # ones has to be built.
+        data = []
+        reader = Reader(self.raw, self.tx_offset)
+        try:
+            for i in range(self.tx_count):
+                start = reader.offset
+                segwit = skip_tx(reader)
+                if segwit is None:
+                    data.append(self.raw[start:reader.offset])
+                else:
+                    data.append(self.raw[start:start + 4].tobytes() + self.raw[segwit[0]:segwit[1]].tobytes() +
+                                self.raw[reader.offset - 4:reader.offset].tobytes())
+        except struct_error:
+            raise Exception("There is some error in the serialized transaction found at offset " + str(start) +
+                            " of the block.")
+
+        if reader.remaining():
+            raise Exception("There is some error in the serialized block. " + str(reader.remaining()) +
+                            " bytes remain unparsed.")
+
+        tx_ids = double_sha256_batch(data)
+        if endianness == "BE":
+            tx_ids = [tx_id[::-1] for tx_id in tx_ids]
+        if rtype is hex:
+            tx_ids = [hexlify(tx_id) for tx_id in tx_ids]
+
+        return tx_ids
+
+    def check_merkle_root(self):
+        """ Checks whether the merkle root of the block header matches the transactions of the block.
+
+        :return: True if the merkle root is correct, False otherwise.
+        :rtype: bool
+        """
+
+        return hexlify(merkle_root(self.get_txids(rtype=bin))[::-1]) == self.header.merkle_root
+
+
+def get_blk_files(blocks_dir=None):
+    """ Lists the block files (blk*.dat) of a given directory, sorted by name.
+
+    :param blocks_dir: Directory containing the block files. Defaults to the blocks dir in the Bitcoin core path.
+    :type blocks_dir: str
+    :return: Sorted list of block files.
+    :rtype: list of str
+    """
+
+    if blocks_dir is None:
+        blocks_dir = CFG.btc_core_path + "blocks/"
+
+    return sorted(glob(path.join(blocks_dir, "blk*.dat")))
+
+
+def read_blk_file(file_name, magic=MAINNET_MAGIC):
+    """ Reads a block file (blk*.dat) lazily, one block at a time. The file is memory mapped, so blocks (and their
+    transactions) are read straight from the file without copying them.
+
+    Every block is stored in the file as: network magic (4 bytes) | block size (4 bytes, LE) | serialized block. Files
+    are preallocated by Bitcoin core, so their end may be filled with zeros.
+
+    :param file_name: Path to the block file.
+    :type file_name: str
+    :param magic: Network magic bytes.
+    :type magic: bytes
+    :return: Generator of blocks.
+    :rtype: generator of Block
+    """
+
+    f = open(file_name, 'rb')
+    try:
+        data = mmap(f.fileno(), 0, access=ACCESS_READ)
+    except ValueError:
+        # Empty files can't be mapped.
+        return
+    finally:
+        # The map keeps its own reference to the file, and it is released once every block is gone.
+        f.close()
+
+    reader = Reader(buffer(data))
+    while reader.remaining() >= 8:
+        offset = reader.offset
+        block_magic = reader.read_bytes(4)
+        if block_magic != magic:
+            if block_magic == "\x00\x00\x00\x00":
+                # Preallocated (unused) space reached.
+                break
+            raise Exception("Wrong network magic found in " + file_name + " at offset " + str(offset) + ": " +
+                            hexlify(block_magic))
+
+        size = reader.read_uint32()
+        if size > reader.remaining():
+            raise Exception("Truncated block found in " + file_name + " at offset " + str(offset))
+
+        yield Block(reader.read(size), file_name, offset)
+
+
+def iter_blocks(files=None, magic=MAINNET_MAGIC):
+    """ Reads all the blocks from a list of block files, in order.
+
+    :param files: List of block files. All the block files from the Bitcoin core path by default.
+    :type files: list of str
+    :param magic: Network magic bytes.
+    :type magic: bytes
+    :return: Generator of blocks.
+    :rtype: generator of Block
+    """
+
+    if files is None:
+        files = get_blk_files()
+
+    for file_name in files:
+        for block in read_blk_file(file_name, magic):
+            yield block
+
+
+def read_block(file_name, offset, magic=MAINNET_MAGIC):
+    """ Reads a single block from a block file, given its offset (e.g. taken from the block index).
+
+    :param file_name: Path to the block file.
+    :type file_name: str
+    :param offset: Offset of the block within the file.
+    :type offset: int
+    :param magic: Network magic bytes.
+    :type magic: bytes
+    :return: The block.
+    :rtype: Block
+    """
+
+    f = open(file_name, 'rb')
+    f.seek(offset)
+    data = f.read(8)
+    if data[:4] != magic:
+        f.close()
+        raise Exception("No block found in " + file_name + " at offset " + str(offset))
+
+    size = Reader(data, 4).read_uint32()
+    raw = f.read(size)
+    f.close()
+
+    return Block(raw, file_name, offset)
+
+
+def _index_blk_file(args):
+    """ Builds the index entries of a single block file. Used by build_block_index workers.
+
+    :param args: Block file and network magic.
+    :type args: tuple
+    :return: List of index entries (block hash (BE), file name, offset, size, previous block hash).
+    :rtype: list
+    """
+
+    file_name, magic = args
+
+    return [(block.get_hash(endianness="BE"), path.basename(file_name), block.offset, len(block.raw),
+             block.header.prev_block_hash) for block in read_blk_file(file_name, magic)]
+
+
+def _process_blk_file(args):
+    """ Applies a function to every block of a single block file. Used by process_blk_files workers.
+
+    :param args: Function, block file and network magic.
+    :type args: tuple
+    :return: Block file and list of results.
+    :rtype: str, list
+    """
+
+    f, file_name, magic = args
+
+    return file_name, [f(block) for block in read_blk_file(file_name, magic)]
+
+
+def process_blk_files(f, files=None, magic=MAINNET_MAGIC, processes=None):
+    """ Applies a function to every block of a list of block files, processing each file in a different process. The
+    function must be picklable (i.e. defined at module level) and so must be its results, so it should return some
+    data extracted from the block rather than the block itself.
+
+    e.g:
+        def count_txs(block):
+            return block.get_hash(endianness="BE"), block.tx_count
+
+        for file_name, results in process_blk_files(count_txs):
+            ...
+
+    :param f: Function to apply to every block.
+    :type f: function
+    :param files: List of block files. All the block files from the Bitcoin core path by default.
+    :type files: list of str
+    :param magic: Network magic bytes.
+    :type magic: bytes
+    :param processes: Number of worker processes (number of cpus by default).
+    :type processes: int
+    :return: Generator of (block file, list of results), in the same order as files.
+    :rtype: generator
+    """
+
+    if files is None:
+        files = get_blk_files()
+
+    pool = Pool(processes)
+    try:
+        for r in pool.imap(_process_blk_file, [(f, file_name, magic) for file_name in files]):
+            yield r
+    finally:
+        pool.close()
+        pool.join()
+
+
+def build_block_index(files=None, fout_name=None, magic=MAINNET_MAGIC, processes=None):
+    """ Builds an index with the location of every block in the block files, so they can be accessed directly (see
+    read_block). Block files are indexed in parallel.
+
+    :param files: List of block files. All the block files from the Bitcoin core path by default.
+    :type files: list of str
+    :param fout_name: Name of the file (in the data path) where the index will be stored (as json). Not stored if None.
+    :type fout_name: str
+    :param magic: Network magic bytes.
+    :type magic: bytes
+    :param processes: Number of worker processes (number of cpus by default).
+    :type processes: int
+    :return: The index: block hash (BE) -> {file, offset, size, prev_block_hash}
+    :rtype: dict
+    """
+
+    if files is None:
+        files = get_blk_files()
+
+    pool = Pool(processes)
+    try:
+        entries = pool.map(_index_blk_file, [(file_name, magic) for file_name in files])
+    finally:
+        pool.close()
+        pool.join()
+
+    index = dict()
+    for file_entries in entries:
+        for block_hash, file_name, offset, size, prev_block_hash in file_entries:
+            index[block_hash] = {"file": file_name, "offset": offset, "size": size,
+                                 "prev_block_hash": prev_block_hash}
+
+    if fout_name is not None:
+        fout = open(CFG.data_path + fout_name, 'w')
+        fout.write(dumps(index))
+        fout.close()
+
+    return index
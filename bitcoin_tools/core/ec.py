@@ -0,0 +1,179 @@
+from ecdsa import SECP256k1
+
+# Arithmetic over the secp256k1 curve (y^2 = x^3 + 7 over GF(p)), used to speed up public key derivation.
+#
+# Public keys are derived by multiplying the (fixed) generator G by the private key. Since G never changes, all the
+# multiples j * 2^(w*i) * G (for every window i of w bits of the key and every value j of the window) are computed once,
+# and then every multiplication only takes an addition per window (256 / w), with no doublings at all.
+#
+# Points are handled as tuples of ints: (x, y) for affine coordinates and (X, Y, Z) for Jacobian ones (x = X / Z^2,
+# y = Y / Z^3), with Z = 0 for the point at infinity.
+
+P = SECP256k1.curve.p()
+N = SECP256k1.order
+G = (SECP256k1.generator.x(), SECP256k1.generator.y())
+
+# Window size (in bits) of the precomputed tables. Tables take 256 / w * (2^w - 1) points.
+WINDOW_SIZE = 8
+
+INFINITY = (1, 1, 0)
+
+_tables = dict()
+
+
+def jacobian_double(point):
+    """ Doubles a point (Jacobian coordinates).
+
+    :param point: Point to be doubled.
+    :type point: tuple
+    :return: 2 * point.
+    :rtype: tuple
+    """
+
+    x, y, z = point
+    if not z or not y:
+        return INFINITY
+
+    yy = y * y % P
+    s = 4 * x * yy % P
+    m = 3 * x * x % P
+    x3 = (m * m - 2 * s) % P
+
+    return x3, (m * (s - x3) - 8 * yy * yy) % P, 2 * y * z % P
+
+
+def jacobian_add_affine(point, affine_point):
+    """ Adds an affine point to a Jacobian one (mixed addition).
+
+    :param point: Point in Jacobian coordinates.
+    :type point: tuple
+    :param affine_point: Point in affine coordinates.
+    :type affine_point: tuple
+    :return: point + affine_point (Jacobian coordinates).
+    :rtype: tuple
+    """
+
+    x1, y1, z1 = point
+    x2, y2 = affine_point
+    if not z1:
+        return x2, y2, 1
+
+    zz = z1 * z1 % P
+    h = (x2 * zz - x1) % P
+    r = (y2 * zz * z1 - y1) % P
+    if not h:
+        if not r:
+            return jacobian_double(point)
+        return INFINITY
+
+    hh = h * h % P
+    hhh = h * hh % P
+    v = x1 * hh % P
+    x3 = (r * r - hhh - 2 * v) % P
+
+    return x3, (r * (v - x3) - y1 * hhh) % P, z1 * h % P
+
+
+def to_affine(points):
+    """ Converts a batch of points from Jacobian to affine coordinates, using a single modular inversion for the whole
+    batch (Montgomery's trick).
+
+    :param points: Points in Jacobian coordinates (none of them can be the point at infinity).
+    :type points: list of tuple
+    :return: Points in affine coordinates.
+    :rtype: list of tuple
+    """
+
+    if not points:
+        return []
+
+    # Products of the z coordinates of the first i + 1 points.
+    products = []
+    acc = 1
+    for x, y, z in points:
+        if not z:
+            raise Exception("The point at infinity has no affine coordinates.")
+        acc = acc * z % P
+        products.append(acc)
+
+    inv = pow(acc, P - 2, P)
+    affine = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        x, y, z = points[i]
+        # inv is the inverse of the product of the first i + 1 z's, so z_i^-1 = inv * (product of the first i z's).
+        z_inv = inv * products[i - 1] % P if i else inv
+        inv = inv * z % P
+        zz_inv = z_inv * z_inv % P
+        affine[i] = (x * zz_inv % P, y * zz_inv * z_inv % P)
+
+    return affine
+
+
+def get_table(w=WINDOW_SIZE):
+    """ Gets the table of precomputed multiples of G for a given window size, building it the first time.
+
+    :param w: Window size (in bits).
+    :type w: int
+    :return: Table of points (affine), where table[i][j - 1] = j * 2^(w*i) * G, for j in [1, 2^w).
+    :rtype: list of list of tuple
+    """
+
+    table = _tables.get(w)
+    if table is None:
+        windows = (N.bit_length() + w - 1) // w
+        points = []
+        base = G
+        for i in range(windows):
+            acc = INFINITY
+            row = []
+            for j in range(2 ** w - 1):
+                acc = jacobian_add_affine(acc, base)
+                row.append(acc)
+            points.extend(row)
+            # The base of the next window is 2^w * base = (2^w - 1) * base + base.
+            base = to_affine([jacobian_add_affine(acc, base)])[0]
+
+        points = to_affine(points)
+        table = _tables[w] = [points[i:i + 2 ** w - 1] for i in range(0, len(points), 2 ** w - 1)]
+
+    return table
+
+
+def multiply_g(k, w=WINDOW_SIZE):
+    """ Multiplies G by a given scalar, using the precomputed tables.
+
+    :param k: Scalar (e.g. a private key).
+    :type k: int
+    :param w: Window size (in bits).
+    :type w: int
+    :return: k * G (Jacobian coordinates).
+    :rtype: tuple
+    """
+
+    table = get_table(w)
+    mask = 2 ** w - 1
+
+    point = INFINITY
+    i = 0
+    while k:
+        j = k & mask
+        if j:
+            point = jacobian_add_affine(point, table[i][j - 1])
+        k >>= w
+        i += 1
+
+    return point
+
+
+def multiply_g_batch(ks, w=WINDOW_SIZE):
+    """ Multiplies G by a batch of scalars, converting all the results to affine coordinates at once.
+
+    :param ks: Scalars, all of them in [1, N).
+    :type ks: list of int
+    :param w: Window size (in bits).
+    :type w: int
+    :return: k * G for every given k (affine coordinates).
+    :rtype: list of tuple
+    """
+
+    return to_affine([multiply_g(k, w) for k in ks])
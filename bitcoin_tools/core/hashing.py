@@ -0,0 +1,183 @@
+from hashlib import new, sha256
+from multiprocessing import cpu_count
+from os import getpid
+from multiprocessing.pool import ThreadPool
+
+from bitcoin_tools.utils import Reader, skip_tx
+
+# Batch hashing (double-sha256 and hash160) of serialized data, such as transaction ids, merkle roots or public key
+# hashes. Everything is handled as bytes (with no hex encoding in between).
+#
+# hashlib only releases the GIL while hashing buffers of at least 2 KB, so only those are sent to the thread pool.
+# Smaller ones (e.g. public keys or merkle tree nodes) are hashed in the calling thread, where they are faster than any
+# hand-off to a worker. This is also done while the pool is busy with the big ones.
+
+GIL_MIN_SIZE = 2048
+
+# Number of threads of the hashing pool (no pool is used with a single cpu).
+THREADS = cpu_count()
+
+# RIPEMD-160 is created the first time it is used, since some hashlib builds (e.g. OpenSSL 3 with no legacy provider)
+# don't support it.
+_ripemd160 = None
+
+# Shared thread pool, and the process it belongs to.
+_pool = None
+_pool_pid = None
+
+
+def _get_pool():
+    """ Gets the (shared) hashing thread pool, creating it the first time. Forked processes (e.g. multiprocessing
+    workers) inherit the pool of their parent but not its threads, so they get a new one.
+
+    :return: The thread pool.
+    :rtype: ThreadPool
+    """
+
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != getpid():
+        _pool = ThreadPool(THREADS)
+        _pool_pid = getpid()
+
+    return _pool
+
+
+def _map(f, data):
+    """ Applies a hash function to a batch of buffers. Big buffers are hashed by the thread pool, while the small ones
+    are hashed meanwhile in the calling thread.
+
+    :param f: Hash function.
+    :type f: function
+    :param data: Buffers to be hashed.
+    :type data: list of bytes
+    :return: The hash of every buffer, in the same order.
+    :rtype: list of bytes
+    """
+
+    big = [i for i, d in enumerate(data) if len(d) >= GIL_MIN_SIZE] if THREADS > 1 else []
+    if len(big) < 2:
+        return [f(d) for d in data]
+
+    pending = _get_pool().map_async(f, [data[i] for i in big])
+    hashes = [f(d) if len(d) < GIL_MIN_SIZE else None for d in data]
+    for i, h in zip(big, pending.get()):
+        hashes[i] = h
+
+    return hashes
+
+
+def double_sha256(data):
+    """ Computes the double-sha256 of some data (as used for transaction ids, block hashes and merkle trees).
+
+    :param data: Data to be hashed.
+    :type data: bytes or memoryview
+    :return: The hash (LE, as it is serialized).
+    :rtype: bytes
+    """
+
+    return sha256(sha256(data).digest()).digest()
+
+
+def double_sha256_batch(data):
+    """ Computes the double-sha256 of a batch of buffers. See double_sha256.
+
+    :param data: Buffers to be hashed.
+    :type data: list of bytes
+    :return: The hash of every buffer, in the same order.
+    :rtype: list of bytes
+    """
+
+    return _map(double_sha256, data)
+
+
+def _hash_160(data):
+    """ Computes the RIPEMD-160 of the sha256 of some data.
+
+    :param data: Data to be hashed.
+    :type data: bytes
+    :return: The hash.
+    :rtype: bytes
+    """
+
+    global _ripemd160
+    if _ripemd160 is None:
+        try:
+            _ripemd160 = new('ripemd160')
+        except ValueError:
+            raise Exception("RIPEMD-160 is not supported by this Python build (hashlib). It is required to compute "
+                            "hash160 digests (e.g. Bitcoin addresses).")
+
+    md = _ripemd160.copy()
+    md.update(sha256(data).digest())
+
+    return md.digest()
+
+
+def hash_160_batch(data):
+    """ Computes the hash160 (RIPEMD-160 of the sha256) of a batch of buffers, such as serialized public keys.
+
+    :param data: Buffers to be hashed.
+    :type data: list of bytes
+    :return: The hash of every buffer, in the same order.
+    :rtype: list of bytes
+    """
+
+    return _map(_hash_160, data)
+
+
+def strip_witness(raw_tx):
+    """ Gets the serialization of a transaction without its witness data (the one its id is computed from).
+
+    :param raw_tx: Serialized transaction.
+    :type raw_tx: bytes
+    :return: The given transaction with no marker, flag nor witnesses (the same bytes for legacy transactions).
+    :rtype: bytes
+    """
+
+    # Legacy transactions can't have zero inputs, so a zero byte right after the version can only be the segwit marker.
+    if raw_tx[4:5] != "\x00":
+        return raw_tx
+
+    reader = Reader(raw_tx)
+    segwit = skip_tx(reader)
+    if segwit is None:
+        return raw_tx
+    start, witness = segwit
+
+    return raw_tx[:4] + raw_tx[start:witness] + raw_tx[reader.offset - 4:reader.offset]
+
+
+def get_txids(raw_txs):
+    """ Computes the ids of a batch of serialized transactions (see TX.get_txid), with no need to decode them.
+
+    :param raw_txs: Serialized transactions.
+    :type raw_txs: list of bytes
+    :return: The id of every transaction (LE, as it is serialized), in the same order.
+    :rtype: list of bytes
+    """
+
+    return double_sha256_batch([strip_witness(raw_tx) for raw_tx in raw_txs])
+
+
+def merkle_root(hashes):
+    """ Computes the merkle root of a list of hashes (e.g. the ids of the transactions of a block). Levels with an odd
+    number of nodes have their last node duplicated.
+
+    :param hashes: Leaves of the tree (LE).
+    :type hashes: list of bytes
+    :return: The merkle root (LE, as it is stored in block headers).
+    :rtype: bytes
+    """
+
+    if not hashes:
+        raise Exception("The merkle root of an empty list of hashes can't be computed.")
+
+    level = list(hashes)
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        # Nodes are only 64 bytes long, so they are always hashed in the calling thread (see GIL_MIN_SIZE).
+        data = "".join(level)
+        level = [sha256(sha256(data[i:i + 64]).digest()).digest() for i in range(0, len(data), 64)]
+
+    return level[0]
@@ -1,12 +1,29 @@
 from bitcoin_tools import CFG
+from bitcoin_tools.core.ec import N, multiply_g, multiply_g_batch, jacobian_add_affine, to_affine
+from bitcoin_tools.core.hashing import hash_160_batch
 from bitcoin_tools.utils import change_endianness, int2bytes
 from bitcoin.core.script import SIGHASH_ALL, SIGHASH_SINGLE, SIGHASH_NONE
 
 from binascii import hexlify, unhexlify
-from hashlib import sha256
+from collections import OrderedDict
+from hashlib import sha256, sha512
+from hmac import new as hmac_new
+from multiprocessing import Pool
 from os import mkdir, path
+from struct import pack, unpack_from
 from ecdsa import SigningKey, VerifyingKey, SECP256k1
-from ecdsa.util import sigencode_der_canonize, number_to_string
+from ecdsa.ecdsa import Private_key
+from ecdsa.ellipticcurve import PointJacobi
+from ecdsa.util import sigencode_der_canonize, sigdecode_der, number_to_string, randrange
+
+# Maximum number of signature verification results kept in memory (see ecdsa_verify_sighash).
+VERIFY_CACHE_SIZE = 50000
+
+_verify_cache = OrderedDict()
+
+# BIP32 master key derivation key and first hardened child index.
+BIP32_SEED_KEY = "Bitcoin seed"
+HARDENED = 2 ** 31
 
 
 def generate_keys():
@@ -17,15 +34,59 @@ def generate_keys():
     """
 
     # Generate the key pair from a SECP256K1 elliptic curve.
-    sk = SigningKey.generate(curve=SECP256k1)
-    pk = sk.get_verifying_key()
+    return generate_keys_batch(1)[0]
+
+
+def generate_keys_batch(n, secrets=None):
+    """ Gets a batch of new elliptic curve key pairs (SECP256K1). Public keys are derived using precomputed multiples
+    of the curve generator (see core.ec), which is several times faster than ecdsa's generic derivation, and converted
+    all at once.
+
+    :param n: Number of key pairs.
+    :type n: int
+    :param secrets: Private keys (as integers in [1, order)) to derive the key pairs from. Random ones by default.
+    :type secrets: list of int
+    :return: elliptic curve key pairs.
+    :rtype: list of (SigningKey, VerifyingKey)
+    """
+
+    if secrets is None:
+        secrets = [randrange(N) for _ in range(n)]
+    elif len(secrets) != n or not all(1 <= s < N for s in secrets):
+        raise Exception("Wrong private keys. " + str(n) + " integers in [1, " + str(N) + ") are expected.")
+
+    return [build_key_pair(secexp, x, y) for secexp, (x, y) in zip(secrets, multiply_g_batch(secrets))]
+
+
+def build_key_pair(secexp, x, y):
+    """ Builds an elliptic curve key pair (SECP256K1) from a private key and its (already derived) public key, with no
+    point multiplication at all. The key objects are built the same way SigningKey.from_secret_exponent does.
+
+    :param secexp: Private key.
+    :type secexp: int
+    :param x: x coordinate of the public key.
+    :type x: int
+    :param y: y coordinate of the public key.
+    :type y: int
+    :return: elliptic curve key pair.
+    :rtype: SigningKey, VerifyingKey
+    """
+
+    pk = VerifyingKey.from_public_point(PointJacobi(SECP256k1.curve, x, y, 1, N), SECP256k1, validate_point=False)
+    sk = SigningKey(_error__please_use_generate=True)
+    sk.curve = SECP256k1
+    sk.default_hashfunc = pk.default_hashfunc
+    sk.baselen = SECP256k1.baselen
+    sk.verifying_key = pk
+    sk.privkey = Private_key(pk.pubkey, secexp)
+    sk.privkey.order = N
 
     return sk, pk
 
 
-def store_keys(sk, pk, btc_addr, vault_path=None):
+def store_keys(sk, pk, btc_addr, vault_path=None, vault=None):
     """ Stores an elliptic curve key pair in PEM format into disk. Both keys are stored in a folder named after the
-    Bitcoin address derived from the public key.
+    Bitcoin address derived from the public key, or in a single file key vault if one is given (see core.vault).
 
     :param sk: PEM encoded elliptic curve private key.
     :type sk: str
@@ -35,6 +96,8 @@ def store_keys(sk, pk, btc_addr, vault_path=None):
     :type btc_addr: str
     :param vault_path: Path where keys will be stored. Defined in the config file by default.
     :type vault_path: str
+    :param vault: Key vault where keys will be stored (instead of the vault path).
+    :type vault: KeyVault
     :return: None.
     :rtype: None
     """
@@ -42,6 +105,10 @@ def store_keys(sk, pk, btc_addr, vault_path=None):
     if vault_path is None:
         vault_path = CFG.address_vault
 
+    if vault is not None:
+        vault.add(btc_addr, SigningKey.from_pem(sk), VerifyingKey.from_pem(pk))
+        return
+
     if not path.exists(vault_path + btc_addr):
         mkdir(vault_path + btc_addr)
 
@@ -50,18 +117,27 @@ def store_keys(sk, pk, btc_addr, vault_path=None):
     open(vault_path + btc_addr + '/pk.pem', "w").write(pk)
 
 
-def load_keys(btc_addr, vault_path=None):
-    """ Loads an elliptic curve key pair in PEM format from disk. Keys are stored in their proper objects from the ecdsa
-    python library (SigningKey and VerifyingKey respectively)
+def load_keys(btc_addr, vault_path=None, vault=None):
+    """ Loads an elliptic curve key pair in PEM format from disk (or from a single file key vault if one is given, see
+    core.vault). Keys are stored in their proper objects from the ecdsa python library (SigningKey and VerifyingKey
+    respectively)
 
     :param btc_addr: Bitcoin address associated to the public key of the key pair.
     :type btc_addr: str
     :param vault_path: Path where keys are be stored. Defined in the config file by default.
     :type vault_path: str
+    :param vault: Key vault where keys are stored (instead of the vault path).
+    :type vault: KeyVault
     :return: ecdsa key pair as a tuple.
     :rtype: SigningKey, VerifyingKey
     """
 
+    if vault is not None:
+        keys = vault.get(btc_addr)
+        if keys is None:
+            raise Exception("No keys found for " + btc_addr + " in the key vault.")
+        return keys
+
     if vault_path is None:
         vault_path = CFG.address_vault
 
@@ -100,6 +176,28 @@ def serialize_pk(pk, compressed=True):
     return s_key
 
 
+def decompress_pk(pk):
+    """ Decompresses a compressed public key, by computing its y coordinate from the x coordinate and the parity byte.
+
+    :param pk: Compressed public key (33 bytes).
+    :type pk: hex str
+    :return: Uncompressed public key (65 bytes).
+    :rtype: hex str
+    """
+
+    if len(pk) != 66 or pk[:2] not in ["02", "03"]:
+        raise Exception("Wrong compressed public key.")
+
+    p = SECP256k1.curve.p()
+    x = int(pk[2:], 16)
+    # y^2 = x^3 + 7 (mod p). Since p = 3 (mod 4), the square root can be computed as (x^3 + 7)^((p + 1) / 4) (mod p).
+    y = pow(pow(x, 3, p) + 7, (p + 1) / 4, p)
+    if y & 1 != int(pk[:2], 16) & 1:
+        y = p - y
+
+    return '04' + pk[2:] + int2bytes(y, 32)
+
+
 def serialize_sk(sk):
     """ Serializes a ecdsa.SigningKey (private key).
 
@@ -132,16 +230,415 @@ def ecdsa_tx_sign(unsigned_tx, sk, hashflag=SIGHASH_ALL, deterministic=True):
 
     # ToDo: Deal with SIGHASH_ANYONECANPAY
 
-    # sha-256 the unsigned transaction together with the hash type (little endian).
-    h = sha256(unhexlify(unsigned_tx + change_endianness(hc))).digest()
-    # Sign the transaction (using a sha256 digest, that will conclude with the double-sha256)
-    # If deterministic is set, the signature will be performed deterministically choosing a k from the given transaction
+    # double-sha-256 the unsigned transaction together with the hash type (little endian).
+    sighash = sha256(sha256(unhexlify(unsigned_tx + change_endianness(hc))).digest()).digest()
+
+    return ecdsa_sighash_sign(sighash, sk, hashflag, deterministic)
+
+
+def ecdsa_sighash_sign(sighash, sk, hashflag=SIGHASH_ALL, deterministic=True):
+    """ Performs and ECDSA sign over a given signature hash (i.e: the double-sha256 of the unsigned transaction
+    together with the hash type, as computed by TX.get_sighash) using a given secret key.
+
+    :param sighash: Signature hash to be signed.
+    :type sighash: bytes
+    :param sk: ECDSA private key that will sign the signature hash.
+    :type sk: SigningKey
+    :param hashflag: hash type used to compute the signature hash, that will identify the signature format.
+    :type hashflag: int
+    :param deterministic: Whether the signature is performed using a deterministic k or not. Set by default.
+    :type deterministic: bool
+    :return: DER encoded signature followed by the hash type.
+    :rtype: hex str
+    """
+
+    if hashflag not in [SIGHASH_ALL, SIGHASH_SINGLE, SIGHASH_NONE]:
+        raise Exception("Wrong hash flag.")
+
+    # If deterministic is set, the signature will be performed deterministically choosing a k from the given hash.
     if deterministic:
-        s = sk.sign_deterministic(h, hashfunc=sha256, sigencode=sigencode_der_canonize)
+        s = sk.sign_digest_deterministic(sighash, hashfunc=sha256, sigencode=sigencode_der_canonize)
     # Otherwise, k will be chosen at random. Notice that this can lead to a private key disclosure if two different
     # messages are signed using the same k.
     else:
-        s = sk.sign(h, hashfunc=sha256, sigencode=sigencode_der_canonize)
+        s = sk.sign_digest(sighash, sigencode=sigencode_der_canonize)
+
+    # Finally, add the hashtype to the end of the signature as a 1-byte hex value.
+    return hexlify(s) + int2bytes(hashflag, 1)
+
+
+def ecdsa_verify_sighash(sighash, pk, signature):
+    """ Verifies an ECDSA signature over a given signature hash. Results are kept in a bounded cache, indexed by
+    (sighash, pk, signature), so verifying the same signature again (e.g. when a transaction is validated more than
+    once, or every key of a multisig is tried against the same signature) performs no elliptic curve operations.
+
+    :param sighash: Signature hash (see TX.get_sighash).
+    :type sighash: bytes
+    :param pk: Public key (compressed or uncompressed).
+    :type pk: hex str
+    :param signature: DER encoded signature (without the hash type).
+    :type signature: hex str
+    :return: True if the signature is valid, False otherwise.
+    :rtype: bool
+    """
+
+    key = (sighash, pk, signature)
+    result = _verify_cache.pop(key, None)
+
+    if result is None:
+        try:
+            if pk[:2] in ["02", "03"]:
+                pk = decompress_pk(pk)
+            if len(pk) != 130 or pk[:2] != "04":
+                raise Exception("Wrong public key.")
+            vk = VerifyingKey.from_string(unhexlify(pk[2:]), curve=SECP256k1)
+            result = vk.verify_digest(unhexlify(signature), sighash, sigdecode=sigdecode_der)
+        except Exception:
+            # Malformed keys or signatures (or signatures that don't match) are just invalid.
+            result = False
+
+    _verify_cache[key] = result
+    if len(_verify_cache) > VERIFY_CACHE_SIZE:
+        _verify_cache.popitem(last=False)
+
+    return result
+
+
+# Signing keys already built by a signing worker process (see ecdsa_sighash_sign_batch), indexed by their serialization.
+_worker_sks = dict()
+
+
+def _ecdsa_sighash_sign_job(args):
+    """ Signs a signature hash in a worker process. Keys are sent serialized (and rebuilt only once per process), since
+    SigningKey objects are expensive to pickle and to build.
+
+    :param args: Signature hash, serialized private key, hash type and whether the signature is deterministic.
+    :type args: tuple
+    :return: DER encoded signature followed by the hash type.
+    :rtype: hex str
+    """
+
+    sighash, sk_str, hashflag, deterministic = args
+
+    sk = _worker_sks.get(sk_str)
+    if sk is None:
+        sk = _worker_sks[sk_str] = SigningKey.from_string(sk_str, curve=SECP256k1)
+
+    return ecdsa_sighash_sign(sighash, sk, hashflag, deterministic)
+
+
+def ecdsa_sighash_sign_batch(jobs, hashflag=SIGHASH_ALL, deterministic=True, processes=None):
+    """ Signs a batch of signature hashes in parallel, using a pool of processes. Deterministic signatures are identical
+    to the ones performed by ecdsa_sighash_sign.
+
+    :param jobs: Signature hashes to be signed along with the private key that will sign each one of them.
+    :type jobs: list of (bytes, SigningKey)
+    :param hashflag: hash type used to compute the signature hashes.
+    :type hashflag: int
+    :param deterministic: Whether the signatures are performed using a deterministic k or not. Set by default.
+    :type deterministic: bool
+    :param processes: Number of worker processes (number of cpus by default). If set to 1, hashes are signed in the
+    calling process.
+    :type processes: int
+    :return: Signatures, in the same order as the given jobs.
+    :rtype: list of hex str
+    """
+
+    if processes == 1:
+        return [ecdsa_sighash_sign(sighash, sk, hashflag, deterministic) for sighash, sk in jobs]
+
+    pool = Pool(processes)
+    try:
+        return pool.map(_ecdsa_sighash_sign_job, [(sighash, sk.to_string(), hashflag, deterministic)
+                                                  for sighash, sk in jobs])
+    finally:
+        pool.close()
+        pool.join()
+
+
+class HDKey(object):
+    """ Defines a BIP32 hierarchical deterministic key (extended key): a private key (or only a public one) along with
+    its chain code, from which child keys can be derived.
+
+    Intermediate nodes derived along a path are cached, so deriving keys that share a parent (e.g. all the addresses of
+    an account) costs a single child derivation each.
+    """
+
+    def __init__(self, chain_code, secexp=None, point=None, depth=0, parent_fingerprint="\x00" * 4, child_number=0):
+        """
+        :param chain_code: Chain code (32 bytes).
+        :type chain_code: bytes
+        :param secexp: Private key. None for public extended keys.
+        :type secexp: int
+        :param point: Public key, as an affine point. Derived from the private key if not given.
+        :type point: (int, int)
+        :param depth: Depth of the key in the tree (0 for master keys).
+        :type depth: int
+        :param parent_fingerprint: Fingerprint of the parent key (4 bytes).
+        :type parent_fingerprint: bytes
+        :param child_number: Index of the key within its parent (hardened ones from 2^31 on).
+        :type child_number: int
+        """
+
+        if secexp is None and point is None:
+            raise Exception("Either a private or a public key is needed to build an extended key.")
+
+        self.chain_code = chain_code
+        self.secexp = secexp
+        self._point = point
+        self.depth = depth
+        self.parent_fingerprint = parent_fingerprint
+        self.child_number = child_number
+
+        self._children = dict()
+
+    @classmethod
+    def from_seed(cls, seed):
+        """ Builds a master extended key from a seed.
+
+        :param seed: Seed (from 16 to 64 bytes).
+        :type seed: bytes
+        :return: The master extended key.
+        :rtype: HDKey
+        """
+
+        i = hmac_new(BIP32_SEED_KEY, seed, sha512).digest()
+        secexp = int(hexlify(i[:32]), 16)
+        if not 1 <= secexp < N:
+            raise Exception("Invalid seed. The derived master key is out of range.")
+
+        return cls(i[32:], secexp)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Builds an extended key from its (78 bytes) serialization.
+
+        :param data: Serialized extended key.
+        :type data: bytes
+        :return: The version bytes and the extended key.
+        :rtype: int, HDKey
+        """
+
+        if len(data) != 78:
+            raise Exception("Wrong extended key length: " + str(len(data)))
+
+        version, depth = unpack_from(">IB", data, 0)
+        parent_fingerprint, child_number = data[5:9], unpack_from(">I", data, 9)[0]
+        chain_code, key = data[13:45], data[45:]
+
+        if key[0] == "\x00":
+            secexp = int(hexlify(key[1:]), 16)
+            if not 1 <= secexp < N:
+                raise Exception("Wrong extended key. The private key is out of range.")
+            node = cls(chain_code, secexp=secexp, depth=depth, parent_fingerprint=parent_fingerprint,
+                       child_number=child_number)
+        else:
+            pk = decompress_pk(hexlify(key))
+            node = cls(chain_code, point=(int(pk[2:66], 16), int(pk[66:], 16)), depth=depth,
+                       parent_fingerprint=parent_fingerprint, child_number=child_number)
+
+        return version, node
+
+    def to_bytes(self, version, private=True):
+        """ Serializes the extended key (78 bytes).
+
+        :param version: Version bytes (e.g. 0x0488ADE4 for mainnet private keys).
+        :type version: int
+        :param private: Whether the private key is serialized (xprv) or the public one (xpub).
+        :type private: bool
+        :return: Serialized extended key.
+        :rtype: bytes
+        """
+
+        if private:
+            if self.secexp is None:
+                raise Exception("A public extended key can't be serialized as private.")
+            key = "\x00" + number_to_string(self.secexp, N)
+        else:
+            key = self.get_public_key()
+
+        return pack(">IB", version, self.depth) + self.parent_fingerprint + pack(">I", self.child_number) + \
+            self.chain_code + key
+
+    @property
+    def point(self):
+        """ Public key, as an affine point (derived from the private key the first time it is accessed).
+
+        :return: Public key.
+        :rtype: (int, int)
+        """
+
+        if self._point is None:
+            self._point = to_affine([multiply_g(self.secexp)])[0]
+
+        return self._point
+
+    def is_private(self):
+        return self.secexp is not None
+
+    def get_public_key(self):
+        """ Gets the compressed serialization of the public key.
+
+        :return: Compressed public key (33 bytes).
+        :rtype: bytes
+        """
+
+        x, y = self.point
+
+        return chr(2 + (y & 1)) + number_to_string(x, N)
+
+    def get_fingerprint(self):
+        """ Gets the fingerprint of the key: the first 4 bytes of the hash160 (RIPEMD-160 of the sha256) of its public
+        key.
+
+        :return: Key fingerprint.
+        :rtype: bytes
+        """
+
+        return hash_160_batch([self.get_public_key()])[0][:4]
+
+    def get_keys(self):
+        """ Gets the ecdsa key pair of the extended key (see build_key_pair).
+
+        :return: elliptic curve key pair. The private key is None for public extended keys.
+        :rtype: SigningKey, VerifyingKey
+        """
+
+        x, y = self.point
+        if self.secexp is None:
+            pk = VerifyingKey.from_public_point(PointJacobi(SECP256k1.curve, x, y, 1, N), SECP256k1,
+                                                validate_point=False)
+            return None, pk
+
+        return build_key_pair(self.secexp, x, y)
+
+    def neuter(self):
+        """ Gets the public extended key of the key (with no private key).
+
+        :return: Public extended key.
+        :rtype: HDKey
+        """
+
+        return HDKey(self.chain_code, point=self.point, depth=self.depth, parent_fingerprint=self.parent_fingerprint,
+                     child_number=self.child_number)
+
+    def _get_tweak(self, i, public_key):
+        """ Computes the HMAC-SHA512 used to derive a given child: the tweak (added to the parent key) and the child
+        chain code.
+
+        :param i: Child index.
+        :type i: int
+        :param public_key: Compressed public key of the parent (only used for non hardened children).
+        :type public_key: bytes
+        :return: Tweak and chain code.
+        :rtype: int, bytes
+        """
+
+        if i >= HARDENED:
+            if self.secexp is None:
+                raise Exception("Hardened keys can't be derived from a public extended key.")
+            data = "\x00" + number_to_string(self.secexp, N) + pack(">I", i)
+        else:
+            data = public_key + pack(">I", i)
+
+        h = hmac_new(self.chain_code, data, sha512).digest()
+        tweak = int(hexlify(h[:32]), 16)
+        if tweak >= N:
+            raise Exception("Invalid child key " + str(i) + ". Proceed with the next index.")
+
+        return tweak, h[32:]
+
+    def derive_child(self, i):
+        """ Derives a child extended key. Private children are derived from private keys, and public ones otherwise.
+
+        :param i: Child index (hardened ones from 2^31 on).
+        :type i: int
+        :return: The child extended key.
+        :rtype: HDKey
+        """
+
+        return self.derive_range(i, 1)[0]
+
+    def derive_range(self, start, n):
+        """ Derives a range of consecutive children of the key at once. Public keys of all the children are converted to
+        affine coordinates at the same time.
+
+        :param start: Index of the first child.
+        :type start: int
+        :param n: Number of children.
+        :type n: int
+        :return: The child extended keys, in order.
+        :rtype: list of HDKey
+        """
+
+        if start < 0 or start + n > 2 ** 32:
+            raise Exception("Child indexes must be in [0, 2^32).")
+
+        public_key = self.get_public_key()
+        fingerprint = self.get_fingerprint()
+        tweaks = [self._get_tweak(i, public_key) for i in range(start, start + n)]
+
+        if self.secexp is not None:
+            secexps = [(tweak + self.secexp) % N for tweak, _ in tweaks]
+            if 0 in secexps:
+                raise Exception("Invalid child key " + str(start + secexps.index(0)) + ". Proceed with the next index.")
+            points = multiply_g_batch(secexps)
+        else:
+            secexps = [None] * n
+            points = [jacobian_add_affine(multiply_g(tweak), self.point) for tweak, _ in tweaks]
+            if any(not z for _, _, z in points):
+                raise Exception("Invalid child key. Proceed with the next index.")
+            points = to_affine(points)
+
+        return [HDKey(chain_code, secexp, point, self.depth + 1, fingerprint, i)
+                for i, (_, chain_code), secexp, point in zip(range(start, start + n), tweaks, secexps, points)]
+
+    def derive(self, path):
+        """ Derives a descendant extended key along a given path, relative to this key. Every intermediate key is
+        cached, so only the last step is derived when the same parent is reached again.
+
+        e.g: derive("m/44'/0'/0'/0/5")
+
+        :param path: Derivation path, either as a string (hardened indexes marked with ' or h) or as a list of indexes.
+        :type path: str, unicode or list of int
+        :return: The descendant extended key.
+        :rtype: HDKey
+        """
+
+        indexes = parse_path(path) if isinstance(path, basestring) else path
+
+        node = self
+        for i in indexes[:-1]:
+            child = node._children.get(i)
+            if child is None:
+                child = node._children[i] = node.derive_child(i)
+            node = child
+
+        return node.derive_child(indexes[-1]) if indexes else node
+
+
+def parse_path(path):
+    """ Parses a BIP32 derivation path.
+
+    e.g: parse_path("m/0'/1") = [2147483648, 1]
+
+    :param path: Derivation path (hardened indexes marked with ', h or H). The leading m is optional.
+    :type path: str
+    :return: Child indexes.
+    :rtype: list of int
+    """
+
+    elements = path.split("/")
+    if elements[0] in ["m", "M"]:
+        elements = elements[1:]
+
+    indexes = []
+    for e in elements:
+        hardened = e[-1:] in ["'", "h", "H"]
+        if hardened:
+            e = e[:-1]
+        if not e.isdigit() or int(e) >= HARDENED:
+            raise Exception("Wrong derivation path: " + path)
+        indexes.append(int(e) + HARDENED if hardened else int(e))
 
-    # Finally, add the hashtype to the end of the signature as a 2-byte big endian hex value.
-    return hexlify(s) + hc[-2:]
+    return indexes
@@ -0,0 +1,288 @@
+from abc import ABCMeta, abstractmethod
+from binascii import hexlify, unhexlify
+from collections import OrderedDict
+from httplib import HTTPConnection, HTTPSConnection, HTTPException
+from json import loads
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty
+from socket import error as socket_error
+from struct import pack
+from time import sleep
+from urlparse import urlparse
+
+from bitcoin_tools import CFG
+from bitcoin_tools.utils import get_blockcypher_url, parse_tx_outputs
+
+# Script types stored in the local prevout store (as a single leading byte, its index in this tuple).
+SCRIPT_TYPES = ("P2PKH", "P2SH", "P2PK", "P2MS", "unknown", "P2WPKH", "P2WSH")
+
+# Number of resolved prevouts kept in memory by the LocalResolver.
+CACHE_SIZE = 100000
+
+# Default HTTPResolver settings: maximum number of concurrent requests, number of retries per request, base delay
+# between retries (doubled after every retry) and request timeout (in seconds).
+CONCURRENCY = 10
+RETRIES = 3
+BACKOFF = 0.5
+TIMEOUT = 10
+
+
+class PrevoutResolver:
+    """ Defines the interface of a prevout resolver: an object able to find the ScriptPubKey (and its type) of the
+    outputs that are redeemed by the inputs of a transaction (identified by the previous transaction id and the output
+    index).
+    """
+
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def resolve(self, outpoints):
+        """ Resolves a batch of outpoints at once.
+
+        :param outpoints: Outpoints to be resolved, as (previous transaction id (BE), output index) pairs.
+        :type outpoints: list of (hex str, int)
+        :return: The ScriptPubKey and its type for every outpoint, in the same order. None for unknown outpoints.
+        :rtype: list of (hex str, str)
+        """
+
+    def get(self, tx_id, index):
+        """ Resolves a single outpoint.
+
+        :param tx_id: Previous transaction id (BE).
+        :type tx_id: hex str
+        :param index: Output index.
+        :type index: int
+        :return: The ScriptPubKey and its type. None if the outpoint is unknown.
+        :rtype: hex str, str
+        """
+
+        return self.resolve([(tx_id, index)])[0]
+
+
+class HTTPResolver(PrevoutResolver):
+    """ Resolves prevouts by querying a web API that serves transactions in blockcypher's format (base url followed by
+    the transaction id, returning a json with the script and script type of every output).
+
+    Transactions are fetched concurrently (every transaction only once per batch, no matter how many of its outputs are
+    requested) using a bounded pool of threads, and keep-alive connections are reused between requests. Failed requests
+    (connection errors, 5xx and 429 responses) are retried with exponential backoff.
+    """
+
+    def __init__(self, base_url, concurrency=CONCURRENCY, retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT):
+        """
+        :param base_url: Base url of the API (e.g: http://localhost:8080/txs/).
+        :type base_url: str
+        :param concurrency: Maximum number of concurrent requests (and open connections).
+        :type concurrency: int
+        :param retries: Number of times a failed request is retried.
+        :type retries: int
+        :param backoff: Delay before the first retry (in seconds). It is doubled after every retry.
+        :type backoff: float
+        :param timeout: Timeout of every request (in seconds).
+        :type timeout: float
+        """
+
+        url = urlparse(base_url)
+        if url.scheme not in ["http", "https"]:
+            raise Exception("Wrong base url (only http and https are supported): " + base_url)
+
+        self.base_url = base_url
+        self.https = url.scheme == "https"
+        self.host = url.netloc
+        self.path = url.path if url.path.endswith("/") else url.path + "/"
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        # Idle (keep-alive) connections.
+        self.connections = Queue()
+
+    def close(self):
+        while True:
+            try:
+                self.connections.get_nowait().close()
+            except Empty:
+                break
+
+    def _get_connection(self):
+        try:
+            return self.connections.get_nowait()
+        except Empty:
+            if self.https:
+                return HTTPSConnection(self.host, timeout=self.timeout)
+            else:
+                return HTTPConnection(self.host, timeout=self.timeout)
+
+    def fetch(self, tx_id):
+        """ Fetches the outputs of a given transaction.
+
+        :param tx_id: Transaction id (BE).
+        :type tx_id: hex str
+        :return: The ScriptPubKey and its type for every output of the transaction. None if the transaction is unknown.
+        :rtype: list of (hex str, str)
+        """
+
+        status = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                sleep(self.backoff * 2 ** (attempt - 1))
+
+            conn = self._get_connection()
+            try:
+                conn.request("GET", self.path + tx_id, headers={"User-agent": "Mozilla/5.0"})
+                r = conn.getresponse()
+                body = r.read()
+            except (HTTPException, socket_error):
+                # The connection may have been closed by the server (or the request timed out), so it is discarded.
+                conn.close()
+                status = None
+                continue
+
+            if r.will_close:
+                conn.close()
+            else:
+                self.connections.put(conn)
+
+            status = r.status
+            if status == 200:
+                return parse_tx_outputs(loads(body))
+            elif status == 404:
+                return None
+            elif status != 429 and status < 500:
+                break
+
+        raise Exception("Transaction " + tx_id + " can't be fetched from " + self.base_url + " (status " + str(status) +
+                        ").")
+
+    def resolve(self, outpoints):
+        tx_ids = list(OrderedDict.fromkeys([tx_id for tx_id, _ in outpoints]))
+        if not tx_ids:
+            return []
+
+        pool = ThreadPool(min(self.concurrency, len(tx_ids)))
+        try:
+            txs = dict(zip(tx_ids, pool.map(self.fetch, tx_ids)))
+        finally:
+            pool.close()
+            pool.join()
+
+        return [txs[tx_id][index] if txs[tx_id] is not None and index < len(txs[tx_id]) else None
+                for tx_id, index in outpoints]
+
+
+class BlockcypherResolver(HTTPResolver):
+    """ Resolves prevouts by querying blockcypher's API (see HTTPResolver).
+    """
+
+    def __init__(self, network='test', **kwargs):
+        """
+        :param network: Network in which the transactions can be found (either mainnet or testnet).
+        :type network: str
+        :param kwargs: HTTPResolver settings (concurrency, retries, backoff and timeout).
+        :type kwargs: dict
+        """
+
+        HTTPResolver.__init__(self, get_blockcypher_url(network), **kwargs)
+        self.network = network
+
+
+class LocalResolver(PrevoutResolver):
+    """ Resolves prevouts from a local store (a LevelDB built from the chainstate, see
+    analysis.leveldb.utils.build_prevout_store), so no request is performed. The most recently resolved prevouts are
+    also kept in memory.
+
+    A fallback resolver can be provided to resolve the outpoints missing from the store (e.g. BlockcypherResolver for
+    UTXOs created after the store was built). Prevouts resolved by the fallback are stored, so they are only requested
+    once.
+    """
+
+    def __init__(self, db_path=None, fallback=None, cache_size=CACHE_SIZE):
+        """
+        :param db_path: Path to the prevout store. CFG.data_path + "prevouts" by default.
+        :type db_path: str
+        :param fallback: Resolver used for outpoints missing from the store.
+        :type fallback: PrevoutResolver
+        :param cache_size: Number of prevouts kept in memory.
+        :type cache_size: int
+        """
+
+        # plyvel (LevelDB) is only required to resolve prevouts locally.
+        import plyvel
+
+        if db_path is None:
+            db_path = CFG.data_path + "prevouts"
+
+        self.db = plyvel.DB(db_path, create_if_missing=True)
+        self.fallback = fallback
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def close(self):
+        self.db.close()
+
+    def _cache_put(self, key, prevout):
+        self.cache[key] = prevout
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def resolve(self, outpoints):
+        prevouts = [None] * len(outpoints)
+        missing = []
+
+        for i, (tx_id, index) in enumerate(outpoints):
+            key = get_outpoint_key(tx_id, index)
+            prevout = self.cache.pop(key, None)
+            if prevout is None:
+                value = self.db.get(key)
+                if value is not None:
+                    prevout = (hexlify(value[1:]), SCRIPT_TYPES[ord(value[0])])
+            if prevout is not None:
+                self._cache_put(key, prevout)
+                prevouts[i] = prevout
+            else:
+                missing.append(i)
+
+        if missing and self.fallback is not None:
+            resolved = self.fallback.resolve([outpoints[i] for i in missing])
+            wb = self.db.write_batch()
+            for i, prevout in zip(missing, resolved):
+                if prevout is not None:
+                    key = get_outpoint_key(*outpoints[i])
+                    wb.put(key, encode_prevout(*prevout))
+                    self._cache_put(key, prevout)
+                    prevouts[i] = prevout
+            wb.write()
+
+        return prevouts
+
+
+def get_outpoint_key(tx_id, index):
+    """ Builds the key of an outpoint in the prevout store.
+
+    :param tx_id: Transaction id (BE).
+    :type tx_id: hex str
+    :param index: Output index.
+    :type index: int
+    :return: Outpoint key (32-byte transaction id followed by the 4-byte output index, both BE).
+    :rtype: bytes
+    """
+
+    return unhexlify(tx_id) + pack(">I", index)
+
+
+def encode_prevout(script, script_type):
+    """ Encodes a prevout to be stored in the prevout store.
+
+    :param script: ScriptPubKey.
+    :type script: hex str
+    :param script_type: Type of the script.
+    :type script_type: str
+    :return: Encoded prevout (1-byte script type followed by the script).
+    :rtype: bytes
+    """
+
+    if script_type not in SCRIPT_TYPES:
+        script_type = "unknown"
+
+    return chr(SCRIPT_TYPES.index(script_type)) + unhexlify(script)
@@ -2,8 +2,21 @@ from bitcoin_tools.wallet import btc_addr_to_hash_160
 from bitcoin_tools.utils import check_public_key, check_signature, check_address
 from abc import ABCMeta, abstractmethod
 from binascii import unhexlify, hexlify
+from struct import pack, unpack_from, error as struct_error
+import bitcoin.core.script
 from bitcoin.core.script import *
 
+# Serialized opcodes by name. Besides the canonical names, aliases defined by python-bitcoinlib (e.g. OP_TRUE) are
+# accepted as well.
+OPCODES = dict((name, format(op, '02x')) for name, op in vars(bitcoin.core.script).items()
+               if name.startswith("OP_") and isinstance(op, CScriptOp) and op in OPCODE_NAMES)
+
+# Opcode names by value (as plain ints, so lookups don't go through CScriptOp).
+_OPCODE_NAMES = dict((int(op), name) for op, name in OPCODE_NAMES.items())
+
+# Compiled script templates (see get_template).
+_templates = dict()
+
 
 class Script:
     """ Defines the class Script which includes two subclasses, InputScript and OutputScript. Every script type have two
@@ -13,9 +26,95 @@ class Script:
 
     __metaclass__ = ABCMeta
 
+    # Number of times the content of any script has been set, so the caches built from scripts (see TX.serialize) can
+    # be validated without comparing every script again.
+    modifications = 0
+
     def __init__(self):
-        self.content = ""
-        self.type = "unknown"
+        self._content = ""
+        self._raw = None
+        self._type = None
+        self._tokens = None
+        self._elements = None
+
+    @property
+    def content(self):
+        """ Serialized script (hexadecimal). Scripts built from bytes are only hex encoded the first time their content
+        is accessed.
+
+        :return: Serialized script.
+        :rtype: hex str
+        """
+
+        if self._content is None:
+            self._content = hexlify(self._get_raw())
+
+        return self._content
+
+    @content.setter
+    def content(self, hex_script):
+        Script.modifications += 1
+        self._content = hex_script
+        self._raw = None
+        self._tokens = None
+        self._elements = None
+
+    @property
+    def type(self):
+        """ Script type (P2PK, P2PKH, P2SH, P2MS, nulldata or unknown). Unless explicitly set, it is found (the first
+        time it is accessed) by matching the serialized script against the standard templates (see match).
+
+        :return: Script type.
+        :rtype: str
+        """
+
+        if self._type is None:
+            self._type = self.match(self._get_raw())[0]
+
+        return self._type
+
+    @type.setter
+    def type(self, script_type):
+        self._type = script_type
+
+    def _get_raw(self):
+        """ Gets the serialized script as bytes (without hex encoding it if the script was built from bytes). Both
+        representations are kept once computed, and slices of a bigger buffer are only copied the first time they are
+        accessed (so the buffer can be released afterwards).
+
+        :return: Serialized script.
+        :rtype: bytes
+        """
+
+        raw = self._raw
+        if raw is None:
+            raw = self._raw = unhexlify(self._content)
+        elif raw.__class__ is memoryview:
+            raw = self._raw = raw.tobytes()
+
+        return raw
+
+    def __getstate__(self):
+        # Raw slices (memoryviews) can't be copied nor pickled, so they are copied into bytes first.
+        state = self.__dict__.copy()
+        state['_raw'] = self._get_raw()
+        return state
+
+    @classmethod
+    def from_bytes(cls, raw_script):
+        """ Builds a script from its serialized (binary) representation. The given data is kept as is (e.g. a memoryview
+        slice of a whole serialized transaction is not copied) until the content of the script is accessed.
+
+        :param raw_script: Serialized script.
+        :type raw_script: bytes or memoryview
+        :return: Script object with the serialized script as it's content.
+        :rtype Script
+        """
+        script = cls()
+        script._content = None
+        script._raw = raw_script
+
+        return script
 
     @classmethod
     def from_hex(cls, hex_script):
@@ -63,18 +162,12 @@ class Script:
         :rtype: hex str
         """
 
-        start = "CScript(["
-        end = "])"
-
-        ps = CScript(unhexlify(script)).__repr__()
-        ps = ps[ps.index(start) + len(start): ps.index(end)].split(", ")
-
-        for i in range(len(ps)):
-            if ps[i].startswith('x('):
-                ps[i] = ps[i][3:-2]
-                ps[i] = '<' + ps[i] + '>'
-
-        return " ".join(ps)
+        try:
+            return " ".join([format_token(token) for token in tokenize(unhexlify(script))])
+        except Exception:
+            # Malformed scripts (e.g. truncated pushes, that may be found in coinbase transactions) are deserialized by
+            # python-bitcoinlib.
+            return _deserialize_cscript(script)
 
     @staticmethod
     def serialize(data):
@@ -85,16 +178,46 @@ class Script:
         :rtype: hex str
         """
 
-        hex_string = ""
-        for e in data.split(" "):
-            if e[0] == "<" and e[-1] == ">":
-                hex_string += hexlify(CScriptOp.encode_op_pushdata(unhexlify(e[1:-1])))
-            elif eval(e) in OPCODE_NAMES:
-                hex_string += format(eval(e), '02x')
-            else:
-                raise Exception
+        return "".join([encode_push(e[1:-1]) if e[:1] == "<" and e[-1:] == ">" else encode_op(e)
+                        for e in data.split(" ")])
+
+    def get_tokens(self):
+        """ Splits the script into its tokens (see tokenize). Tokens are only computed once, until the content of the
+        script changes.
+
+        :return: List of tokens, as (offset, opcode, pushed data) tuples.
+        :rtype: list of (int, int, bytes)
+        """
+
+        if self._tokens is None:
+            self._tokens = tokenize(self._get_raw())
+
+        return self._tokens
+
+    def get_elements(self):
+        """ Gets the human readable elements of the script (see deserialize). Elements are only computed once, until
+        the content of the script changes.
+
+        :return: List of elements.
+        :rtype: list of str
+        """
+
+        if self._elements is None:
+            try:
+                self._elements = [format_token(token) for token in self.get_tokens()]
+            except Exception:
+                self._elements = _deserialize_cscript(self.content).split()
 
-        return hex_string
+        return self._elements
+
+    def to_human(self):
+        """ Deserializes the script (goes from hex to human). See deserialize.
+
+        :return: Deserialized script.
+        :rtype: str
+        """
+
+        return " ".join(self.get_elements())
 
     def get_element(self, i):
         """
@@ -105,8 +228,20 @@ class Script:
         :rtype: str
         """
 
-        return Script.deserialize(self.content).split()[i]
+        return self.get_elements()[i]
+
+    def get_ops(self):
+        """ Splits the script into its operations (see parse_ops).
+
+        :return: List of operations, as (opcode, pushed data) pairs.
+        :rtype: list of (int, bytes)
+        """
+
+        return [(op, data) for offset, op, data in self.get_tokens()]
 
+    @abstractmethod
+    def match(self):
+        pass
 
     @abstractmethod
     def P2PK(self):
@@ -129,6 +264,13 @@ class InputScript(Script):
     """ Defines an InputScript (ScriptSig) class that inherits from script.
     """
 
+    @staticmethod
+    def match(raw_script):
+        """ Matches a serialized ScriptSig against the standard templates. See match_input_script.
+        """
+
+        return match_input_script(raw_script)
+
     @classmethod
     def P2PK(cls, signature):
         """ Pay-to-PubKey template 'constructor'. Builds a P2PK InputScript from a given signature.
@@ -142,7 +284,7 @@ class InputScript(Script):
         script = cls()
         if check_signature(signature):
             script.type = "P2PK"
-            script.content = script.serialize("<" + signature + ">")
+            script.content = serialize_template("<>", [signature])
 
         return script
 
@@ -162,7 +304,7 @@ class InputScript(Script):
         script = cls()
         if check_signature(signature) and check_public_key(pk):
             script.type = "P2PKH"
-            script.content = script.serialize("<" + signature + "> <" + pk + ">")
+            script.content = serialize_template("<> <>", [signature, pk])
 
         return script
 
@@ -177,13 +319,10 @@ class InputScript(Script):
         """
 
         script = cls()
-        s = "OP_0"
-        for sig in sigs:
-            if check_signature(sig):
-                s += " <" + sig + ">"
+        sigs = [sig for sig in sigs if check_signature(sig)]
 
         script.type = "P2MS"
-        script.content = script.serialize(s)
+        script.content = serialize_template("OP_0" + " <>" * len(sigs), sigs)
 
         return script
 
@@ -219,6 +358,13 @@ class OutputScript(Script):
     """ Defines an OutputScript (ScriptPubKey) class that inherits from script.
     """
 
+    @staticmethod
+    def match(raw_script):
+        """ Matches a serialized ScriptPubKey against the standard templates. See match_output_script.
+        """
+
+        return match_output_script(raw_script)
+
     @classmethod
     def P2PK(cls, pk):
         """ Pay-to-PubKey template 'constructor'. Builds a P2PK OutputScript from a given public key.
@@ -232,7 +378,7 @@ class OutputScript(Script):
         script = cls()
         if check_public_key(pk):
             script.type = "P2PK"
-            script.content = script.serialize("<"+pk+"> OP_CHECKSIG")
+            script.content = serialize_template("<> OP_CHECKSIG", [pk])
 
         return script
 
@@ -252,8 +398,8 @@ class OutputScript(Script):
             script = cls()
             if check_address(btc_addr, network):
                 script.type = "P2PKH"
-                script.content = script.serialize("OP_DUP OP_HASH160 <" + btc_addr_to_hash_160(btc_addr)
-                                                  + "> OP_EQUALVERIFY OP_CHECKSIG")
+                script.content = serialize_template("OP_DUP OP_HASH160 <> OP_EQUALVERIFY OP_CHECKSIG",
+                                                    [btc_addr_to_hash_160(btc_addr)])
 
             return script
         else:
@@ -281,13 +427,11 @@ class OutputScript(Script):
         elif m not in range(1, 15) or n not in range(1, 15):
             raise Exception("Multisig transactions must be 15-15 at max")
         else:
-            s = "OP_" + str(m)
-            for pk in pks:
-                if check_public_key(pk):
-                    s += " <" + pk + ">"
+            pks = [pk for pk in pks if check_public_key(pk)]
 
         script.type = "P2MS"
-        script.content = script.serialize(s + " OP_" + str(n) + " OP_CHECKMULTISIG")
+        script.content = serialize_template("OP_" + str(m) + " <>" * len(pks) + " OP_" + str(n) + " OP_CHECKMULTISIG",
+                                            pks)
 
         return script
 
@@ -307,6 +451,343 @@ class OutputScript(Script):
             raise Exception("Wrong RIPEMD-160 hash length: " + str(l))
         else:
             script.type = "P2SH"
-            script.content = script.serialize("OP_HASH160 <" + script_hash + "> OP_EQUAL")
+            script.content = serialize_template("OP_HASH160 <> OP_EQUAL", [script_hash])
+
+        return script
+
+    @classmethod
+    def P2WPKH(cls, pk_hash):
+        """ Pay-to-WitnessPubKeyHash template 'constructor'. Builds a (version 0) P2WPKH OutputScript from the hash160
+        of a compressed public key. Outputs of this type are redeemed with an empty ScriptSig, and the signature and
+        public key are provided in the witness of the input (see TX.sign).
+
+        :param pk_hash: Hash160 of the public key to which the output will be locked to.
+        :type pk_hash: hex str
+        :return: A P2WPKH ScriptPubKey built using the given public key hash.
+        :rtype: hex str
+        """
+
+        script = cls()
+        l = len(pk_hash)
+        if l != 40:
+            raise Exception("Wrong RIPEMD-160 hash length: " + str(l))
+        else:
+            script.type = "P2WPKH"
+            script.content = serialize_template("OP_0 <>", [pk_hash])
 
         return script
+
+
+def encode_op(name):
+    """ Serializes a single (non push) opcode, given its name (e.g. OP_DUP) or its value (e.g. 118 or 0x76).
+
+    :param name: Opcode name or value.
+    :type name: str
+    :return: Serialized opcode.
+    :rtype: hex str
+    """
+
+    op = OPCODES.get(name)
+    if op is None:
+        try:
+            op = int(name, 0)
+        except ValueError:
+            raise Exception("Unknown opcode: " + name)
+        if op not in OPCODE_NAMES:
+            raise Exception("Unknown opcode: " + name)
+        op = format(op, '02x')
+
+    return op
+
+
+def encode_push(data):
+    """ Serializes a data push, using the smallest push opcode that fits the data (as CScriptOp.encode_op_pushdata).
+
+    :param data: Data to be pushed.
+    :type data: hex str
+    :return: Serialized push.
+    :rtype: hex str
+    """
+
+    size = len(data) // 2
+    if size < OP_PUSHDATA1:
+        return format(size, '02x') + data
+    elif size <= 0xff:
+        return "4c" + format(size, '02x') + data
+    elif size <= 0xffff:
+        return "4d" + hexlify(pack("<H", size)) + data
+    else:
+        return "4e" + hexlify(pack("<I", size)) + data
+
+
+def get_template(template):
+    """ Compiles a script template (a human readable script where every piece of data is left as '<>'), splitting it
+    into the serialized chunks found between data pushes. Templates are only compiled once.
+
+    e.g: get_template('OP_DUP OP_HASH160 <> OP_EQUALVERIFY OP_CHECKSIG') = ['76a9', '88ac']
+
+    :param template: Script template.
+    :type template: str
+    :return: Serialized chunks (one more than the pushes in the template).
+    :rtype: list of hex str
+    """
+
+    chunks = _templates.get(template)
+    if chunks is None:
+        chunks = [""]
+        for e in template.split(" "):
+            if e == "<>":
+                chunks.append("")
+            else:
+                chunks[-1] += encode_op(e)
+        _templates[template] = chunks
+
+    return chunks
+
+
+def serialize_template(template, data):
+    """ Serializes a script template (see get_template) filling it with the given data.
+
+    e.g: serialize_template('<> OP_CHECKSIG', [pk]) = Script.serialize('<' + pk + '> OP_CHECKSIG')
+
+    :param template: Script template.
+    :type template: str
+    :param data: Data to be pushed, in the same order as the pushes in the template.
+    :type data: list of hex str
+    :return: Serialized script.
+    :rtype: hex str
+    """
+
+    chunks = get_template(template)
+    if len(data) != len(chunks) - 1:
+        raise Exception("The given data does not match the template pushes: " + str(len(data)) + "!=" +
+                        str(len(chunks) - 1))
+
+    serialized = [chunks[0]]
+    for d, chunk in zip(data, chunks[1:]):
+        serialized.append(encode_push(d))
+        serialized.append(chunk)
+
+    return "".join(serialized)
+
+
+def tokenize(raw_script):
+    """ Disassembles a serialized script into its tokens, walking the push opcodes directly. Data pushes (from OP_0 to
+    OP_PUSHDATA4) come along with the data they push, while the rest of opcodes come with None. Every token also
+    includes the offset of the script where it starts.
+
+    e.g: tokenize(unhexlify('76a914b34bbaac4e9606c9a8a6a720acaf3018c9bc77c988ac')) = [(0, 118, None), (1, 169, None),
+    (2, 20, '\xb3K\xba\xacN\x96\x06\xc9\xa8\xa6\xa7 \xac\xaf0\x18\xc9\xbcw\xc9'), (23, 136, None), (24, 172, None)]
+
+    :param raw_script: Serialized script.
+    :type raw_script: bytes
+    :return: List of tokens, as (offset, opcode, pushed data) tuples.
+    :rtype: list of (int, int, bytes)
+    """
+
+    tokens = []
+    offset = 0
+    try:
+        while offset < len(raw_script):
+            start = offset
+            op = ord(raw_script[offset])
+            offset += 1
+            if op > OP_PUSHDATA4:
+                tokens.append((start, op, None))
+                continue
+
+            if op < OP_PUSHDATA1:
+                size = op
+            elif op == OP_PUSHDATA1:
+                size = ord(raw_script[offset])
+                offset += 1
+            elif op == OP_PUSHDATA2:
+                size, = unpack_from("<H", raw_script, offset)
+                offset += 2
+            else:
+                size, = unpack_from("<I", raw_script, offset)
+                offset += 4
+
+            if offset + size > len(raw_script):
+                raise IndexError
+            tokens.append((start, op, raw_script[offset:offset + size]))
+            offset += size
+    except (IndexError, struct_error):
+        raise Exception("Wrong script. Pushed data exceeds the script length.")
+
+    return tokens
+
+
+def parse_ops(raw_script):
+    """ Splits a serialized script into its operations, as tokenize but with no offsets.
+
+    e.g: parse_ops(unhexlify('76a914b34bbaac4e9606c9a8a6a720acaf3018c9bc77c988ac')) = [(118, None), (169, None),
+    (20, '\xb3K\xba\xacN\x96\x06\xc9\xa8\xa6\xa7 \xac\xaf0\x18\xc9\xbcw\xc9'), (136, None), (172, None)]
+
+    :param raw_script: Serialized script.
+    :type raw_script: bytes
+    :return: List of operations, as (opcode, pushed data) pairs.
+    :rtype: list of (int, bytes)
+    """
+
+    return [(op, data) for offset, op, data in tokenize(raw_script)]
+
+
+def format_token(token):
+    """ Formats a script token (see tokenize) the same way python-bitcoinlib does: pushed data is escaped between '<'
+    '>', OP_0 and OP_1 to OP_16 are shown as numbers, and the rest of opcodes by their name.
+
+    :param token: Script token.
+    :type token: (int, int, bytes)
+    :return: Human readable token.
+    :rtype: str
+    """
+
+    offset, op, data = token
+
+    if op == OP_0:
+        return "0"
+    elif data is not None:
+        return "<" + hexlify(data) + ">"
+    elif OP_1 <= op <= OP_16:
+        return str(op - OP_1 + 1)
+    else:
+        return _OPCODE_NAMES.get(op) or "CScriptOp(" + format(op, '#04x') + ")"
+
+
+def _deserialize_cscript(script):
+    """ Deserializes a script using python-bitcoinlib's CScript representation. Only used for malformed scripts.
+
+    :param script: Serialized script to be deserialized.
+    :type script: hex str
+    :return: Deserialized script
+    :rtype: hex str
+    """
+
+    start = "CScript(["
+    end = "])"
+
+    ps = CScript(unhexlify(script)).__repr__()
+    ps = ps[ps.index(start) + len(start): ps.index(end)].split(", ")
+
+    for i in range(len(ps)):
+        if ps[i].startswith('x('):
+            ps[i] = ps[i][3:-2]
+            ps[i] = '<' + ps[i] + '>'
+
+    return " ".join(ps)
+
+
+def is_signature(data):
+    """ Checks whether some pushed data is formatted as a DER signature followed by its hash type.
+
+    :param data: Pushed data.
+    :type data: bytes
+    :return: True if the data looks like a signature, False otherwise.
+    :rtype: bool
+    """
+
+    return 9 <= len(data) <= 73 and data[0] == "\x30" and ord(data[1]) == len(data) - 3
+
+
+def is_pk(data):
+    """ Checks whether some pushed data is formatted as an (either compressed or uncompressed) public key.
+
+    :param data: Pushed data.
+    :type data: bytes
+    :return: True if the data looks like a public key, False otherwise.
+    :rtype: bool
+    """
+
+    return (len(data) == 33 and data[0] in "\x02\x03") or (len(data) == 65 and data[0] == "\x04")
+
+
+def match_output_script(raw_script):
+    """ Matches a serialized ScriptPubKey against the standard templates, straight from its bytes. The most common
+    templates (P2PKH, P2SH, P2PK and the version 0 witness programs) are identified by their fixed length and bytes,
+    while the rest are split into operations first (see parse_ops).
+
+    e.g: match_output_script(unhexlify('76a914b34bbaac4e9606c9a8a6a720acaf3018c9bc77c988ac')) = ('P2PKH',
+    ['\xb3K\xba\xacN\x96\x06\xc9\xa8\xa6\xa7 \xac\xaf0\x18\xc9\xbcw\xc9'])
+
+    :param raw_script: Serialized script.
+    :type raw_script: bytes
+    :return: The script type (P2PKH, P2SH, P2PK, P2WPKH, P2WSH, P2MS, nulldata or unknown) and the data it pushes, in
+    order. Small integers (m and n in P2MS) are given as int.
+    :rtype: str, list
+    """
+
+    size = len(raw_script)
+
+    # P2PKH: OP_DUP OP_HASH160 <20-byte hash> OP_EQUALVERIFY OP_CHECKSIG
+    if size == 25 and raw_script[:3] == "\x76\xa9\x14" and raw_script[23:] == "\x88\xac":
+        return "P2PKH", [raw_script[3:23]]
+    # P2SH: OP_HASH160 <20-byte hash> OP_EQUAL
+    elif size == 23 and raw_script[:2] == "\xa9\x14" and raw_script[22] == "\x87":
+        return "P2SH", [raw_script[2:22]]
+    # P2PK: <pk> OP_CHECKSIG
+    elif size in [35, 67] and ord(raw_script[0]) == size - 2 and raw_script[-1] == "\xac" and is_pk(raw_script[1:-1]):
+        return "P2PK", [raw_script[1:-1]]
+    # P2WPKH: OP_0 <20-byte hash>
+    elif size == 22 and raw_script[:2] == "\x00\x14":
+        return "P2WPKH", [raw_script[2:]]
+    # P2WSH: OP_0 <32-byte hash>
+    elif size == 34 and raw_script[:2] == "\x00\x20":
+        return "P2WSH", [raw_script[2:]]
+
+    try:
+        ops = parse_ops(raw_script)
+    except Exception:
+        return "unknown", []
+
+    # Null data: OP_RETURN <data> (push only)
+    if size and raw_script[0] == "\x6a":
+        if all(data is not None for op, data in ops[1:]):
+            return "nulldata", [data for op, data in ops[1:]]
+    # P2MS: OP_m <pk_1> ... <pk_n> OP_n OP_CHECKMULTISIG
+    elif len(ops) > 3 and ops[-1][0] == OP_CHECKMULTISIG and OP_1 <= ops[0][0] <= OP_16 and \
+            OP_1 <= ops[-2][0] <= OP_16:
+        m = ops[0][0] - OP_1 + 1
+        n = ops[-2][0] - OP_1 + 1
+        pks = [data for op, data in ops[1:-2]]
+        if m <= n == len(pks) and all(data is not None and is_pk(data) for data in pks):
+            return "P2MS", [m] + pks + [n]
+
+    return "unknown", []
+
+
+def match_input_script(raw_script):
+    """ Matches a serialized ScriptSig against the standard templates, straight from its bytes. ScriptSigs have no fixed
+    layout, so they are identified by the number and format of the data they push:
+        - P2PK: <sig>
+        - P2PKH: <sig> <pk>
+        - P2MS: OP_0 <sig_1> ... <sig_m>
+        - P2SH: <data_1> ... <data_k> <redeem_script>, where the redeem script is a standard (non P2SH) ScriptPubKey.
+
+    :param raw_script: Serialized script.
+    :type raw_script: bytes
+    :return: The script type (P2PK, P2PKH, P2MS, P2SH or unknown) and the data it pushes, in order (OP_0 pushes an
+    empty string).
+    :rtype: str, list
+    """
+
+    try:
+        ops = parse_ops(raw_script)
+    except Exception:
+        return "unknown", []
+
+    pushes = [data for op, data in ops]
+    if not pushes or None in pushes:
+        # Standard ScriptSigs are push only.
+        return "unknown", []
+
+    if len(pushes) == 1 and is_signature(pushes[0]):
+        return "P2PK", pushes
+    elif len(pushes) == 2 and is_signature(pushes[0]) and is_pk(pushes[1]):
+        return "P2PKH", pushes
+    elif len(pushes) > 1 and ops[0][0] == OP_0 and all(is_signature(data) for data in pushes[1:]):
+        return "P2MS", pushes
+    elif match_output_script(pushes[-1])[0] in ["P2PK", "P2PKH", "P2MS"]:
+        return "P2SH", pushes
+
+    return "unknown", []
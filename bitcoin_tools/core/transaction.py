@@ -1,14 +1,64 @@
 from binascii import unhexlify, hexlify
 from copy import deepcopy
 from hashlib import sha256
+from multiprocessing import Pool
+from struct import Struct, error as struct_error
 
 from ecdsa import SigningKey
 
-from bitcoin_tools.core.keys import serialize_pk, ecdsa_tx_sign
-from bitcoin_tools.core.script import InputScript, OutputScript, Script, SIGHASH_ALL, SIGHASH_SINGLE, SIGHASH_NONE, \
-    SIGHASH_ANYONECANPAY
+from bitcoin_tools.core.hashing import double_sha256
+from bitcoin_tools.core.keys import serialize_pk, ecdsa_sighash_sign_batch, ecdsa_verify_sighash
+from bitcoin_tools.core.prevouts import BlockcypherResolver
+from bitcoin_tools.core.script import Script, InputScript, OutputScript, SIGHASH_ALL, SIGHASH_SINGLE, SIGHASH_NONE, \
+    SIGHASH_ANYONECANPAY, match_output_script
+from bitcoin_tools.profiling import profiled
 from bitcoin_tools.utils import change_endianness, encode_varint, int2bytes, is_public_key, is_btc_addr, \
-    parse_element, parse_varint, get_prev_ScriptPubKey
+    get_prev_ScriptPubKey, pack_varint, Reader, Writer, UINT32, UINT32_BE, UINT64
+from bitcoin_tools.wallet import hash_160
+
+# Outpoint: hash of the previous transaction (LE) and output index.
+OUTPOINT = Struct("<32sI")
+
+
+class _FieldList(list):
+    """ List of per-input or per-output values of a transaction (e.g. TX.prev_tx_id) that counts how many times it has
+    been modified, so the caches built from it can be validated without comparing (nor serializing) its values again.
+    Only the list itself is tracked: its items are expected to be replaced, not modified in place (scripts are tracked
+    on their own, see Script.modifications, but witness stacks are not, see TX.clear_cache).
+    """
+
+    # Number of modifications (set on the instance the first time the list is modified, so lists are built as fast as
+    # plain ones).
+    changes = 0
+
+    def __reduce__(self):
+        # Copies (and unpickled lists) are built from their values, as new lists, and keep the modification count (so
+        # the caches copied along with them are still validated against it).
+        return _FieldList, (list(self),), self.__dict__
+
+
+def _tracked(name):
+    """ Wraps a list method so every call to it is counted as a modification (see _FieldList).
+
+    :param name: Name of the list method.
+    :type name: str
+    :return: The wrapped method.
+    :rtype: function
+    """
+
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        self.changes += 1
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ["__setitem__", "__delitem__", "__setslice__", "__delslice__", "__iadd__", "__imul__", "append", "extend",
+              "insert", "pop", "remove", "reverse", "sort"]:
+    setattr(_FieldList, _name, _tracked(_name))
 
 
 class TX:
@@ -21,18 +71,35 @@ class TX:
         self.inputs = None
         self.outputs = None
         self.nLockTime = None
-        self.prev_tx_id = []
-        self.prev_out_index = []
-        self.scriptSig = []
+        # The fields the serialization and the signature hashes depend on are tracked (see _FieldList, _get_state and
+        # _get_sighash_key).
+        self.prev_tx_id = _FieldList()
+        self.prev_out_index = _FieldList()
+        self.scriptSig = _FieldList()
         self.scriptSig_len = []
-        self.nSequence = []
-        self.value = []
-        self.scriptPubKey = []
+        self.nSequence = _FieldList()
+        self.value = _FieldList()
+        self.scriptPubKey = _FieldList()
         self.scriptPubKey_len = []
+        # Witness (BIP141) of every input: the list of its stack items. Empty for non-segwit inputs.
+        self.witness = _FieldList()
 
         self.offset = 0
         self.hex = ""
 
+        # Serialization cache. Every section (version, each input, each output, each witness and nLockTime) is stored
+        # along with the field values it was built from, so only the sections whose fields have changed are serialized
+        # again. Inputs, outputs and witnesses are also stored as groups, along with the state of their fields (see
+        # _get_state), so they are not even checked unless some of those fields have been modified. The last assembled
+        # transaction (and its hash) is kept as well, both with and without witness data.
+        self._section_cache = dict()
+        self._input_cache = []
+        self._output_cache = []
+        self._witness_cache = []
+        self._serialized_cache = dict()
+        self._sighash_engine = None
+        self._segwit_sighash_engine = None
+
     @classmethod
     def build_from_hex(cls, hex_tx):
         """
@@ -92,8 +159,8 @@ class TX:
 
             # INPUTS
             tx.inputs = len(prev_tx_id)
-            tx.prev_tx_id = prev_tx_id
-            tx.prev_out_index = prev_out_index
+            tx.prev_tx_id = _FieldList(prev_tx_id)
+            tx.prev_out_index = _FieldList(prev_out_index)
 
             for i in range(tx.inputs):
                 # ScriptSig
@@ -101,6 +168,7 @@ class TX:
                 tx.scriptSig.append(scriptSig[i])
 
                 tx.nSequence.append(pow(2, 32) - 1)  # ffffffff
+                tx.witness.append([])
 
             # OUTPUTS
             tx.outputs = len(scriptPubKey)
@@ -208,6 +276,7 @@ class TX:
         return tx
 
     @classmethod
+    @profiled("deserialize")
     def deserialize(cls, hex_tx):
         """ Builds a transaction object from the hexadecimal serialization format of a transaction that
         could be obtained, for example, from a blockexplorer.
@@ -218,88 +287,396 @@ class TX:
         :rtype: TX
         """
 
-        tx = cls()
+        tx = cls.from_bytes(unhexlify(hex_tx))
         tx.hex = hex_tx
 
-        tx.version = int(change_endianness(parse_element(tx, 4)), 16)
+        return tx
 
-        # INPUTS
-        tx.inputs = int(parse_varint(tx), 16)
+    @classmethod
+    def from_bytes(cls, raw_tx):
+        """ Builds a transaction object from the binary serialization format of a transaction (e.g: data read from a
+        block file or received from a node).
 
-        for i in range(tx.inputs):
-            tx.prev_tx_id.append(change_endianness(parse_element(tx, 32)))
-            tx.prev_out_index.append(int(change_endianness(parse_element(tx, 4)), 16))
-            # ScriptSig
-            tx.scriptSig_len.append(int(parse_varint(tx), 16))
-            tx.scriptSig.append(InputScript.from_hex(parse_element(tx, tx.scriptSig_len[i])))
-            tx.nSequence.append(int(parse_element(tx, 4), 16))
+        :param raw_tx: Binary serialized transaction.
+        :type raw_tx: bytes
+        :return: The transaction build using the provided serialized transaction.
+        :rtype: TX
+        """
+
+        tx, offset = cls.parse(raw_tx)
+
+        if offset != len(raw_tx):
+            raise Exception("There is some error in the serialized transaction passed as input. Transaction can't"
+                            " be built")
+
+        tx.hex = hexlify(raw_tx)
+
+        return tx
+
+    @classmethod
+    def parse(cls, raw, offset=0):
+        """ Parses a binary serialized transaction starting at a given offset of a buffer (that may contain more data
+        after the transaction, such as a serialized block). See read.
+
+        :param raw: Buffer containing the serialized transaction.
+        :type raw: bytes, bytearray, buffer or memoryview
+        :param offset: Offset of the buffer where the transaction starts.
+        :type offset: int
+        :return: The parsed transaction, and the offset of the buffer right after it.
+        :rtype: TX, int
+        """
+
+        reader = Reader(raw, offset)
+        tx = cls.read(reader)
+
+        return tx, reader.offset
+
+    @classmethod
+    def read(cls, reader):
+        """ Reads a binary serialized transaction from a reader, leaving it right after the transaction. Fields are read
+        straight from the buffer, in a single pass, and scripts are kept as (zero-copy) slices of it until their content
+        is accessed. Both legacy and segwit (BIP144) serialization formats are supported.
+
+        :param reader: Reader positioned where the transaction starts.
+        :type reader: Reader
+        :return: The parsed transaction.
+        :rtype: TX
+        """
+
+        tx = cls()
+        read_struct, read_var_slice = reader.read_struct, reader.read_var_slice
+        # Tracked fields (see _FieldList) are filled through list.append, since there is nothing cached for a new
+        # transaction yet.
+        append = list.append
+        prev_tx_ids, prev_out_indexes, script_sigs, sequences, values, scripts, witnesses = tx.prev_tx_id, \
+            tx.prev_out_index, tx.scriptSig, tx.nSequence, tx.value, tx.scriptPubKey, tx.witness
+
+        try:
+            tx.version = reader.read_uint32()
+
+            # INPUTS
+            tx.inputs = reader.read_varint()
+
+            # Segwit transactions have a marker (0x00, that would otherwise be an empty list of inputs) followed by a
+            # flag (0x01) right after the version.
+            segwit = False
+            if tx.inputs == 0:
+                if reader.read_uint8() == 1:
+                    segwit = True
+                    tx.inputs = reader.read_varint()
+                else:
+                    reader.offset -= 1
 
-        # OUTPUTS
-        tx.outputs = int(parse_varint(tx), 16)
+            for i in range(tx.inputs):
+                # Outpoint: 32-byte hash of the previous tx (LE) and 4-byte output index.
+                prev_tx_id, prev_out_index = read_struct(OUTPOINT)
+                append(prev_tx_ids, hexlify(prev_tx_id[::-1]))
+                append(prev_out_indexes, prev_out_index)
+                # ScriptSig
+                script = read_var_slice()
+                tx.scriptSig_len.append(len(script))
+                append(script_sigs, InputScript.from_bytes(script))
+                # nSequence is stored as it is found in the serialized transaction (not swapped).
+                append(sequences, read_struct(UINT32_BE)[0])
 
-        for i in range(tx.outputs):
-            tx.value.append(int(change_endianness(parse_element(tx, 8)), 16))
-            # ScriptPubKey
-            tx.scriptPubKey_len.append(int(parse_varint(tx), 16))
-            tx.scriptPubKey.append(OutputScript.from_hex(parse_element(tx, tx.scriptPubKey_len[i])))
+            # OUTPUTS
+            tx.outputs = reader.read_varint()
 
-        tx.nLockTime = int(parse_element(tx, 4), 16)
+            for i in range(tx.outputs):
+                append(values, read_struct(UINT64)[0])
+                # ScriptPubKey
+                script = read_var_slice()
+                tx.scriptPubKey_len.append(len(script))
+                append(scripts, OutputScript.from_bytes(script))
+
+            # WITNESSES (one stack per input)
+            if segwit:
+                read_var_bytes = reader.read_var_bytes
+                for i in range(tx.inputs):
+                    append(witnesses, [read_var_bytes() for j in range(reader.read_varint())])
+            else:
+                list.extend(witnesses, [[] for i in range(tx.inputs)])
+
+            # As well as nSequence, nLockTime is stored as it is found in the serialized transaction.
+            tx.nLockTime = reader.read_uint32_be()
 
-        if tx.offset != len(tx.hex):
+        except struct_error:
             raise Exception("There is some error in the serialized transaction passed as input. Transaction can't"
                             " be built")
-        else:
-            tx.offset = 0
 
         return tx
 
-    def serialize(self, rtype=hex):
+    @profiled("serialize")
+    def serialize(self, rtype=hex, witness=True):
         """ Serialize all the transaction fields arranged in the proper order, resulting in a hexadecimal string
         ready to be broadcast to the network.
 
+        Transactions with witness data are serialized following BIP144 (marker, flag and a witness per input), unless
+        witness is set to False (e.g. to compute their id).
+
         :param self: self
         :type self: TX
         :param rtype: Whether the serialized transaction is returned as a hex str or a byte array.
         :type rtype: hex or bool
+        :param witness: Whether the witness data (if any) is serialized or not.
+        :type witness: bool
         :return: Serialized transaction representation (hexadecimal or bin depending on rtype parameter).
         :rtype: hex str / bin
         """
 
         if rtype not in [hex, bin]:
             raise Exception("Invalid return type (rtype). It should be either hex or bin.")
-        serialized_tx = change_endianness(int2bytes(self.version, 4))  # 4-byte version number (LE).
 
-        # INPUTS
-        serialized_tx += encode_varint(self.inputs)  # Varint number of inputs.
+        cache = self._serialize(witness)
 
-        for i in range(self.inputs):
-            serialized_tx += change_endianness(self.prev_tx_id[i])  # 32-byte hash of the previous transaction (LE).
-            serialized_tx += change_endianness(int2bytes(self.prev_out_index[i], 4))  # 4-byte output index (LE)
-            serialized_tx += encode_varint(len(self.scriptSig[i].content) / 2)   # Varint input script length.
-            # ScriptSig
-            serialized_tx += self.scriptSig[i].content  # Input script.
-            serialized_tx += int2bytes(self.nSequence[i], 4)  # 4-byte sequence number.
-
-        # OUTPUTS
-        serialized_tx += encode_varint(self.outputs)  # Varint number of outputs.
-
-        if self.outputs != 0:
-            for i in range(self.outputs):
-                serialized_tx += change_endianness(int2bytes(self.value[i], 8))  # 8-byte field Satoshi value (LE)
-                # ScriptPubKey
-                serialized_tx += encode_varint(len(self.scriptPubKey[i].content) / 2)   # Varint Output script length.
-                serialized_tx += self.scriptPubKey[i].content  # Output script.
+        # If return type has been set to hex, the serialized transaction is converted.
+        if rtype is hex:
+            if cache[2] is None:
+                cache[2] = hexlify(cache[1])
+            return cache[2]
+
+        return cache[1]
+
+    def _serialize(self, witness):
+        """ Serializes the transaction using the serialization cache (see serialize). Every group of sections (inputs,
+        outputs and witnesses) is only checked again if some of the fields it is built from has been modified (see
+        _get_state), and only the sections whose values have actually changed are serialized again. Therefore, an
+        unchanged transaction is not serialized (nor checked) again at all.
+
+        :param witness: Whether the witness data (if any) is serialized or not.
+        :type witness: bool
+        :return: The cache entry of the serialized transaction: the sections it has been assembled from, the serialized
+        transaction, and its hex encoding and hash (None until they are requested).
+        :rtype: list
+        """
+
+        try:
+            # 4-byte version number (LE).
+            version = self._get_section("version", self.version, lambda: UINT32.pack(self.version))
+
+            # INPUTS (varint number of inputs followed by every input).
+            inputs = self._get_section("inputs", self._get_state(self.inputs, self.prev_tx_id, self.prev_out_index,
+                                                                 self.scriptSig, self.nSequence), self._serialize_inputs)
+
+            # OUTPUTS (varint number of outputs followed by every output).
+            outputs = self._get_section("outputs", self._get_state(self.outputs, self.value, self.scriptPubKey),
+                                        self._serialize_outputs)
+
+            # 4-byte lock time field (stored as it is found in the serialized transaction, not swapped).
+            lock_time = self._get_section("nLockTime", self.nLockTime, lambda: UINT32_BE.pack(self.nLockTime))
+
+            # WITNESSES (None for transactions with no witness data).
+            witnesses = None
+            if witness:
+                witnesses = self._get_section("witnesses", self._get_state(self.inputs, self.witness),
+                                              self._serialize_witnesses)
+        except struct_error:
+            raise Exception("Some field of the transaction is out of range. Transaction can't be serialized.")
+
+        # The transaction is only assembled again if some of its sections has changed (unchanged groups are the very
+        # same lists, so they are compared by identity).
+        segwit = witnesses is not None
+        sections = (version, inputs, outputs, lock_time, witnesses)
+        cache = self._serialized_cache.get(segwit)
+        if cache is None or cache[0] != sections:
+            if segwit:
+                # Marker and flag go right after the version, and witnesses right before nLockTime.
+                serialized = "".join([version, "\x00\x01"] + inputs + outputs + witnesses + [lock_time])
+            else:
+                serialized = "".join([version] + inputs + outputs + [lock_time])
+            cache = self._serialized_cache[segwit] = [sections, serialized, None, None]
+
+        return cache
+
+    def _get_state(self, count, *fields):
+        """ Gets the state of a group of fields (e.g. every per-input field), used to check in constant time whether the
+        sections built from them are still valid. Tracked fields (see _FieldList) are represented by their modification
+        count, and scripts by the number of modifications of any script (see Script.modifications).
+
+        :param count: Number of items of the group (e.g. the number of inputs).
+        :type count: int
+        :param fields: Fields of the group.
+        :type fields: list
+        :return: The state of the fields, or None if some of them has been replaced by a plain list (so it can't be
+        known whether they have changed).
+        :rtype: list or None
+        """
+
+        state = [count, Script.modifications]
+        for values in fields:
+            if values.__class__ is not _FieldList:
+                return None
+            state += [values, values.changes]
+
+        return state
+
+    def _serialize_inputs(self):
+        """ Serializes the inputs of the transaction (using the serialization cache of every input).
+
+        :return: The varint number of inputs followed by every serialized input.
+        :rtype: list of bytes
+        """
+
+        del self._input_cache[self.inputs:]
+
+        return [pack_varint(self.inputs)] + [self._serialize_input(i) for i in range(self.inputs)]
+
+    def _serialize_outputs(self):
+        """ Serializes the outputs of the transaction (using the serialization cache of every output).
+
+        :return: The varint number of outputs followed by every serialized output.
+        :rtype: list of bytes
+        """
 
-        serialized_tx += int2bytes(self.nLockTime, 4)  # 4-byte lock time field
+        del self._output_cache[self.outputs:]
 
-        # If return type has been set to binary, the serialized transaction is converted.
-        if rtype is bin:
-            serialized_tx = unhexlify(serialized_tx)
+        return [pack_varint(self.outputs)] + [self._serialize_output(i) for i in range(self.outputs)]
 
-        return serialized_tx
+    def _serialize_witnesses(self):
+        """ Serializes the witnesses of the transaction (using the serialization cache of every witness).
+
+        :return: Every serialized witness, or None if the transaction has no witness data.
+        :rtype: list of bytes or None
+        """
+
+        if not self.has_witness():
+            return None
+
+        del self._witness_cache[self.inputs:]
+
+        return [self._serialize_witness(i) for i in range(self.inputs)]
+
+    def clear_cache(self):
+        """ Drops every cached serialization (and signature hash engine) of the transaction, so they are computed from
+        scratch the next time they are needed (e.g. after modifying some script in place).
+
+        :return: None.
+        :rtype: None
+        """
+
+        self._section_cache = dict()
+        self._input_cache = []
+        self._output_cache = []
+        self._witness_cache = []
+        self._serialized_cache = dict()
+        self._sighash_engine = None
+        self._segwit_sighash_engine = None
+
+    def has_witness(self):
+        """ Checks whether any input of the transaction has witness data (i.e. whether it is a segwit transaction).
+
+        :return: True if some input has a non-empty witness, False otherwise.
+        :rtype: bool
+        """
+
+        return any(self.witness[:self.inputs])
+
+    def _serialize_witness(self, i):
+        """ Serializes the witness of the ith input of the transaction (using the serialization cache).
+
+        :param i: Index of the input.
+        :type i: int
+        :return: The serialized witness: number of stack items followed by every item (varint prefixed).
+        :rtype: bytes
+        """
+
+        key = tuple(self.witness[i]) if i < len(self.witness) else ()
+
+        if i < len(self._witness_cache) and self._witness_cache[i][0] == key:
+            return self._witness_cache[i][1]
+
+        w = Writer()
+        w.write_varint(len(key))
+        for item in key:
+            w.write_var_bytes(item)
+        serialized_witness = w.get_value()
+
+        if i < len(self._witness_cache):
+            self._witness_cache[i] = (key, serialized_witness)
+        else:
+            self._witness_cache.append((key, serialized_witness))
+
+        return serialized_witness
+
+    def _get_section(self, name, key, build):
+        """ Gets a serialized section (or group of sections) of the transaction from the cache, building it again only
+        if the values it was built from have changed.
+
+        :param name: Name of the section.
+        :type name: str
+        :param key: Field value(s) (or state, see _get_state) the section is built from. None if it can't be known,
+        so the section is always built.
+        :type key: object
+        :param build: Function that serializes the section.
+        :type build: function
+        :return: The serialized section.
+        :rtype: bytes or list of bytes
+        """
+
+        cache = self._section_cache.get(name)
+        if key is None or cache is None or cache[0] != key:
+            cache = self._section_cache[name] = (key, build())
+
+        return cache[1]
+
+    def _serialize_input(self, i):
+        """ Serializes the ith input of the transaction (using the serialization cache).
+
+        :param i: Index of the input.
+        :type i: int
+        :return: The serialized input.
+        :rtype: bytes
+        """
+
+        script = self.scriptSig[i]._get_raw()
+        key = (self.prev_tx_id[i], self.prev_out_index[i], script, self.nSequence[i])
+
+        if i < len(self._input_cache) and self._input_cache[i][0] == key:
+            return self._input_cache[i][1]
+
+        w = Writer()
+        # Outpoint: 32-byte hash of the previous tx (LE) and 4-byte output index (LE).
+        w.write_struct(OUTPOINT, unhexlify(self.prev_tx_id[i])[::-1], self.prev_out_index[i])
+        w.write_var_bytes(script)  # Varint input script length and input script.
+        w.write_uint32_be(self.nSequence[i])  # 4-byte sequence number.
+        serialized_input = w.get_value()
+
+        if i < len(self._input_cache):
+            self._input_cache[i] = (key, serialized_input)
+        else:
+            self._input_cache.append((key, serialized_input))
+
+        return serialized_input
+
+    def _serialize_output(self, i):
+        """ Serializes the ith output of the transaction (using the serialization cache).
+
+        :param i: Index of the output.
+        :type i: int
+        :return: The serialized output.
+        :rtype: bytes
+        """
+
+        script = self.scriptPubKey[i]._get_raw()
+        key = (self.value[i], script)
+
+        if i < len(self._output_cache) and self._output_cache[i][0] == key:
+            return self._output_cache[i][1]
+
+        w = Writer()
+        w.write_uint64(self.value[i])  # 8-byte field Satoshi value (LE)
+        w.write_var_bytes(script)  # Varint output script length and output script.
+        serialized_output = w.get_value()
+
+        if i < len(self._output_cache):
+            self._output_cache[i] = (key, serialized_output)
+        else:
+            self._output_cache.append((key, serialized_output))
+
+        return serialized_output
 
     def get_txid(self, rtype=hex, endianness="LE"):
-        """ Computes the transaction id (i.e: transaction hash for non-segwit txs).
+        """ Computes the transaction id (i.e: transaction hash for non-segwit txs). Witness data is not part of the id.
         :param rtype: Defines the type of return, either hex str or bytes.
         :type rtype: str or bin
         :param endianness: Whether the id is returned in BE (Big endian) or LE (Little Endian) (default one)
@@ -308,26 +685,167 @@ class TX:
         :rtype: hex str or bin, depending on rtype parameter.
         """
 
+        return self._get_hash(False, rtype, endianness)
+
+    def get_wtxid(self, rtype=hex, endianness="LE"):
+        """ Computes the witness transaction id (BIP141): the hash of the transaction including its witness data. It
+        matches the transaction id for non-segwit transactions.
+        :param rtype: Defines the type of return, either hex str or bytes.
+        :type rtype: str or bin
+        :param endianness: Whether the id is returned in BE (Big endian) or LE (Little Endian) (default one)
+        :type endianness: str
+        :return: The witness transaction id.
+        :rtype: hex str or bin, depending on rtype parameter.
+        """
+
+        return self._get_hash(True, rtype, endianness)
+
+    def _get_hash(self, witness, rtype, endianness):
+        """ Computes the hash of the serialized transaction, either with or without its witness data (see get_txid and
+        get_wtxid).
+
+        :param witness: Whether the witness data (if any) is hashed or not.
+        :type witness: bool
+        :param rtype: Defines the type of return, either hex str or bytes.
+        :type rtype: str or bin
+        :param endianness: Whether the hash is returned in BE (Big endian) or LE (Little Endian)
+        :type endianness: str
+        :return: The hash of the transaction.
+        :rtype: hex str or bin, depending on rtype parameter.
+        """
+
         if rtype not in [hex, bin]:
             raise Exception("Invalid return type (rtype). It should be either hex or bin.")
         if endianness not in ["BE", "LE"]:
             raise Exception("Invalid endianness type. It should be either BE or LE.")
 
+        # The hash is only computed again if the transaction has changed since the last time it was serialized.
+        cache = self._serialize(witness)
+        if cache[3] is None:
+            cache[3] = double_sha256(cache[1])
+
+        tx_id = cache[3]
+        if endianness == "BE":
+            tx_id = tx_id[::-1]
         if rtype is hex:
-            tx_id = hexlify(sha256(sha256(self.serialize(rtype=bin)).digest()).digest())
-            if endianness == "BE":
-                tx_id = change_endianness(tx_id)
-        else:
-            tx_id = sha256(sha256(self.serialize(rtype=bin)).digest()).digest()
-            if endianness == "BE":
-                tx_id = unhexlify(change_endianness(hexlify(tx_id)))
+            tx_id = hexlify(tx_id)
 
         return tx_id
 
-    def sign(self, sk, index, hashflag=SIGHASH_ALL, compressed=True, orphan=False, deterministic=True, network='test'):
+    def _get_sighash_key(self):
+        """ Gets the state of the fields the signature hashes depend on (every field but the input scripts and
+        witnesses), used to check whether the sighash engines are still valid. Tracked fields (see _FieldList) are
+        represented by their modification count, so the check takes constant time. Fields replaced by plain lists are
+        represented by their values.
+
+        :return: State of the fields.
+        :rtype: tuple
+        """
+
+        key = [self.version, self.inputs, self.outputs, self.nLockTime]
+        for values in (self.prev_tx_id, self.prev_out_index, self.nSequence, self.value):
+            if values.__class__ is _FieldList:
+                key += [values, values.changes]
+            else:
+                key.append(tuple(values))
+
+        if self.scriptPubKey.__class__ is _FieldList:
+            key += [self.scriptPubKey, self.scriptPubKey.changes]
+        else:
+            key.append(tuple([script._get_raw() for script in self.scriptPubKey]))
+
+        return tuple(key)
+
+    def get_sighash(self, index, script_code, hashflag=SIGHASH_ALL):
+        """ Computes the (legacy) signature hash of a given input: the double-sha256 of the transaction in its
+        signature format (see signature_format) followed by the hash type.
+
+        The transaction is not copied nor serialized again for every input. Its fields are serialized once (and reused
+        as long as they do not change), and every signature hash is computed, and cached, only once per input, script
+        and hash type. Input scripts are not part of the signature hash, so signing an input does not invalidate the
+        cached hashes of the others.
+
+        :param index: The index of the input to be signed.
+        :type index: int
+        :param script_code: OutputScript from the UTXO that will be redeemed by the input.
+        :type script_code: hex str
+        :param hashflag: Hash type to be used.
+        :type hashflag: int
+        :return: The signature hash.
+        :rtype: bytes
+        """
+
+        key = self._get_sighash_key()
+        if self._sighash_engine is None or self._sighash_engine.key != key:
+            self._sighash_engine = _SighashEngine(self, key)
+
+        return self._sighash_engine.get_sighash(index, script_code, hashflag)
+
+    def get_segwit_sighash(self, index, script_code, amount, hashflag=SIGHASH_ALL):
+        """ Computes the (BIP143) signature hash of a given segwit input, which commits to the value of the UTXO it
+        redeems.
+
+        The hashes of all the outpoints, sequences and outputs (hashPrevouts, hashSequence and hashOutputs) are computed
+        once per transaction (and reused as long as its fields do not change), so every input only hashes its own fields
+        and signing a transaction takes linear time in its number of inputs.
+
+        :param index: The index of the input to be signed.
+        :type index: int
+        :param script_code: Script code of the input (for P2WPKH inputs, the P2PKH script of the public key hash).
+        :type script_code: hex str
+        :param amount: Value (in Satoshis) of the UTXO redeemed by the input.
+        :type amount: int
+        :param hashflag: Hash type to be used.
+        :type hashflag: int
+        :return: The signature hash.
+        :rtype: bytes
+        """
+
+        key = self._get_sighash_key()
+        if self._segwit_sighash_engine is None or self._segwit_sighash_engine.key != key:
+            self._segwit_sighash_engine = _SegwitSighashEngine(self, key)
+
+        return self._segwit_sighash_engine.get_sighash(index, script_code, amount, hashflag)
+
+    def get_prev_scripts(self, index, prevouts=None, resolver=None, network='test'):
+        """ Gets the OutputScripts of the UTXOs redeemed by some inputs of the transaction. The ones that are not
+        provided are resolved, all of them at once, using the given resolver.
+
+        :param index: Indexes of the inputs.
+        :type index: list of int
+        :param prevouts: Known OutputScripts, indexed by the index of the input that redeems them.
+        :type prevouts: dict(index, OutputScript)
+        :param resolver: Resolver used to find the missing UTXOs. BlockcypherResolver (for the given network) by default.
+        :type resolver: PrevoutResolver
+        :param network: Network in which the UTXOs can be found (either main or test), if no resolver is given.
+        :type network: str
+        :return: The OutputScripts, in the same order as the indexes.
+        :rtype: list of Script
+        """
+
+        prev_scripts = [prevouts.get(i) if prevouts else None for i in index]
+        missing = [j for j in range(len(index)) if not prev_scripts[j]]
+        if missing:
+            if resolver is None:
+                resolver = BlockcypherResolver(network)
+            outpoints = [(self.prev_tx_id[index[j]], self.prev_out_index[index[j]]) for j in missing]
+            for j, prevout in zip(missing, resolver.resolve(outpoints)):
+                if prevout is None:
+                    raise Exception("The UTXO redeemed by input " + str(index[j]) + " can't be found.")
+                prev_scripts[j] = InputScript.from_hex(prevout[0])
+                prev_scripts[j].type = prevout[1]
+
+        return prev_scripts
+
+    @profiled("sign")
+    def sign(self, sk, index, hashflag=SIGHASH_ALL, compressed=True, orphan=False, deterministic=True, network='test',
+             processes=1, resolver=None, amounts=None):
         """ Signs a transaction using the provided private key(s), index(es) and hash type. If more than one key and index
         is provides, key i will sign the ith input of the transaction.
 
+        P2PK, P2PKH and P2MS inputs are signed using the legacy signature hash (see get_sighash), while P2WPKH inputs
+        are signed using the BIP143 one (see get_segwit_sighash) and their signature goes in the witness of the input.
+
         :param sk: Private key(s) used to sign the ith transaction input (defined by index).
         :type sk: SigningKey or list of SigningKey.
         :param index: Index(es) to be signed by the provided key(s).
@@ -347,6 +865,15 @@ class TX:
         :type deterministic: bool
         :param network: Network from which the previous ScripPubKey will be queried (either main or test).
         :type network: str
+        :param processes: Number of worker processes used to perform the ECDSA signatures. Signatures are performed in
+        the calling process by default (1). If set to None, as many processes as cpus are used. Deterministic signatures
+        are identical no matter the number of processes.
+        :type processes: int
+        :param resolver: Resolver used to find the UTXOs redeemed by the non-orphan inputs, all of them in a single
+        batch. BlockcypherResolver (for the given network) by default. A LocalResolver can be used to sign offline.
+        :type resolver: PrevoutResolver
+        :param amounts: Value (in Satoshis) of the UTXOs redeemed by the segwit inputs, indexed by input index.
+        :type amounts: dict(index, int)
         :return: Transaction signature.
         :rtype: str
         """
@@ -360,42 +887,204 @@ class TX:
         if isinstance(index, int):
             index = [index]
 
-        for i in range(len(sk)):
+        # If the input to be signed is orphan, the OutputScript of the UTXO to be redeemed is taken from the orphan
+        # dict, otherwise the UTXO is requested. All the UTXOs are resolved at once.
+        prev_scripts = self.get_prev_scripts(index, orphan, resolver, network)
 
-            # If the input to be signed is orphan, the OutputScript of the UTXO to be redeemed will be passed to
-            # the signature_format function, otherwise False is passed and the UTXO will be requested afterwards.
-            o = orphan if not orphan else orphan.get(i)
-            # The unsigned transaction is formatted depending on the input that is going to be signed. For input i,
-            # the ScriptSig[i] will be set to the scriptPubKey of the UTXO that input i tries to redeem, while all
-            # the other inputs will be set blank.
-            unsigned_tx = self.signature_format(index[i], hashflag, o, network)
-
-            # Then, depending on the format how the private keys have been passed to the signing function
-            # and the content of the ScripSig field, a different final scriptSig will be created.
-            if isinstance(sk[i], list) and unsigned_tx.scriptSig[index[i]].type is "P2MS":
-                sigs = []
-                for k in sk[i]:
-                    sigs.append(ecdsa_tx_sign(unsigned_tx.serialize(), k, hashflag, deterministic))
-                iscript = InputScript.P2MS(sigs)
-            elif isinstance(sk[i], SigningKey) and unsigned_tx.scriptSig[index[i]].type is "P2PK":
-                s = ecdsa_tx_sign(unsigned_tx.serialize(), sk[i], hashflag, deterministic)
-                iscript = InputScript.P2PK(s)
-            elif isinstance(sk[i], SigningKey) and unsigned_tx.scriptSig[index[i]].type is "P2PKH":
-                s = ecdsa_tx_sign(unsigned_tx.serialize(), sk[i], hashflag, deterministic)
-                pk = serialize_pk(sk[i].get_verifying_key(), compressed)
-                iscript = InputScript.P2PKH(s, pk)
-            elif unsigned_tx.scriptSig[index[i]].type is "unknown":
+        # Then, every input is checked and its signature hash is computed, so all the signatures can be performed at
+        # once afterwards.
+        jobs = []
+        types = []
+        for i in range(len(sk)):
+            prev_script = prev_scripts[i]
+
+            # The signature hash of the input is computed (only once, no matter how many keys sign it) from the
+            # transaction in its signature format. For input i, the ScriptSig[i] is set to the scriptPubKey of the UTXO
+            # that input i tries to redeem, while all the other inputs are set blank (see signature_format).
+            # Segwit inputs commit to the value of the UTXO they redeem as well (see get_segwit_sighash).
+            if prev_script.type is "P2WPKH":
+                if not amounts or amounts.get(index[i]) is None:
+                    raise Exception("The amount of the UTXO redeemed by input " + str(index[i]) + " is needed in order"
+                                    " to sign it.")
+                sighash = self.get_segwit_sighash(index[i], _get_p2wpkh_script_code(prev_script), amounts[index[i]],
+                                                  hashflag)
+            else:
+                sighash = self.get_sighash(index[i], prev_script.content, hashflag)
+
+            # Then, depending on the format how the private keys have been passed to the signing function and the type
+            # of the UTXO script, one or more signatures will be performed.
+            if isinstance(sk[i], list) and prev_script.type is "P2MS":
+                keys = sk[i]
+            elif isinstance(sk[i], SigningKey) and prev_script.type in ["P2PK", "P2PKH", "P2WPKH"]:
+                keys = [sk[i]]
+            elif prev_script.type is "unknown":
                 raise Exception("Unknown previous transaction output script type. Can't sign the transaction.")
             else:
                 # ToDo: Handle P2SH outputs as an additional elif
                 raise Exception("Can't sign input " + str(i) + " with the provided data.")
 
+            jobs.extend([(sighash, k) for k in keys])
+            types.append(prev_script.type)
+
+        # The signatures are performed (in parallel if requested) and returned in the same order as jobs.
+        sigs = iter(ecdsa_sighash_sign_batch(jobs, hashflag, deterministic, processes))
+
+        # Transactions built field by field may lack the (empty) witnesses of their inputs.
+        self.witness.extend([] for _ in range(self.inputs - len(self.witness)))
+
+        for i in range(len(sk)):
+            # A different final scriptSig is created depending on the type of the UTXO script. Inputs are processed in
+            # the same order as jobs were created, so every input takes its signatures from the head of the results.
+            if types[i] is "P2MS":
+                iscript = InputScript.P2MS([next(sigs) for _ in sk[i]])
+            elif types[i] is "P2PK":
+                iscript = InputScript.P2PK(next(sigs))
+            elif types[i] is "P2WPKH":
+                # P2WPKH inputs have an empty scriptSig. The signature and the public key (always compressed) go in the
+                # witness.
+                iscript = InputScript()
+                self.witness[index[i]] = [unhexlify(next(sigs)), unhexlify(serialize_pk(sk[i].get_verifying_key()))]
+            else:
+                pk = serialize_pk(sk[i].get_verifying_key(), compressed)
+                iscript = InputScript.P2PKH(next(sigs), pk)
+
             # Finally, temporal scripts are stored as final and the length of the script is computed
-            self.scriptSig[i] = iscript
-            self.scriptSig_len[i] = len(iscript.content) / 2
+            self.scriptSig[index[i]] = iscript
+            self.scriptSig_len[index[i]] = len(iscript.content) / 2
 
         self.hex = self.serialize()
 
+    @profiled("verify")
+    def verify(self, index=None, prevouts=None, resolver=None, network='test', amounts=None):
+        """ Verifies the signatures of the inputs of the transaction. Only P2PK, P2PKH, P2MS and P2WPKH inputs are
+        supported.
+
+        :param index: Index(es) of the inputs to be verified. All of them by default.
+        :type index: int or list of int
+        :param prevouts: OutputScripts of the UTXOs redeemed by the inputs, indexed by input index. The missing ones are
+        resolved using the given resolver.
+            e.g:
+              prevouts = dict({0: OutputScript.P2PKH(btc_addr))
+        :type prevouts: dict(index, OutputScript)
+        :param resolver: Resolver used to find the missing UTXOs. BlockcypherResolver (for the given network) by default.
+        :type resolver: PrevoutResolver
+        :param network: Network in which the UTXOs can be found (either main or test), if no resolver is given.
+        :type network: str
+        :param amounts: Value (in Satoshis) of the UTXOs redeemed by the segwit inputs, indexed by input index.
+        :type amounts: dict(index, int)
+        :return: True if every input is properly signed, False otherwise.
+        :rtype: bool
+        """
+
+        if index is None:
+            index = range(self.inputs)
+        elif isinstance(index, int):
+            index = [index]
+        if amounts is None:
+            amounts = dict()
+
+        prev_scripts = self.get_prev_scripts(index, prevouts, resolver, network)
+
+        return all(self.verify_input(i, prev_script, amounts.get(i)) for i, prev_script in zip(index, prev_scripts))
+
+    def verify_input(self, index, prev_script, amount=None):
+        """ Verifies the signature(s) of a given input against the OutputScript of the UTXO it redeems. The signature
+        hash is built the same way as when signing (see get_sighash), and verification results are cached (see
+        keys.ecdsa_verify_sighash).
+
+        :param index: Index of the input to be verified.
+        :type index: int
+        :param prev_script: OutputScript of the UTXO redeemed by the input.
+        :type prev_script: Script
+        :param amount: Value (in Satoshis) of the UTXO redeemed by the input. Only needed for segwit inputs.
+        :type amount: int
+        :return: True if the input is properly signed, False otherwise.
+        :rtype: bool
+        """
+
+        prev_type, prev_data = match_output_script(prev_script._get_raw())
+        try:
+            pushes = [data for op, data in self.scriptSig[index].get_ops()]
+        except Exception:
+            return False
+        if None in pushes:
+            # Only data pushes are allowed in the ScriptSig.
+            return False
+
+        # P2PKH: OP_DUP OP_HASH160 <hash160> OP_EQUALVERIFY OP_CHECKSIG  /  <sig> <pk>
+        if prev_type is "P2PKH":
+            return len(pushes) == 2 and hash_160(hexlify(pushes[1])) == prev_data[0] and \
+                   self._check_signature(index, prev_script.content, pushes[0], pushes[1])
+
+        # P2PK: <pk> OP_CHECKSIG  /  <sig>
+        elif prev_type is "P2PK":
+            return len(pushes) == 1 and self._check_signature(index, prev_script.content, pushes[0], prev_data[0])
+
+        # P2MS: OP_m <pk_1> ... <pk_n> OP_n OP_CHECKMULTISIG  /  OP_0 <sig_1> ... <sig_m>
+        elif prev_type is "P2MS":
+            m = prev_data[0]
+            pks = prev_data[1:-1]
+            if len(pushes) != m + 1 or pushes[0] != "":
+                return False
+            # As in OP_CHECKMULTISIG, signatures must follow the same order than public keys. Every signature is
+            # checked against the remaining keys until one matches.
+            k = 0
+            for sig in pushes[1:]:
+                while k < len(pks) and not self._check_signature(index, prev_script.content, sig, pks[k]):
+                    k += 1
+                if k == len(pks):
+                    return False
+                k += 1
+            return True
+
+        # P2WPKH: OP_0 <hash160>  /  (empty ScriptSig) and witness: <sig> <pk>
+        elif prev_type is "P2WPKH":
+            if amount is None:
+                raise Exception("The amount of the UTXO redeemed by input " + str(index) + " is needed in order to "
+                                "verify it.")
+            witness = self.witness[index] if index < len(self.witness) else []
+            return not pushes and len(witness) == 2 and hash_160(hexlify(witness[1])) == prev_data[0] and \
+                self._check_signature(index, _get_p2wpkh_script_code(prev_script), witness[0], witness[1], amount)
+
+        else:
+            raise Exception("Can't verify input " + str(index) + ". Unsupported previous transaction output script.")
+
+    def _check_signature(self, index, script_code, sig, pk, amount=None):
+        """ Checks a signature (followed by its hash type) of a given input against a public key. The BIP143 signature
+        hash is used if the amount of the redeemed UTXO is given (segwit inputs), and the legacy one otherwise.
+
+        :param index: Index of the input.
+        :type index: int
+        :param script_code: OutputScript of the UTXO redeemed by the input.
+        :type script_code: hex str
+        :param sig: Signature (followed by the 1-byte hash type).
+        :type sig: bytes
+        :param pk: Public key.
+        :type pk: bytes
+        :param amount: Value (in Satoshis) of the UTXO redeemed by the input, for segwit inputs.
+        :type amount: int
+        :return: True if the signature is valid, False otherwise (including signatures with a hash type the signature
+        hash can't be computed for, such as SIGHASH_ANYONECANPAY for legacy inputs).
+        :rtype: bool
+        """
+
+        if len(sig) < 2:
+            return False
+
+        hashflag = ord(sig[-1])
+        if amount is None:
+            # SIGHASH_SINGLE inputs with no corresponding output can't be checked either (see get_sighash).
+            if hashflag not in [SIGHASH_ALL, SIGHASH_SINGLE, SIGHASH_NONE] or \
+                    (hashflag == SIGHASH_SINGLE and index >= self.outputs):
+                return False
+            sighash = self.get_sighash(index, script_code, hashflag)
+        else:
+            if hashflag & 0x1f not in [SIGHASH_ALL, SIGHASH_SINGLE, SIGHASH_NONE]:
+                return False
+            sighash = self.get_segwit_sighash(index, script_code, amount, hashflag)
+
+        return ecdsa_verify_sighash(sighash, hexlify(pk), hexlify(sig[:-1]))
+
     def signature_format(self, index, hashflag=SIGHASH_ALL, orphan=False, network='test'):
         """ Builds the signature format an unsigned transaction has to follow in order to be signed. Basically empties
         every InputScript field but the one to be signed, identified by index, that will be filled with the OutputScript
@@ -522,10 +1211,13 @@ class TX:
             print "\t input script (scriptSig) length: " + str(self.scriptSig_len[i]) \
                   + " (" + encode_varint((self.scriptSig_len[i])) + ")"
             print "\t input script (scriptSig): " + self.scriptSig[i].content
-            print "\t decoded scriptSig: " + Script.deserialize(self.scriptSig[i].content)
+            print "\t decoded scriptSig: " + self.scriptSig[i].to_human()
             if self.scriptSig[i].type is "P2SH":
-                print "\t \t decoded redeemScript: " + InputScript.deserialize(self.scriptSig[i].get_element(-1)[1:-1])
+                redeem_script = InputScript.from_bytes(self.scriptSig[i].get_tokens()[-1][2])
+                print "\t \t decoded redeemScript: " + redeem_script.to_human()
             print "\t nSequence: " + str(self.nSequence[i]) + " (" + int2bytes(self.nSequence[i], 4) + ")"
+            if i < len(self.witness) and self.witness[i]:
+                print "\t witness: " + " ".join([hexlify(item) for item in self.witness[i]])
         print "number of outputs: " + str(self.outputs) + " (" + encode_varint(self.outputs) + ")"
         for i in range(self.outputs):
             print "output " + str(i)
@@ -534,6 +1226,332 @@ class TX:
             print "\t output script (scriptPubKey) length: " + str(self.scriptPubKey_len[i]) \
                   + " (" + encode_varint(self.scriptPubKey_len[i]) + ")"
             print "\t output script (scriptPubKey): " + self.scriptPubKey[i].content
-            print "\t decoded scriptPubKey: " + Script.deserialize(self.scriptPubKey[i].content)
+            print "\t decoded scriptPubKey: " + self.scriptPubKey[i].to_human()
 
         print "nLockTime: " + str(self.nLockTime) + " (" + int2bytes(self.nLockTime, 4) + ")"
+
+
+class _SighashEngine(object):
+    """ Computes the (legacy) signature hashes of the inputs of a transaction. Every field of the transaction is
+    serialized once, and the signature format of every input is hashed straight from those segments, without building
+    (nor copying) the unsigned transaction.
+
+    Every input in its blank form (outpoint, empty script and nSequence) takes exactly 41 bytes, so the blank inputs are
+    kept as a single string, and the segments before and after the input being signed are just slices of it. The hash
+    of the leading segment (sha256 midstate) is kept and extended, so signing the inputs in order hashes every leading
+    segment only once.
+    """
+
+    # Size of a serialized blank input: outpoint (36 bytes), empty script length (1 byte) and nSequence (4 bytes).
+    BLANK_INPUT_SIZE = 41
+
+    def __init__(self, tx, key):
+        """
+        :param tx: Transaction to be signed.
+        :type tx: TX
+        :param key: State of the fields the signature hashes depend on (see TX._get_sighash_key).
+        :type key: tuple
+        """
+
+        self.key = key
+
+        try:
+            self.head = UINT32.pack(tx.version) + pack_varint(tx.inputs)
+            self.outpoints = [OUTPOINT.pack(unhexlify(tx.prev_tx_id[i])[::-1], tx.prev_out_index[i])
+                              for i in range(tx.inputs)]
+            self.sequences = [UINT32_BE.pack(tx.nSequence[i]) for i in range(tx.inputs)]
+            self.nLockTime = UINT32_BE.pack(tx.nLockTime)
+        except struct_error:
+            raise Exception("Some field of the transaction is out of range. Transaction can't be serialized.")
+
+        # Blank inputs as they are (SIGHASH_ALL) and with their nSequence set to 0 (SIGHASH_SINGLE and SIGHASH_NONE).
+        self.blank_inputs = {SIGHASH_ALL: "".join([o + "\x00" + s for o, s in zip(self.outpoints, self.sequences)]),
+                             SIGHASH_NONE: "".join([o + "\x00" * 5 for o in self.outpoints])}
+        self.blank_inputs[SIGHASH_SINGLE] = self.blank_inputs[SIGHASH_NONE]
+
+        self.n_outputs = tx.outputs
+        self.outputs = [tx._serialize_output(i) for i in range(tx.outputs)]
+        # Outputs as they are signed with SIGHASH_ALL (the same for every input).
+        self.all_outputs = pack_varint(tx.outputs) + "".join(self.outputs)
+
+        self.midstates = dict()
+        self.sighashes = dict()
+
+    def __getstate__(self):
+        # sha256 midstates can't be copied nor pickled.
+        state = self.__dict__.copy()
+        state['midstates'] = dict()
+        return state
+
+    def get_prefix_hash(self, hashflag, index):
+        """ Gets a sha256 object that has already hashed the signature format up to a given input (not included).
+
+        :param hashflag: Hash type.
+        :type hashflag: int
+        :param index: Index of the input being signed.
+        :type index: int
+        :return: sha256 object.
+        :rtype: hashlib.sha256
+        """
+
+        blank_inputs = memoryview(self.blank_inputs[hashflag])
+        i, h = self.midstates.get(hashflag, (None, None))
+        if i is None or i > index:
+            i, h = 0, sha256(self.head)
+
+        h.update(blank_inputs[i * self.BLANK_INPUT_SIZE:index * self.BLANK_INPUT_SIZE])
+        self.midstates[hashflag] = (index, h.copy())
+
+        return h
+
+    def get_sighash(self, index, script_code, hashflag=SIGHASH_ALL):
+        """ Computes the signature hash of a given input (see TX.get_sighash).
+
+        :param index: The index of the input to be signed.
+        :type index: int
+        :param script_code: OutputScript from the UTXO that will be redeemed by the input.
+        :type script_code: hex str
+        :param hashflag: Hash type to be used.
+        :type hashflag: int
+        :return: The signature hash.
+        :rtype: bytes
+        """
+
+        sighash = self.sighashes.get((index, script_code, hashflag))
+        if sighash is not None:
+            return sighash
+
+        if hashflag not in [SIGHASH_ALL, SIGHASH_SINGLE, SIGHASH_NONE]:
+            # ToDo: Deal with SIGHASH_ANYONECANPAY
+            raise Exception("Wrong hash flag.")
+        if not 0 <= index < len(self.outpoints):
+            raise Exception("There is no input " + str(index) + " in the transaction.")
+
+        if hashflag == SIGHASH_ALL:
+            outputs = [self.all_outputs]
+        elif hashflag == SIGHASH_SINGLE:
+            # SIGHASH_SINGLE signs each input with the output of the same index. If there is no such output, the
+            # signature process is aborted since it could lead to a irreversible lose of funds due to a bug in
+            # SIGHASH_SINGLE. https://bitcointalk.org/index.php?topic=260595
+            if index >= self.n_outputs:
+                raise Exception("You are trying to use SIGHASH_SINGLE to sign an input that does not have a "
+                                "corresponding output (" + str(index) + "). This could lead to a irreversible lose "
+                                "of funds. Signature process aborted.")
+            # Every output before index is set empty, with its value set to maximum (2^64-1).
+            outputs = [pack_varint(index + 1), (UINT64.pack(pow(2, 64) - 1) + "\x00") * index,
+                       self.outputs[index]]
+        else:
+            # SIGHASH_NONE empties all the outputs.
+            outputs = [pack_varint(0)]
+
+        h = self.get_prefix_hash(hashflag, index)
+        raw_code = unhexlify(script_code)
+        h.update(self.outpoints[index] + pack_varint(len(raw_code)) + raw_code + self.sequences[index])
+        h.update(memoryview(self.blank_inputs[hashflag])[(index + 1) * self.BLANK_INPUT_SIZE:])
+        h.update("".join(outputs) + self.nLockTime + UINT32.pack(hashflag))
+
+        sighash = self.sighashes[(index, script_code, hashflag)] = sha256(h.digest()).digest()
+
+        return sighash
+
+
+def _get_p2wpkh_script_code(prev_script):
+    """ Builds the script code used to compute the (BIP143) signature hash of a P2WPKH input: the P2PKH script of the
+    public key hash the redeemed output is locked to.
+
+    :param prev_script: P2WPKH OutputScript of the UTXO redeemed by the input.
+    :type prev_script: Script
+    :return: The script code.
+    :rtype: hex str
+    """
+
+    return "76a914" + hexlify(match_output_script(prev_script._get_raw())[1][0]) + "88ac"
+
+
+class _SegwitSighashEngine(object):
+    """ Computes the BIP143 signature hashes of the (segwit) inputs of a transaction. The hashes of all the outpoints,
+    sequences and outputs are computed only once, and so is the sha256 midstate of the prefix every signature hash
+    starts with (version, hashPrevouts and hashSequence) for every hash type. Every input then hashes its own fields
+    only.
+    """
+
+    def __init__(self, tx, key):
+        """
+        :param tx: Transaction to be signed.
+        :type tx: TX
+        :param key: State of the fields the signature hashes depend on (see TX._get_sighash_key).
+        :type key: tuple
+        """
+
+        self.key = key
+
+        try:
+            self.version = UINT32.pack(tx.version)
+            self.outpoints = [OUTPOINT.pack(unhexlify(tx.prev_tx_id[i])[::-1], tx.prev_out_index[i])
+                              for i in range(tx.inputs)]
+            self.sequences = [UINT32_BE.pack(tx.nSequence[i]) for i in range(tx.inputs)]
+            self.nLockTime = UINT32_BE.pack(tx.nLockTime)
+        except struct_error:
+            raise Exception("Some field of the transaction is out of range. Transaction can't be serialized.")
+
+        self.outputs = [tx._serialize_output(i) for i in range(tx.outputs)]
+
+        self.hash_prevouts = double_sha256("".join(self.outpoints))
+        self.hash_sequence = double_sha256("".join(self.sequences))
+        self.hash_outputs = double_sha256("".join(self.outputs))
+
+        self.midstates = dict()
+        self.sighashes = dict()
+
+    def __getstate__(self):
+        # sha256 midstates can't be copied nor pickled.
+        state = self.__dict__.copy()
+        state['midstates'] = dict()
+        return state
+
+    def get_prefix_hash(self, hashflag):
+        """ Gets a sha256 object that has already hashed the common prefix of the signature hashes of a given hash type:
+        version, hashPrevouts (zero for SIGHASH_ANYONECANPAY) and hashSequence (zero for SIGHASH_ANYONECANPAY,
+        SIGHASH_SINGLE and SIGHASH_NONE).
+
+        :param hashflag: Hash type.
+        :type hashflag: int
+        :return: sha256 object.
+        :rtype: hashlib.sha256
+        """
+
+        anyone_can_pay = bool(hashflag & SIGHASH_ANYONECANPAY)
+        key = (anyone_can_pay, hashflag & 0x1f == SIGHASH_ALL)
+
+        h = self.midstates.get(key)
+        if h is None:
+            hash_prevouts = "\x00" * 32 if anyone_can_pay else self.hash_prevouts
+            hash_sequence = self.hash_sequence if key == (False, True) else "\x00" * 32
+            h = self.midstates[key] = sha256(self.version + hash_prevouts + hash_sequence)
+
+        return h.copy()
+
+    def get_sighash(self, index, script_code, amount, hashflag=SIGHASH_ALL):
+        """ Computes the signature hash of a given input (see TX.get_segwit_sighash).
+
+        :param index: The index of the input to be signed.
+        :type index: int
+        :param script_code: Script code of the input.
+        :type script_code: hex str
+        :param amount: Value (in Satoshis) of the UTXO redeemed by the input.
+        :type amount: int
+        :param hashflag: Hash type to be used.
+        :type hashflag: int
+        :return: The signature hash.
+        :rtype: bytes
+        """
+
+        key = (index, script_code, amount, hashflag)
+        sighash = self.sighashes.get(key)
+        if sighash is not None:
+            return sighash
+
+        base_flag = hashflag & 0x1f
+        if base_flag not in [SIGHASH_ALL, SIGHASH_SINGLE, SIGHASH_NONE]:
+            raise Exception("Wrong hash flag.")
+        if not 0 <= index < len(self.outpoints):
+            raise Exception("There is no input " + str(index) + " in the transaction.")
+
+        # SIGHASH_SINGLE only commits to the output of the same index (if any), and SIGHASH_NONE to no output at all.
+        if base_flag == SIGHASH_ALL:
+            hash_outputs = self.hash_outputs
+        elif base_flag == SIGHASH_SINGLE and index < len(self.outputs):
+            hash_outputs = double_sha256(self.outputs[index])
+        else:
+            hash_outputs = "\x00" * 32
+
+        raw_code = unhexlify(script_code)
+        try:
+            raw_amount = UINT64.pack(amount)
+        except struct_error:
+            raise Exception("Wrong UTXO amount: " + str(amount))
+
+        h = self.get_prefix_hash(hashflag)
+        h.update(self.outpoints[index] + pack_varint(len(raw_code)) + raw_code + raw_amount + self.sequences[index] +
+                 hash_outputs + self.nLockTime + UINT32.pack(hashflag))
+
+        sighash = self.sighashes[key] = sha256(h.digest()).digest()
+
+        return sighash
+
+
+def _verify_tx(args):
+    """ Verifies a transaction. Used by verify_txs workers.
+
+    :param args: Serialized transaction, the OutputScript (and its type) of the UTXO redeemed by every input and the
+    amounts of the UTXOs redeemed by its segwit inputs.
+    :type args: tuple
+    :return: True if every input is properly signed, False otherwise.
+    :rtype: bool
+    """
+
+    raw_tx, prevouts, amounts = args
+
+    prev_scripts = dict()
+    for i, (script, t) in enumerate(prevouts):
+        prev_scripts[i] = OutputScript.from_hex(script)
+        prev_scripts[i].type = t
+
+    return TX.from_bytes(raw_tx).verify(prevouts=prev_scripts, amounts=amounts)
+
+
+def verify_txs(txs, prevouts=None, resolver=None, network='test', processes=None, amounts=None):
+    """ Verifies a batch of transactions in parallel, using a pool of processes. The UTXOs redeemed by the inputs of all
+    the transactions are resolved at once, in the calling process.
+
+    :param txs: Transactions to be verified.
+    :type txs: list of TX
+    :param prevouts: Known OutputScripts of the UTXOs redeemed by every transaction (one dict per transaction, see
+    TX.verify).
+    :type prevouts: list of dict(index, OutputScript)
+    :param resolver: Resolver used to find the missing UTXOs. BlockcypherResolver (for the given network) by default.
+    :type resolver: PrevoutResolver
+    :param network: Network in which the UTXOs can be found (either main or test), if no resolver is given.
+    :type network: str
+    :param processes: Number of worker processes (number of cpus by default). If set to 1, transactions are verified in
+    the calling process.
+    :type processes: int
+    :param amounts: Values of the UTXOs redeemed by the segwit inputs of every transaction (one dict per transaction,
+    see TX.verify).
+    :type amounts: list of dict(index, int)
+    :return: Whether every transaction is properly signed, in the same order as the given transactions.
+    :rtype: list of bool
+    """
+
+    if prevouts is None:
+        prevouts = [None] * len(txs)
+    if amounts is None:
+        amounts = [None] * len(txs)
+
+    # Every missing UTXO is resolved in a single batch.
+    scripts = [dict(p) if p else dict() for p in prevouts]
+    missing = [(t, i) for t, tx in enumerate(txs) for i in range(tx.inputs) if not scripts[t].get(i)]
+    if missing:
+        if resolver is None:
+            resolver = BlockcypherResolver(network)
+        outpoints = [(txs[t].prev_tx_id[i], txs[t].prev_out_index[i]) for t, i in missing]
+        for (t, i), prevout in zip(missing, resolver.resolve(outpoints)):
+            if prevout is None:
+                raise Exception("The UTXO redeemed by input " + str(i) + " of transaction " + str(t) +
+                                " can't be found.")
+            scripts[t][i] = OutputScript.from_hex(prevout[0])
+            scripts[t][i].type = prevout[1]
+
+    jobs = [(tx.serialize(rtype=bin), [(scripts[t][i].content, scripts[t][i].type) for i in range(tx.inputs)],
+             amounts[t]) for t, tx in enumerate(txs)]
+
+    if processes == 1:
+        return [_verify_tx(job) for job in jobs]
+
+    pool = Pool(processes)
+    try:
+        return pool.map(_verify_tx, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
@@ -0,0 +1,265 @@
+from binascii import hexlify
+from collections import OrderedDict
+from mmap import mmap, ACCESS_READ
+from os import path, rename, fsync
+from struct import pack, unpack_from
+
+from bitcoin_tools import CFG
+from bitcoin_tools.core.keys import build_key_pair
+from bitcoin_tools.wallet import b58check_decode_batch
+
+# Key vault files: records (append only) and the index (sorted by address).
+DATA_FILE = "keys.dat"
+INDEX_FILE = "keys.idx"
+
+# Records are identified by the decoded Bitcoin address (version byte + hash160), and hold the private key and both
+# coordinates of the public key (32 bytes each).
+KEY_SIZE = 21
+RECORD_SIZE = KEY_SIZE + 3 * 32
+
+# Index entries: address key followed by the record number (4 bytes, LE). The index starts with the number of
+# records it covers (8 bytes, LE).
+ENTRY_SIZE = KEY_SIZE + 4
+INDEX_HEADER_SIZE = 8
+
+# Number of key pairs kept in memory (as ecdsa objects).
+CACHE_SIZE = 10000
+
+
+def get_address_key(btc_addr):
+    """ Gets the key used to identify a Bitcoin address in the vault: the decoded address without its checksum (which
+    is verified, so mistyped addresses are not taken as keys).
+
+    :param btc_addr: Bitcoin address.
+    :type btc_addr: str
+    :return: Address key (version byte + hash160).
+    :rtype: bytes
+    """
+
+    decoded = b58check_decode_batch([btc_addr])[0]
+    if decoded is None or len(decoded) != KEY_SIZE:
+        raise Exception("Wrong Bitcoin address: " + btc_addr)
+
+    return decoded
+
+
+class KeyVault(object):
+    """ Stores a (possibly huge) number of key pairs in a single file, as fixed size records appended one after the
+    other. Records are located through an index sorted by address, which is memory mapped and binary searched, so no
+    record (nor index entry) has to be loaded in memory until it is requested.
+
+    New records are indexed in memory until the vault is flushed (or closed), when they are merged into the index
+    file. Records appended after the last flush (e.g. if the process was killed) are indexed again when the vault is
+    opened, and a partially written record at the end of the file (if any) is dropped.
+    """
+
+    def __init__(self, vault_path=None, cache_size=CACHE_SIZE):
+        """
+        :param vault_path: Dir where the vault files are stored. Defined in the config file by default.
+        :type vault_path: str
+        :param cache_size: Number of key pairs kept in memory.
+        :type cache_size: int
+        """
+
+        if vault_path is None:
+            vault_path = CFG.address_vault
+
+        self.data_file = path.join(vault_path, DATA_FILE)
+        self.index_file = path.join(vault_path, INDEX_FILE)
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()
+        self._pending = dict()
+        self._index = None
+        self._indexed = 0
+
+        self._data = open(self.data_file, 'a+b')
+        self._data.seek(0, 2)
+        self._records = self._data.tell() // RECORD_SIZE
+
+        # A partial record (e.g. if the process was killed while writing) would misalign every record appended after it.
+        if self._data.tell() > self._records * RECORD_SIZE:
+            self._data.truncate(self._records * RECORD_SIZE)
+
+        self._load_index()
+
+        # Records not covered by the index file are indexed in memory.
+        if self._indexed < self._records:
+            self._data.seek(self._indexed * RECORD_SIZE)
+            for n in range(self._indexed, self._records):
+                self._pending[self._data.read(RECORD_SIZE)[:KEY_SIZE]] = n
+
+    def __len__(self):
+        return self._records
+
+    def __contains__(self, btc_addr):
+        return self._find(get_address_key(btc_addr)) is not None
+
+    def _load_index(self):
+        """ Maps the index file into memory.
+
+        :return: None.
+        :rtype: None
+        """
+
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        self._indexed = 0
+
+        if path.exists(self.index_file) and path.getsize(self.index_file) > INDEX_HEADER_SIZE:
+            f = open(self.index_file, 'rb')
+            self._index = mmap(f.fileno(), 0, access=ACCESS_READ)
+            f.close()
+            self._indexed, = unpack_from("<Q", self._index, 0)
+
+    def _find(self, key):
+        """ Finds the record number of a given address key, by looking into the pending records and binary searching the
+        index.
+
+        :param key: Address key.
+        :type key: bytes
+        :return: The record number, None if the address is not in the vault.
+        :rtype: int
+        """
+
+        n = self._pending.get(key)
+        if n is not None or self._index is None:
+            return n
+
+        lo, hi = 0, (len(self._index) - INDEX_HEADER_SIZE) // ENTRY_SIZE
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = INDEX_HEADER_SIZE + mid * ENTRY_SIZE
+            entry_key = self._index[offset:offset + KEY_SIZE]
+            if entry_key < key:
+                lo = mid + 1
+            elif entry_key > key:
+                hi = mid
+            else:
+                return unpack_from("<I", self._index, offset + KEY_SIZE)[0]
+
+        return None
+
+    def add(self, btc_addr, sk, pk=None):
+        """ Adds a key pair to the vault. See add_batch.
+        """
+
+        self.add_batch([(btc_addr, sk, pk)])
+
+    def add_batch(self, keys):
+        """ Adds a batch of key pairs to the vault, appending all their records at once. Addresses already in the vault
+        are skipped.
+
+        :param keys: Bitcoin address, private key and public key (if None, taken from the private key) of every key
+        pair.
+        :type keys: list of (str, SigningKey, VerifyingKey)
+        :return: None.
+        :rtype: None
+        """
+
+        records = []
+        for btc_addr, sk, pk in keys:
+            key = get_address_key(btc_addr)
+            if self._find(key) is not None:
+                continue
+            if pk is None:
+                pk = sk.get_verifying_key()
+
+            self._pending[key] = self._records
+            self._records += 1
+            records.append(key + sk.to_string() + pk.to_string())
+
+        self._data.seek(0, 2)
+        self._data.write("".join(records))
+
+    def get(self, btc_addr):
+        """ Gets the key pair of a given Bitcoin address. See get_batch.
+        """
+
+        return self.get_batch([btc_addr])[0]
+
+    def get_batch(self, btc_addrs):
+        """ Gets the key pairs of a batch of Bitcoin addresses. Records are read in the same order they are stored in
+        the vault, and key objects are built with no point multiplication (see keys.build_key_pair).
+
+        :param btc_addrs: Bitcoin addresses.
+        :type btc_addrs: list of str
+        :return: The key pair of every address, in the same order. None for addresses not in the vault.
+        :rtype: list of (SigningKey, VerifyingKey)
+        """
+
+        keys = [self._cache.get(btc_addr) for btc_addr in btc_addrs]
+
+        missing = []
+        for i, btc_addr in enumerate(btc_addrs):
+            if keys[i] is None:
+                n = self._find(get_address_key(btc_addr))
+                if n is not None:
+                    missing.append((n, i))
+
+        if missing:
+            self._data.flush()
+            for n, i in sorted(missing):
+                self._data.seek(n * RECORD_SIZE)
+                record = self._data.read(RECORD_SIZE)
+                secexp, x, y = [int(hexlify(record[j:j + 32]), 16) for j in range(KEY_SIZE, RECORD_SIZE, 32)]
+                keys[i] = build_key_pair(secexp, x, y)
+
+        for btc_addr, key_pair in zip(btc_addrs, keys):
+            if key_pair is not None:
+                self._cache.pop(btc_addr, None)
+                self._cache[btc_addr] = key_pair
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return keys
+
+    def flush(self):
+        """ Writes the pending records to disk and merges them into the index file. The new index is written to a
+        temporary file first, and then moved over the old one.
+
+        :return: None.
+        :rtype: None
+        """
+
+        self._data.flush()
+        fsync(self._data.fileno())
+
+        if not self._pending:
+            return
+
+        entries = [(key, pack("<I", n)) for key, n in self._pending.items()]
+        if self._index is not None:
+            index = self._index
+            entries.extend((index[offset:offset + KEY_SIZE], index[offset + KEY_SIZE:offset + ENTRY_SIZE])
+                           for offset in range(INDEX_HEADER_SIZE, len(index), ENTRY_SIZE))
+        entries.sort()
+
+        fout = open(self.index_file + ".tmp", 'wb')
+        fout.write(pack("<Q", self._records))
+        fout.write("".join(key + n for key, n in entries))
+        fout.flush()
+        fsync(fout.fileno())
+        fout.close()
+
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        rename(self.index_file + ".tmp", self.index_file)
+
+        self._pending = dict()
+        self._load_index()
+
+    def close(self):
+        """ Flushes the vault (see flush) and closes its files.
+
+        :return: None.
+        :rtype: None
+        """
+
+        self.flush()
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        self._data.close()
@@ -0,0 +1,239 @@
+from atexit import register
+from cProfile import Profile
+from functools import wraps
+from os import environ, makedirs, path
+from sys import stderr
+from time import time
+
+# Profiling can be enabled without touching the code by setting the following environment variables:
+#   - BITCOIN_TOOLS_PROFILE: if set (and not 0), the time spent in every named region is tracked and a report is output
+#   to stderr once the execution finishes.
+#   - BITCOIN_TOOLS_PROFILE_DIR: if set, cProfile stats are also captured for every region and stored in the given
+#   directory (one file per region, named after it, e.g: decode.prof).
+ENV_PROFILE = "BITCOIN_TOOLS_PROFILE"
+ENV_PROFILE_DIR = "BITCOIN_TOOLS_PROFILE_DIR"
+
+
+class _NullRegion(object):
+    """ Region used while profiling is disabled. Does nothing, so the cost of an instrumented region is just the cost of
+    the with statement.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class _Region(object):
+    """ Timed (and optionally cProfiled) region of code. Regions can be nested, in which case the time spent in the
+    inner region is also accounted for the outer one (cumulative time). Only the outermost profiled region captures
+    cProfile stats, since a single profiler can be active at a time.
+    """
+
+    __slots__ = ('stage', 'start', 'profiler')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.start = None
+        self.profiler = None
+
+    def __enter__(self):
+        if _state['stats_dir'] is not None and not _state['profiling']:
+            self.profiler = _state['profilers'].setdefault(self.stage.name, Profile())
+            _state['profiling'] = True
+            self.profiler.enable()
+        self.start = time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler = None
+            _state['profiling'] = False
+        self.stage.calls += 1
+        self.stage.total += elapsed
+        return False
+
+
+class _Stage(object):
+    """ Accumulated data of all the executions of a given named region.
+    """
+
+    __slots__ = ('name', 'calls', 'total')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+
+
+_NULL_REGION = _NullRegion()
+
+_state = {'enabled': False, 'stats_dir': None, 'profiling': False, 'stages': {}, 'profilers': {}}
+
+
+def enable(stats_dir=None):
+    """ Enables profiling. From now on, every named region will be timed.
+
+    :param stats_dir: Directory where cProfile stats will be stored (one file per region). If not provided, regions are
+    only timed.
+    :type stats_dir: str
+    :return: None
+    :rtype: None
+    """
+
+    _state['enabled'] = True
+    _state['stats_dir'] = stats_dir
+
+
+def disable():
+    """ Disables profiling. Data gathered so far is kept until reset is called.
+
+    :return: None
+    :rtype: None
+    """
+
+    _state['enabled'] = False
+    _state['stats_dir'] = None
+
+
+def is_enabled():
+    """ Checks whether profiling is enabled or not.
+
+    :return: True if profiling is enabled, False otherwise.
+    :rtype: bool
+    """
+
+    return _state['enabled']
+
+
+def reset():
+    """ Removes all the profiling data gathered so far.
+
+    :return: None
+    :rtype: None
+    """
+
+    _state['stages'] = {}
+    _state['profilers'] = {}
+
+
+def region(name):
+    """ Defines a named region to be profiled, to be used as a context manager:
+
+    e.g:
+        with region("decode"):
+            utxo = decode_utxo(data["value"])
+
+    If profiling is disabled, the region does nothing.
+
+    :param name: Name of the region (stage). Regions with the same name are accumulated.
+    :type name: str
+    :return: Context manager that profiles the enclosed code.
+    :rtype: _Region
+    """
+
+    if not _state['enabled']:
+        return _NULL_REGION
+
+    stage = _state['stages'].get(name)
+    if stage is None:
+        stage = _state['stages'][name] = _Stage(name)
+
+    return _Region(stage)
+
+
+def profiled(name):
+    """ Decorator version of region. Profiles every call to the decorated function under the given region name.
+
+    :param name: Name of the region (stage).
+    :type name: str
+    :return: Decorator.
+    :rtype: function
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with region(name):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def get_report():
+    """ Gets the data gathered for every profiled region.
+
+    :return: Dictionary with the number of calls, the cumulative time and the time per call of every region.
+    :rtype: dict
+    """
+
+    data = dict()
+    for name, stage in _state['stages'].items():
+        data[name] = {"calls": stage.calls, "total": stage.total,
+                      "per_call": stage.total / stage.calls if stage.calls else 0.0}
+
+    return data
+
+
+def dump_stats(stats_dir=None):
+    """ Stores the cProfile stats captured for every region into disk (one file per region, named after it).
+
+    :param stats_dir: Directory where stats will be stored. The one provided when enabling profiling by default.
+    :type stats_dir: str
+    :return: List of created files.
+    :rtype: list
+    """
+
+    if stats_dir is None:
+        stats_dir = _state['stats_dir']
+    if stats_dir is None:
+        return []
+
+    if not path.exists(stats_dir):
+        makedirs(stats_dir)
+
+    files = []
+    for name, profiler in _state['profilers'].items():
+        f = path.join(stats_dir, name + ".prof")
+        profiler.dump_stats(f)
+        files.append(f)
+
+    return files
+
+
+def report(fout=stderr):
+    """ Outputs a consolidated report of all the profiled regions (sorted by cumulative time) and stores the cProfile
+    stats (if captured).
+
+    :param fout: File-like object where the report will be written. stderr by default.
+    :type fout: file
+    :return: None
+    :rtype: None
+    """
+
+    data = get_report()
+    fout.write("%-20s %12s %14s %14s\n" % ("region", "calls", "cumulative (s)", "per call (s)"))
+    for name in sorted(data, key=lambda k: data[k]["total"], reverse=True):
+        r = data[name]
+        fout.write("%-20s %12d %14.6f %14.9f\n" % (name, r["calls"], r["total"], r["per_call"]))
+
+    for f in dump_stats():
+        fout.write("cProfile stats stored in " + f + "\n")
+
+
+def _report_at_exit():
+    if _state['stages']:
+        report()
+
+
+if environ.get(ENV_PROFILE, "0") not in ["", "0"] or environ.get(ENV_PROFILE_DIR):
+    enable(environ.get(ENV_PROFILE_DIR))
+    register(_report_at_exit)
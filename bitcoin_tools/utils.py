@@ -1,5 +1,13 @@
 from urllib2 import urlopen, Request
 from json import loads
+from struct import Struct, unpack_from, error as struct_error
+
+# Fixed-width fields found in serialized (wire-format) data.
+UINT8 = Struct("<B")
+UINT16 = Struct("<H")
+UINT32 = Struct("<I")
+UINT64 = Struct("<Q")
+UINT32_BE = Struct(">I")
 
 
 def change_endianness(x):
@@ -141,6 +149,385 @@ def encode_varint(value):
     return varint
 
 
+def read_varint(data, offset=0):
+    """ Reads a varint (CompactSize) from a binary buffer.
+
+    :param data: Buffer where the varint will be read from.
+    :type data: bytes, buffer or memoryview
+    :param offset: Offset where the varint is located.
+    :type offset: int
+    :return: The decoded varint and the offset right after it.
+    :rtype: int, int
+    """
+
+    prefix, = unpack_from("B", data, offset)
+
+    if prefix < 0xFD:  # No prefix
+        return prefix, offset + 1
+    elif prefix == 0xFD:
+        return unpack_from("<H", data, offset + 1)[0], offset + 3
+    elif prefix == 0xFE:
+        return unpack_from("<I", data, offset + 1)[0], offset + 5
+    else:
+        return unpack_from("<Q", data, offset + 1)[0], offset + 9
+
+
+def pack_varint(value):
+    """ Encodes a varint (CompactSize) straight into bytes (see encode_varint for its hex counterpart).
+
+    :param value: The integer value that will be encoded.
+    :type value: int
+    :return: The serialized varint.
+    :rtype: bytes
+    """
+
+    if value < 0:
+        raise Exception("Wrong input data size")
+    elif value < 0xFD:
+        return chr(value)
+    elif value <= 0xFFFF:
+        return "\xfd" + UINT16.pack(value)
+    elif value <= 0xFFFFFFFF:
+        return "\xfe" + UINT32.pack(value)
+    elif value < pow(2, 64):
+        return "\xff" + UINT64.pack(value)
+    else:
+        raise Exception("Wrong input data size")
+
+
+class Reader(object):
+    """ Cursor over a binary buffer, used to parse wire-format data (transactions, blocks, scripts, ...). Fields are
+    read straight from the buffer, and byte strings can be returned as (zero-copy) memoryview slices of it.
+
+    Byte strings are read as they are (indexing and slicing them is cheaper than doing it over a memoryview), and only
+    wrapped in a memoryview the first time a zero-copy slice is requested. Any other buffer is wrapped from the start.
+
+    Reading past the end of the buffer raises struct.error, so parsers can handle truncated data in a single place.
+    """
+
+    __slots__ = ('data', 'offset', 'size', '_is_bytes', '_view')
+
+    def __init__(self, data, offset=0):
+        """
+        :param data: Buffer to be read.
+        :type data: bytes, bytearray, buffer or memoryview
+        :param offset: Offset of the buffer where reading starts.
+        :type offset: int
+        """
+
+        if data.__class__ is bytes:
+            self._is_bytes = True
+            self._view = None
+        else:
+            if data.__class__ is not memoryview:
+                data = memoryview(data)
+            self._is_bytes = False
+            self._view = data
+
+        self.data = data
+        self.offset = offset
+        self.size = len(data)
+
+    def remaining(self):
+        """ Gets the number of bytes left to be read.
+
+        :return: Number of bytes.
+        :rtype: int
+        """
+
+        return self.size - self.offset
+
+    def skip(self, size):
+        """ Moves the cursor forward, skipping a given number of bytes.
+
+        :param size: Number of bytes to skip.
+        :type size: int
+        :return: None.
+        :rtype: None
+        """
+
+        if self.offset + size > self.size:
+            raise struct_error("Not enough data to skip " + str(size) + " bytes.")
+        self.offset += size
+
+    def read(self, size):
+        """ Reads a given number of bytes, without copying them.
+
+        :param size: Number of bytes to read.
+        :type size: int
+        :return: The read bytes.
+        :rtype: memoryview
+        """
+
+        start = self.offset
+        end = start + size
+        if end > self.size:
+            raise struct_error("Not enough data to read " + str(size) + " bytes.")
+        self.offset = end
+
+        if self._view is None:
+            self._view = memoryview(self.data)
+
+        return self._view[start:end]
+
+    def read_bytes(self, size):
+        """ Reads a given number of bytes, copying them (see read).
+
+        :param size: Number of bytes to read.
+        :type size: int
+        :return: The read bytes.
+        :rtype: bytes
+        """
+
+        start = self.offset
+        end = start + size
+        if end > self.size:
+            raise struct_error("Not enough data to read " + str(size) + " bytes.")
+        self.offset = end
+
+        return self.data[start:end] if self._is_bytes else self.data[start:end].tobytes()
+
+    def read_struct(self, s):
+        """ Reads a fixed-width field (or group of fields).
+
+        :param s: Layout of the field(s), e.g. UINT32.
+        :type s: struct.Struct
+        :return: The unpacked values.
+        :rtype: tuple
+        """
+
+        values = s.unpack_from(self.data, self.offset)
+        self.offset += s.size
+
+        return values
+
+    def read_uint8(self):
+        try:
+            value = ord(self.data[self.offset])
+        except IndexError:
+            raise struct_error("Not enough data to read 1 byte.")
+        self.offset += 1
+        return value
+
+    def read_uint16(self):
+        value, = UINT16.unpack_from(self.data, self.offset)
+        self.offset += 2
+        return value
+
+    def read_uint32(self):
+        value, = UINT32.unpack_from(self.data, self.offset)
+        self.offset += 4
+        return value
+
+    def read_uint64(self):
+        value, = UINT64.unpack_from(self.data, self.offset)
+        self.offset += 8
+        return value
+
+    def read_uint32_be(self):
+        value, = UINT32_BE.unpack_from(self.data, self.offset)
+        self.offset += 4
+        return value
+
+    def read_varint(self):
+        """ Reads a varint (CompactSize).
+
+        :return: The decoded varint.
+        :rtype: int
+        """
+
+        # Single byte varints (by far the most common ones) are read right away.
+        value = self.read_uint8()
+        if value >= 0xFD:
+            value, self.offset = read_varint(self.data, self.offset - 1)
+
+        return value
+
+    def read_var_slice(self):
+        """ Reads a varint prefixed byte string (e.g. a script), without copying it.
+
+        :return: The read bytes.
+        :rtype: memoryview
+        """
+
+        start = self.offset
+        try:
+            size = ord(self.data[start])
+        except IndexError:
+            raise struct_error("Not enough data to read a varint.")
+        if size < 0xFD:
+            start += 1
+        else:
+            size, start = read_varint(self.data, start)
+
+        end = start + size
+        if end > self.size:
+            raise struct_error("Not enough data to read " + str(size) + " bytes.")
+        self.offset = end
+
+        if self._view is None:
+            self._view = memoryview(self.data)
+
+        return self._view[start:end]
+
+    def read_var_bytes(self):
+        """ Reads a varint prefixed byte string, copying it (see read_var_slice).
+
+        :return: The read bytes.
+        :rtype: bytes
+        """
+
+        return self.read_var_slice().tobytes()
+
+
+class Writer(object):
+    """ Growable buffer used to build wire-format data. Fields are appended to a single bytearray, so the serialized
+    data is not copied until it is retrieved (see get_value).
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def write(self, data):
+        """ Appends some bytes to the buffer.
+
+        :param data: Bytes to be appended.
+        :type data: bytes, bytearray or memoryview
+        :return: None.
+        :rtype: None
+        """
+
+        self.buffer += data
+
+    def write_struct(self, s, *values):
+        """ Appends a fixed-width field (or group of fields).
+
+        :param s: Layout of the field(s), e.g. UINT32.
+        :type s: struct.Struct
+        :param values: Values to be packed.
+        :type values: int
+        :return: None.
+        :rtype: None
+        """
+
+        self.buffer += s.pack(*values)
+
+    def write_uint8(self, value):
+        self.buffer += UINT8.pack(value)
+
+    def write_uint16(self, value):
+        self.buffer += UINT16.pack(value)
+
+    def write_uint32(self, value):
+        self.buffer += UINT32.pack(value)
+
+    def write_uint64(self, value):
+        self.buffer += UINT64.pack(value)
+
+    def write_uint32_be(self, value):
+        self.buffer += UINT32_BE.pack(value)
+
+    def write_varint(self, value):
+        self.buffer += pack_varint(value)
+
+    def write_var_bytes(self, data):
+        """ Appends a varint prefixed byte string (e.g. a script).
+
+        :param data: Bytes to be appended.
+        :type data: bytes or memoryview
+        :return: None.
+        :rtype: None
+        """
+
+        self.buffer += pack_varint(len(data))
+        self.buffer += data
+
+    def get_value(self):
+        """ Gets the serialized data.
+
+        :return: The content of the buffer.
+        :rtype: bytes
+        """
+
+        return bytes(self.buffer)
+
+
+def skip_tx(reader):
+    """ Skips over a serialized transaction (without decoding its fields), leaving the reader right after it.
+
+    :param reader: Reader positioned where the transaction starts.
+    :type reader: Reader
+    :return: For segwit transactions, the offsets where their inputs and their witnesses start (everything in between,
+    plus version and nLockTime, is the serialization the transaction id is computed from). None for legacy ones.
+    :rtype: tuple of int
+    """
+
+    # The offset is tracked locally (with single byte varints read inline), since this is called for every transaction
+    # of a block. Offsets only grow, so reading past the end of the buffer is caught either by the next read or by the
+    # final check.
+    data = reader.data
+    start = None
+
+    try:
+        # Version
+        offset = reader.offset + 4
+        n = ord(data[offset])
+        offset += 1
+        if n >= 0xFD:
+            n, offset = read_varint(data, offset - 1)
+        # Segwit marker (0x00) and flag (0x01)
+        if n == 0 and ord(data[offset]) == 1:
+            start = offset = offset + 1
+            n = ord(data[offset])
+            offset += 1
+            if n >= 0xFD:
+                n, offset = read_varint(data, offset - 1)
+
+        for i in range(n):
+            # Outpoint (36 bytes), scriptSig and nSequence (4 bytes)
+            offset += 36
+            size = ord(data[offset])
+            offset += 1
+            if size >= 0xFD:
+                size, offset = read_varint(data, offset - 1)
+            offset += size + 4
+
+        outputs = ord(data[offset])
+        offset += 1
+        if outputs >= 0xFD:
+            outputs, offset = read_varint(data, offset - 1)
+        for i in range(outputs):
+            # Value (8 bytes) and scriptPubKey
+            offset += 8
+            size = ord(data[offset])
+            offset += 1
+            if size >= 0xFD:
+                size, offset = read_varint(data, offset - 1)
+            offset += size
+
+        if start is not None:
+            witness = offset
+            # Witness stack of every input
+            for i in range(n):
+                items, offset = read_varint(data, offset)
+                for j in range(items):
+                    size, offset = read_varint(data, offset)
+                    offset += size
+    except IndexError:
+        raise struct_error("Not enough data to read the transaction.")
+
+    # nLockTime
+    offset += 4
+    if offset > reader.size:
+        raise struct_error("Not enough data to read the transaction.")
+    reader.offset = offset
+
+    return (start, witness) if start is not None else None
+
+
 def txout_compress(n):
     """ Compresses the Satoshi amount of a UTXO to be stored in the LevelDB. Code is a port from the Bitcoin Core C++
     source:
@@ -316,25 +703,56 @@ def get_prev_ScriptPubKey(tx_id, index, network='test'):
     :rtype hex str, str
     """
 
-    if network in ['main', 'mainnet']:
-        base_url = "https://api.blockcypher.com/v1/btc/main/txs/"
-    elif network in ['test', 'testnet']:
-        base_url = "https://api.blockcypher.com/v1/btc/test3/txs/"
-    else:
-        raise Exception("Bad network.")
+    return get_tx_outputs(tx_id, network)[index]
 
-    request = Request(base_url + tx_id)
+
+def get_tx_outputs(tx_id, network='test'):
+    """ Gets the ScriptPubKey (and its type) of every output of a given transaction id, by querying blockcyer's API.
+
+    :param tx_id: Transaction identifier to be queried.
+    :type tx_id: hex str
+    :param network: Network in which the transaction can be found (either mainnet or testnet).
+    :type network: hex str
+    :return: The ScriptPubKey and its type for every output of the transaction.
+    :rtype list of (hex str, str)
+    """
+
+    request = Request(get_blockcypher_url(network) + tx_id)
     header = 'User-agent', 'Mozilla/5.0'
     request.add_header("User-agent", header)
 
     r = urlopen(request)
 
-    data = loads(r.read())
+    return parse_tx_outputs(loads(r.read()))
+
+
+def get_blockcypher_url(network='test'):
+    """ Gets the base url of blockcypher's API to query transactions from a given network.
+
+    :param network: Network in which the transactions can be found (either mainnet or testnet).
+    :type network: hex str
+    :return: The base url (transaction ids are appended to it).
+    :rtype: str
+    """
 
-    script = data.get('outputs')[index].get('script')
-    t = data.get('outputs')[index].get('script_type')
+    if network in ['main', 'mainnet']:
+        return "https://api.blockcypher.com/v1/btc/main/txs/"
+    elif network in ['test', 'testnet']:
+        return "https://api.blockcypher.com/v1/btc/test3/txs/"
+    else:
+        raise Exception("Bad network.")
+
+
+def parse_tx_outputs(data):
+    """ Parses the outputs of a transaction obtained from a query to blockcyper's API.
+
+    :param data: Decoded (json) response.
+    :type data: dict
+    :return: The ScriptPubKey and its type for every output of the transaction.
+    :rtype list of (hex str, str)
+    """
 
-    return script, parse_script_type(t)
+    return [(out.get('script'), parse_script_type(out.get('script_type'))) for out in data.get('outputs')]
 
 
 def parse_script_type(t):
@@ -354,6 +772,10 @@ def parse_script_type(t):
         r = "P2PKH"
     elif t == 'pay-to-script-hash':
         r = "P2PSH"
+    elif t == 'pay-to-witness-pubkey-hash':
+        r = "P2WPKH"
+    elif t == 'pay-to-witness-script-hash':
+        r = "P2WSH"
     else:
         r = "unknown"
 
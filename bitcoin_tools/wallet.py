@@ -1,13 +1,17 @@
 from binascii import unhexlify, hexlify
-from hashlib import new, sha256
-from os import mkdir, path
+from hashlib import sha256
+from io import BytesIO
+from json import dumps
+from multiprocessing import Pool
+from os import makedirs, mkdir, path
 from re import match
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
 
-from base58 import b58encode, b58decode
 from qrcode import make as qr_make
 
 from bitcoin_tools import CFG
-from bitcoin_tools.core.keys import serialize_pk, serialize_sk
+from bitcoin_tools.core.hashing import double_sha256_batch, hash_160_batch
+from bitcoin_tools.core.keys import serialize_pk, serialize_sk, HDKey
 
 # Network codes
 PUBKEY_HASH = 0
@@ -16,6 +20,109 @@ TESTNET_PUBKEY_HASH = 111
 WIF = 128
 TESTNET_WIF = 239
 
+# Extended key versions (BIP32)
+XPRV = 0x0488ADE4
+XPUB = 0x0488B21E
+TESTNET_XPRV = 0x04358394
+TESTNET_XPUB = 0x043587CF
+
+# Bulk WIF export: number of QR codes encoded by a worker at once, number of images per directory (shard) and name of
+# the manifest file.
+EXPORT_CHUNK_SIZE = 50
+SHARD_SIZE = 1000
+MANIFEST = "manifest.txt"
+
+B58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+# Base58 digits are encoded (and decoded) two at a time, dividing by 58^2 instead of 58, using a table with every pair
+# of digits.
+_B58_PAIRS = [a + b for a in B58_ALPHABET for b in B58_ALPHABET]
+_B58_PAIR_VALUES = dict((pair, i) for i, pair in enumerate(_B58_PAIRS))
+_B58_VALUES = dict((c, i) for i, c in enumerate(B58_ALPHABET))
+
+
+def b58encode_batch(data):
+    """ Base58 encodes a batch of byte strings (with the same output as base58.b58encode).
+
+    :param data: Data to be encoded.
+    :type data: list of bytes
+    :return: Base58 encoded data, in the same order.
+    :rtype: list of str
+    """
+
+    encoded = []
+    for v in data:
+        n = int(hexlify(v), 16) if v else 0
+        digits = []
+        while n:
+            n, r = divmod(n, 3364)
+            digits.append(_B58_PAIRS[r])
+        digits.reverse()
+        # Leading zero bytes are encoded as leading 1s (the zero digit).
+        encoded.append("1" * (len(v) - len(v.lstrip("\0"))) + "".join(digits).lstrip("1"))
+
+    return encoded
+
+
+def b58decode_batch(data):
+    """ Decodes a batch of base58 encoded strings (with the same output as base58.b58decode).
+
+    :param data: Base58 encoded strings.
+    :type data: list of str
+    :return: Decoded data, in the same order.
+    :rtype: list of bytes
+    """
+
+    decoded = []
+    for v in data:
+        v = v.rstrip()
+        digits = v.lstrip("1")
+        try:
+            # Digits are taken in pairs, so an odd leading digit is taken alone.
+            start = len(digits) & 1
+            n = _B58_VALUES[digits[0]] if start else 0
+            for i in range(start, len(digits), 2):
+                n = n * 3364 + _B58_PAIR_VALUES[digits[i:i + 2]]
+        except KeyError:
+            raise Exception("Invalid base58 string: " + v)
+
+        h = format(n, 'x') if n else ""
+        if len(h) & 1:
+            h = "0" + h
+        decoded.append("\0" * (len(v) - len(digits)) + unhexlify(h))
+
+    return decoded
+
+
+def b58check_encode_batch(data):
+    """ Base58check encodes a batch of byte strings: every string is followed by a checksum (the first 4 bytes of its
+    double sha256) and base58 encoded.
+
+    :param data: Data to be encoded (e.g. version byte + RIPEMD-160 hash).
+    :type data: list of bytes
+    :return: Base58check encoded data, in the same order.
+    :rtype: list of str
+    """
+
+    return b58encode_batch([v + h[:4] for v, h in zip(data, double_sha256_batch(data))])
+
+
+def b58check_decode_batch(data):
+    """ Decodes a batch of base58check encoded strings, verifying their checksums.
+
+    :param data: Base58check encoded strings.
+    :type data: list of str
+    :return: Decoded data (without checksum), in the same order. None for the strings with a wrong checksum.
+    :rtype: list of bytes
+    """
+
+    decoded = []
+    for v in b58decode_batch(data):
+        payload, checksum = v[:-4], v[-4:]
+        decoded.append(payload if len(v) >= 4 and sha256(sha256(payload).digest()).digest()[:4] == checksum else None)
+
+    return decoded
+
 
 def hash_160(pk):
     """ Calculates the RIPEMD-160 hash of a given elliptic curve key.
@@ -26,13 +133,7 @@ def hash_160(pk):
     :rtype: bytes
     """
 
-    # Calculate the RIPEMD-160 hash of the given public key.
-    md = new('ripemd160')
-    h = sha256(unhexlify(pk)).digest()
-    md.update(h)
-    h160 = md.digest()
-
-    return h160
+    return hash_160_batch([unhexlify(pk)])[0]
 
 
 def hash_160_to_btc_address(h160, v):
@@ -55,16 +156,24 @@ def hash_160_to_btc_address(h160, v):
     if match('^[0-9a-fA-F]*$', h160):
         h160 = unhexlify(h160)
 
-    # Add the network version leading the previously calculated RIPEMD-160 hash.
-    vh160 = chr(v) + h160
-    # Double sha256.
-    h = sha256(sha256(vh160).digest()).digest()
-    # Add the two first bytes of the result as a checksum tailing the RIPEMD-160 hash.
-    addr = vh160 + h[0:4]
-    # Obtain the Bitcoin address by Base58 encoding the result
-    addr = b58encode(addr)
+    # Add the network version leading the previously calculated RIPEMD-160 hash, and Base58check encode the result.
+    return hash_160_to_btc_address_batch([h160], v)[0]
+
+
+def hash_160_to_btc_address_batch(h160s, v):
+    """ Calculates the Bitcoin addresses of a batch of RIPEMD-160 hashes. See hash_160_to_btc_address.
+
+    :param h160s: RIPEMD-160 hashes.
+    :type h160s: list of bytes
+    :param v: version (prefix) used to calculate the Bitcoin addresses.
+    :type v: int
+    :return: The corresponding Bitcoin addresses, in the same order.
+    :rtype: list of str
+    """
 
-    return addr
+    prefix = chr(v)
+
+    return b58check_encode_batch([prefix + h160 for h160 in h160s])
 
 
 def btc_addr_to_hash_160(btc_addr):
@@ -77,7 +186,7 @@ def btc_addr_to_hash_160(btc_addr):
     """
 
     # Base 58 decode the Bitcoin address.
-    decoded_addr = b58decode(btc_addr)
+    decoded_addr = b58decode_batch([btc_addr])[0]
     # Covert the address from bytes to hex.
     decoded_addr_hex = hexlify(decoded_addr)
     # Obtain the RIPEMD-160 hash by removing the first and four last bytes of the decoded address, corresponding to
@@ -101,6 +210,20 @@ def pk_to_btc_addr(pk, v='test'):
     :rtype: hex str
     """
 
+    return pk_to_btc_addr_batch([pk], v)[0]
+
+
+def pk_to_btc_addr_batch(pks, v='test'):
+    """ Calculates the Bitcoin addresses of a batch of elliptic curve public keys. See pk_to_btc_addr.
+
+    :param pks: elliptic curve public keys.
+    :type pks: list of hex str
+    :param v: version used to calculate the Bitcoin addresses (either 'main' or 'test').
+    :type v: str
+    :return: The corresponding Bitcoin addresses, in the same order.
+    :rtype: list of str
+    """
+
     # Choose the proper version depending on the provided 'v'.
     if v in ['mainnet', 'main']:
         v = PUBKEY_HASH
@@ -109,12 +232,8 @@ def pk_to_btc_addr(pk, v='test'):
     else:
         raise Exception("Invalid version, use either 'main' or 'test'.")
 
-    # Calculate the RIPEMD-160 hash of the given public key.
-    h160 = hash_160(pk)
-    # Calculate the Bitcoin address from the chosen network.
-    btc_addr = hash_160_to_btc_address(h160, v)
-
-    return btc_addr
+    # Calculate the RIPEMD-160 hash of every public key, and the Bitcoin address from the chosen network.
+    return hash_160_to_btc_address_batch(hash_160_batch([unhexlify(pk) for pk in pks]), v)
 
 
 def generate_btc_addr(pk, v='test',  compressed=True):
@@ -130,12 +249,24 @@ def generate_btc_addr(pk, v='test',  compressed=True):
     :rtype: str
     """
 
-    # Get the hex representation of the provided DER encoded public key.
-    public_key_hex = serialize_pk(pk, compressed)
-    # Generate the Bitcoin address of de desired network.
-    btc_addr = pk_to_btc_addr(public_key_hex, v)
+    return generate_btc_addr_batch([pk], v, compressed)[0]
+
+
+def generate_btc_addr_batch(pks, v='test', compressed=True):
+    """ Calculates the Bitcoin addresses associated to a batch of elliptic curve public keys. See generate_btc_addr.
 
-    return btc_addr
+    :param pks: ECDSA VerifyingKey objects (public keys to be converted into Bitcoin addresses).
+    :type pks: list of VerifyingKey
+    :param v: version (prefix) used to calculate the addresses, it depends on the type of network.
+    :type v: str
+    :param compressed: Indicates if Bitcoin addresses will be generated with the compressed or uncompressed keys.
+    :type compressed: bool
+    :return: The Bitcoin addresses associated to the given public keys, in the same order.
+    :rtype: list of str
+    """
+
+    # Get the hex representation of the provided public keys, and generate the Bitcoin addresses of de desired network.
+    return pk_to_btc_addr_batch([serialize_pk(pk, compressed) for pk in pks], v)
 
 
 def sk_to_wif(sk, mode='image', v='test'):
@@ -157,22 +288,7 @@ def sk_to_wif(sk, mode='image', v='test'):
         - str otherwise.
     """
 
-    # Choose the proper version depending on the provided 'v'.
-    if v in ['mainnet', 'main']:
-        v = WIF
-    elif v in ['testnet', 'test']:
-        v = TESTNET_WIF
-    else:
-        raise Exception("Invalid version, use either 'main' or 'test'.")
-
-    # Add the network version leading the private key (in hex).
-    e_pkey = chr(v) + unhexlify(sk)
-    # Double sha256.
-    h = sha256(sha256(e_pkey).digest()).digest()
-    # Add the two first bytes of the result as a checksum tailing the encoded key.
-    wif = e_pkey + h[0:4]
-    # Enconde the result in base58.
-    wif = b58encode(wif)
+    wif = sk_to_wif_batch([sk], v)[0]
 
     # Choose the proper return mode depending on 'mode'.
     if mode is 'image':
@@ -185,6 +301,32 @@ def sk_to_wif(sk, mode='image', v='test'):
     return response
 
 
+def sk_to_wif_batch(sks, v='test'):
+    """ Generates the Wallet Import Format (WIF) representation of a batch of elliptic curve private keys. See
+    sk_to_wif.
+
+    :param sks: elliptic curve private keys.
+    :type sks: list of hex str
+    :param v: version (prefix) used to calculate the WIFs, it depends on the type of network.
+    :type v: str
+    :return: The WIF representations of the private keys (as text), in the same order.
+    :rtype: list of str
+    """
+
+    # Choose the proper version depending on the provided 'v'.
+    if v in ['mainnet', 'main']:
+        v = WIF
+    elif v in ['testnet', 'test']:
+        v = TESTNET_WIF
+    else:
+        raise Exception("Invalid version, use either 'main' or 'test'.")
+
+    # Add the network version leading every private key, and Base58check encode the result.
+    prefix = chr(v)
+
+    return b58check_encode_batch([prefix + unhexlify(sk) for sk in sks])
+
+
 def generate_wif(btc_addr, sk, mode='image', v='test', vault_path=None):
     """ Generates a Wallet Import Format (WIF) file into disk. Uses an elliptic curve private key from disk as an input
     using the btc_addr associated to the public key of the same key pair as an identifier.
@@ -220,3 +362,223 @@ def generate_wif(btc_addr, sk, mode='image', v='test', vault_path=None):
         f.write(wif)
     else:
         raise Exception("Invalid mode, used either 'image' or 'text'.")
+
+
+def parse_xkey(xkey):
+    """ Parses a BIP32 extended key (xprv, xpub, tprv or tpub).
+
+    :param xkey: Base58check encoded extended key.
+    :type xkey: str
+    :return: The extended key.
+    :rtype: HDKey
+    """
+
+    data = b58check_decode_batch([xkey])[0]
+    if data is None:
+        raise Exception("Wrong extended key checksum.")
+
+    version, node = HDKey.from_bytes(data)
+    if version not in [XPRV, XPUB, TESTNET_XPRV, TESTNET_XPUB]:
+        raise Exception("Unknown extended key version: " + hex(version))
+    elif node.is_private() != (version in [XPRV, TESTNET_XPRV]):
+        raise Exception("The extended key version does not match the key type.")
+
+    return node
+
+
+def serialize_xkey(node, private=None, v='main'):
+    """ Serializes a BIP32 extended key.
+
+    :param node: Extended key.
+    :type node: HDKey
+    :param private: Whether the private key (xprv) or the public one (xpub) is serialized. By default, the private key
+    is serialized only if the node has it.
+    :type private: bool
+    :param v: version (prefix) used to serialize the key, it depends on the type of network.
+    :type v: str
+    :return: Base58check encoded extended key.
+    :rtype: str
+    """
+
+    if private is None:
+        private = node.is_private()
+
+    if v in ['mainnet', 'main']:
+        version = XPRV if private else XPUB
+    elif v in ['testnet', 'test']:
+        version = TESTNET_XPRV if private else TESTNET_XPUB
+    else:
+        raise Exception("Invalid version, use either 'main' or 'test'.")
+
+    return b58check_encode_batch([node.to_bytes(version, private)])[0]
+
+
+def generate_hd_addr(node, path, v='test'):
+    """ Calculates the Bitcoin address of the key derived from an extended key along a given path (see HDKey.derive).
+
+    :param node: Extended key.
+    :type node: HDKey
+    :param path: Derivation path (e.g. "m/44'/1'/0'/0/5").
+    :type path: str or list of int
+    :param v: version (prefix) used to calculate the Bitcoin address, it depends on the type of network.
+    :type v: str
+    :return: The Bitcoin address.
+    :rtype: str
+    """
+
+    return pk_to_btc_addr(hexlify(node.derive(path).get_public_key()), v)
+
+
+def generate_hd_addr_range(node, path, start, n, v='test'):
+    """ Calculates the Bitcoin addresses of a range of consecutive children of the key derived from an extended key
+    along a given path. The parent key is derived once (its ancestors are cached), and all the children at once.
+
+    e.g: generate_hd_addr_range(node, "m/44'/1'/0'/0", 0, 1000) gives the first 1000 receiving addresses of the account.
+
+    :param node: Extended key.
+    :type node: HDKey
+    :param path: Derivation path of the parent key.
+    :type path: str or list of int
+    :param start: Index of the first child.
+    :type start: int
+    :param n: Number of children.
+    :type n: int
+    :param v: version (prefix) used to calculate the Bitcoin addresses, it depends on the type of network.
+    :type v: str
+    :return: The Bitcoin addresses, in order.
+    :rtype: list of str
+    """
+
+    children = node.derive(path).derive_range(start, n)
+
+    return pk_to_btc_addr_batch([hexlify(child.get_public_key()) for child in children], v)
+
+
+def _encode_qr_chunk(wifs):
+    """ Encodes a chunk of WIFs as QR codes (PNG). Used by export_wifs workers.
+
+    :param wifs: WIFs to be encoded.
+    :type wifs: list of str
+    :return: PNG images, in the same order.
+    :rtype: list of bytes
+    """
+
+    images = []
+    for wif in wifs:
+        f = BytesIO()
+        qr_make(wif).save(f)
+        images.append(f.getvalue())
+
+    return images
+
+
+def _write_export_file(out, name, data, compress=True):
+    """ Writes a file of a WIF export (see export_wifs), either into a zip archive or into a directory.
+
+    :param out: Zip archive or directory where the file will be written.
+    :type out: ZipFile or str
+    :param name: File name (relative to the archive or directory).
+    :type name: str
+    :param data: File content.
+    :type data: bytes
+    :param compress: Whether the file is compressed (only for archives).
+    :type compress: bool
+    :return: None.
+    :rtype: None
+    """
+
+    if isinstance(out, ZipFile):
+        out.writestr(name, data, ZIP_DEFLATED if compress else ZIP_STORED)
+    else:
+        file_name = path.join(out, name)
+        if not path.exists(path.dirname(file_name)):
+            makedirs(path.dirname(file_name))
+        f = open(file_name, 'wb')
+        f.write(data)
+        f.close()
+
+
+def export_wifs(keys, out_name, mode='text', v='test', archive=True, vault_path=None, processes=None,
+                shard_size=SHARD_SIZE, chunk_size=EXPORT_CHUNK_SIZE):
+    """ Exports a batch of private keys in Wallet Import Format (WIF), either as text, as QR codes (PNG), or both. QR
+    codes are encoded in parallel using a pool of processes.
+
+    Everything is stored either in a single zip archive or in a directory, with images split in sharded subdirectories
+    (shard_size images each). A manifest (one json per line, in the same order as the given keys) lists the Bitcoin
+    address of every key along with its WIF (text mode) and/or the path and sha256 of its image (image mode).
+
+    :param keys: Bitcoin address and private key of every key pair.
+    :type keys: list of (str, SigningKey)
+    :param out_name: Name of the zip archive (if archive) or directory where keys will be exported.
+    :type out_name: str
+    :param mode: Export mode: 'text', 'image' or 'both'.
+    :type mode: str
+    :param v: version (prefix) used to calculate the WIFs, it depends on the type of network.
+    :type v: str
+    :param archive: Whether keys are exported to a zip archive (True) or to a directory (False).
+    :type archive: bool
+    :param vault_path: Path where the export will be stored. Defined in the config file by default.
+    :type vault_path: str
+    :param processes: Number of worker processes (number of cpus by default). If set to 1, QR codes are encoded in the
+    calling process.
+    :type processes: int
+    :param shard_size: Number of images per subdirectory.
+    :type shard_size: int
+    :param chunk_size: Number of QR codes sent to a worker at once.
+    :type chunk_size: int
+    :return: Number of exported keys.
+    :rtype: int
+    """
+
+    if mode not in ['text', 'image', 'both']:
+        raise Exception("Invalid mode, used either 'text', 'image' or 'both'.")
+
+    if vault_path is None:
+        vault_path = CFG.address_vault
+    out_path = vault_path + out_name
+
+    btc_addrs = [btc_addr for btc_addr, _ in keys]
+    wifs = sk_to_wif_batch([serialize_sk(sk) for _, sk in keys], v)
+    manifest = [{"btc_addr": btc_addr} for btc_addr in btc_addrs]
+    if mode in ['text', 'both']:
+        for entry, wif in zip(manifest, wifs):
+            entry["wif"] = wif
+
+    if archive:
+        out = ZipFile(out_path, 'w', ZIP_DEFLATED, allowZip64=True)
+    else:
+        out = out_path
+        if not path.exists(out_path):
+            makedirs(out_path)
+
+    try:
+        if mode in ['image', 'both']:
+            chunks = [wifs[i:i + chunk_size] for i in range(0, len(wifs), chunk_size)]
+            if processes == 1:
+                results = (_encode_qr_chunk(chunk) for chunk in chunks)
+            else:
+                pool = Pool(processes)
+                results = pool.imap(_encode_qr_chunk, chunks)
+
+            try:
+                i = 0
+                for images in results:
+                    for image in images:
+                        name = format(i // shard_size, '04d') + "/" + btc_addrs[i] + ".png"
+                        # PNG images are already compressed.
+                        _write_export_file(out, name, image, compress=False)
+                        manifest[i]["image"] = name
+                        manifest[i]["sha256"] = sha256(image).hexdigest()
+                        i += 1
+            finally:
+                if processes != 1:
+                    pool.close()
+                    pool.join()
+
+        _write_export_file(out, MANIFEST, "".join(dumps(entry) + "\n" for entry in manifest))
+    finally:
+        if isinstance(out, ZipFile):
+            out.close()
+
+    return len(keys)
+
@@ -0,0 +1,46 @@
+from binascii import unhexlify
+
+from bitcoin_tools.core.keys import HDKey
+from bitcoin_tools.wallet import parse_xkey, serialize_xkey, generate_hd_addr, generate_hd_addr_range
+
+# BIP32 test vector 1: (path, xpub, xprv)
+seed = unhexlify("000102030405060708090a0b0c0d0e0f")
+vectors = [("m",
+            "xpub661MyMwAqRbcFtXgS5sYJABqqG9YLmC4Q1Rdap9gSE8NqtwybGhePY2gZ29ESFjqJoCu1Rupje8YtGqsefD265TMg7usUDFdp6W1EGMcet8",
+            "xprv9s21ZrQH143K3QTDL4LXw2F7HEK3wJUD2nW2nRk4stbPy6cq3jPPqjiChkVvvNKmPGJxWUtg6LnF5kejMRNNU3TGtRBeJgk33yuGBxrMPHi"),
+           ("m/0H",
+            "xpub68Gmy5EdvgibQVfPdqkBBCHxA5htiqg55crXYuXoQRKfDBFA1WEjWgP6LHhwBZeNK1VTsfTFUHCdrfp1bgwQ9xv5ski8PX9rL2dZXvgGDnw",
+            "xprv9uHRZZhk6KAJC1avXpDAp4MDc3sQKNxDiPvvkX8Br5ngLNv1TxvUxt4cV1rGL5hj6KCesnDYUhd7oWgT11eZG7XnxHrnYeSvkzY7d2bhkJ7"),
+           ("m/0H/1",
+            "xpub6ASuArnXKPbfEwhqN6e3mwBcDTgzisQN1wXN9BJcM47sSikHjJf3UFHKkNAWbWMiGj7Wf5uMash7SyYq527Hqck2AxYysAA7xmALppuCkwQ",
+            "xprv9wTYmMFdV23N2TdNG573QoEsfRrWKQgWeibmLntzniatZvR9BmLnvSxqu53Kw1UmYPxLgboyZQaXwTCg8MSY3H2EU4pWcQDnRnrVA1xe8fs"),
+           ("m/0H/1/2H",
+            "xpub6D4BDPcP2GT577Vvch3R8wDkScZWzQzMMUm3PWbmWvVJrZwQY4VUNgqFJPMM3No2dFDFGTsxxpG5uJh7n7epu4trkrX7x7DogT5Uv6fcLW5",
+            "xprv9z4pot5VBttmtdRTWfWQmoH1taj2axGVzFqSb8C9xaxKymcFzXBDptWmT7FwuEzG3ryjH4ktypQSAewRiNMjANTtpgP4mLTj34bhnZX7UiM"),
+           ("m/0H/1/2H/2",
+            "xpub6FHa3pjLCk84BayeJxFW2SP4XRrFd1JYnxeLeU8EqN3vDfZmbqBqaGJAyiLjTAwm6ZLRQUMv1ZACTj37sR62cfN7fe5JnJ7dh8zL4fiyLHV",
+            "xprvA2JDeKCSNNZky6uBCviVfJSKyQ1mDYahRjijr5idH2WwLsEd4Hsb2Tyh8RfQMuPh7f7RtyzTtdrbdqqsunu5Mm3wDvUAKRHSC34sJ7in334"),
+           ("m/0H/1/2H/2/1000000000",
+            "xpub6H1LXWLaKsWFhvm6RVpEL9P4KfRZSW7abD2ttkWP3SSQvnyA8FSVqNTEcYFgJS2UaFcxupHiYkro49S8yGasTvXEYBVPamhGW6cFJodrTHy",
+            "xprvA41z7zogVVwxVSgdKUHDy1SKmdb533PjDz7J6N6mV6uS3ze1ai8FHa8kmHScGpWmj4WggLyQjgPie1rFSruoUihUZREPSL39UNdE3BBDu76")]
+
+master = HDKey.from_seed(seed)
+
+print ("DERIVATION")
+
+for path, xpub, xprv in vectors:
+    node = master.derive(path)
+    assert serialize_xkey(node) == xprv and serialize_xkey(node, private=False) == xpub
+    assert serialize_xkey(parse_xkey(xprv)) == xprv and serialize_xkey(parse_xkey(xpub)) == xpub
+    print path, serialize_xkey(node, private=False)
+
+# Non hardened children can be derived from the public extended key as well.
+assert serialize_xkey(parse_xkey(vectors[3][1]).derive("m/2/1000000000"), private=False) == vectors[5][1]
+
+print ("\nADDRESSES")
+
+account = master.derive("m/44'/1'/0'")
+addrs = generate_hd_addr_range(account, "m/0", 0, 10)
+assert addrs == [generate_hd_addr(account.neuter(), "m/0/" + str(i)) for i in range(10)]
+for addr in addrs:
+    print addr
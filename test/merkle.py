@@ -0,0 +1,57 @@
+from binascii import hexlify, unhexlify
+from struct import pack
+
+from bitcoin_tools.core.block import Block
+from bitcoin_tools.core.hashing import get_txids, merkle_root, hash_160_batch
+from bitcoin_tools.core.transaction import TX
+from bitcoin_tools.utils import pack_varint
+from bitcoin_tools.wallet import hash_160
+
+# MERKLE ROOT OF BLOCK 100000 (4 transactions, so both levels of the tree have an even number of nodes)
+
+tx_ids = ["8c14f0db3df150123e6f3dbbf30f8b955a8249b62ac1d1ff16284aefa3d06d87",
+          "fff2525b8931402dd09222c50775608f75787bd2b87e56995a7bdd30f79702c4",
+          "6359f0868171b1d194cbee1af2f16ea598ae8fad666d9b012c8ed2b79a236ec4",
+          "e9a66845e05d5abc0ad04ec80f774a7e585c6e8db975962d069a522137b80c1d"]
+root = merkle_root([unhexlify(tx_id)[::-1] for tx_id in tx_ids])
+print "Merkle root: " + hexlify(root[::-1])
+assert hexlify(root[::-1]) == "f3e94742aca4b5ef85488dc37c06c3282295ffec960994b2c0d5ac2a25a95766"
+
+# BLOCK VALIDATION
+
+# Legacy transaction (BIP143 native P2WPKH example, unsigned) and segwit transaction (the same one, signed).
+legacy_tx = "0100000002fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f0000000000eeffffffef51e1b804cc" \
+            "89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff02202cb206000000001976a9148280b37d" \
+            "f378db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2f0167faa815988ac" \
+            "11000000"
+segwit_tx = "01000000000102fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f00000000494830450221008b9d1d" \
+            "c26ba6a9cb62127b02742fa9d754cd3bebf337f7a55d114c8e5cdd30be022040529b194ba3f9281a99f2b1c0a19c0489bc22ede944" \
+            "ccf4ecbab4cc618ef3ed01eeffffffef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ff" \
+            "ffffff02202cb206000000001976a9148280b37df378db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42" \
+            "dbee7e4dbe6a21b2d50ce2f0167faa815988ac000247304402203609e17b84f6a7d30c80bfa610b5b4542f32a8a0d5447a12fb1366" \
+            "d7f01cc44a0220573a954c4518331561406f90300e8f3358f51928d43c212a8caed02de67eebee0121025476c2e83188368da1ff3e" \
+            "292e7acafcdb3566bb0ad253f62fc70f07aeee635711000000"
+
+# Three transactions, so the last node of the first level is duplicated.
+raw_txs = [unhexlify(legacy_tx), unhexlify(segwit_tx), unhexlify(legacy_tx)]
+txids = get_txids(raw_txs)
+assert txids == [TX.from_bytes(raw_tx).get_txid(rtype=bin) for raw_tx in raw_txs]
+
+
+def build_block(root):
+    header = pack("<I", 0x20000000) + "\x00" * 32 + root + pack("<III", 1231006505, 0x1d00ffff, 0)
+    return Block(header + pack_varint(len(raw_txs)) + "".join(raw_txs))
+
+
+block = build_block(merkle_root(txids))
+assert block.get_txids(endianness="BE") == [tx.get_txid(endianness="BE") for tx in block.iter_txs()]
+print "Block merkle root check: " + str(block.check_merkle_root())
+assert block.check_merkle_root()
+assert not build_block(merkle_root(txids[:2])).check_merkle_root()
+
+# HASH160
+
+pks = ["025476c2e83188368da1ff3e292e7acafcdb3566bb0ad253f62fc70f07aeee6357",
+       "03c9f4836b9a4f77fc0d81f7bcb01b7f1b35916864b9476c241ce9fc198bd25432"]
+assert hexlify(hash_160(pks[0])) == "1d0f172a0ecb48aee1be1f2687d2963ae33f71a1"
+assert hash_160_batch([unhexlify(pk) for pk in pks]) == [hash_160(pk) for pk in pks]
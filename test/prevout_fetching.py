@@ -0,0 +1,83 @@
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from hashlib import sha256
+from json import dumps
+from threading import Thread, Lock
+from time import time, sleep
+
+from bitcoin_tools.core.keys import generate_keys
+from bitcoin_tools.core.prevouts import HTTPResolver
+from bitcoin_tools.core.script import OutputScript
+from bitcoin_tools.core.transaction import TX
+from bitcoin_tools.wallet import generate_btc_addr
+
+# Local stand-in for blockcypher's API. Every transaction has two P2PKH outputs paying to the test address. Requests
+# take LATENCY seconds, and every third transaction fails the first time it is requested (so it has to be retried).
+
+LATENCY = 0.05
+N_INPUTS = 500
+
+sk, pk = generate_keys()
+btc_addr = generate_btc_addr(pk)
+script = OutputScript.P2PKH(btc_addr).content
+
+requests = {"count": 0, "failed": set()}
+lock = Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        tx_id = self.path.split("/")[-1]
+        with lock:
+            requests["count"] += 1
+            fail = int(tx_id[:8], 16) % 3 == 0 and tx_id not in requests["failed"]
+            if fail:
+                requests["failed"].add(tx_id)
+        sleep(LATENCY)
+
+        if fail:
+            body = "Internal error"
+            self.send_response(500)
+        else:
+            body = dumps({"outputs": [{"script": script, "script_type": "pay-to-pubkey-hash"}] * 2})
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+server = Server(("127.0.0.1", 0), Handler)
+Thread(target=server.serve_forever).start()
+base_url = "http://127.0.0.1:" + str(server.server_address[1]) + "/v1/btc/test3/txs/"
+
+# RESOLVE PREVOUTS
+
+resolver = HTTPResolver(base_url, concurrency=20, backoff=0.01)
+prev_tx_ids = [sha256(str(i)).hexdigest() for i in range(N_INPUTS)]
+
+t0 = time()
+prevouts = resolver.resolve([(tx_id, 1) for tx_id in prev_tx_ids])
+elapsed = time() - t0
+
+print "Resolved " + str(len(prevouts)) + " prevouts in " + str(elapsed) + " s (" + str(requests["count"]) + \
+      " requests, " + str(len(requests["failed"])) + " retried)."
+print "Sequential requests would have taken at least " + str((N_INPUTS + len(requests["failed"])) * LATENCY) + " s."
+assert prevouts == [(script, "P2PKH")] * N_INPUTS
+
+# SIGN
+
+tx = TX.build_from_io(prev_tx_ids[:10], [0] * 10, 1000, btc_addr)
+tx.sign([sk] * 10, range(10), resolver=resolver)
+print tx.serialize()
+
+resolver.close()
+server.shutdown()
@@ -0,0 +1,83 @@
+from binascii import hexlify, unhexlify
+
+from ecdsa import SigningKey, SECP256k1
+
+from bitcoin_tools.core.script import OutputScript, SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE, SIGHASH_ANYONECANPAY
+from bitcoin_tools.core.transaction import TX
+
+# Native P2WPKH example from BIP143: input 0 redeems a P2PK output (legacy), while input 1 redeems a P2WPKH one.
+# https://github.com/bitcoin/bips/blob/master/bip-0143.mediawiki#native-p2wpkh
+
+unsigned_tx = "0100000002fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f0000000000eeffffffef51e1b804cc" \
+              "89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff02202cb206000000001976a9148280b37d" \
+              "f378db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2f0167faa815988ac" \
+              "11000000"
+signed_tx = "01000000000102fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f00000000494830450221008b9d1d" \
+            "c26ba6a9cb62127b02742fa9d754cd3bebf337f7a55d114c8e5cdd30be022040529b194ba3f9281a99f2b1c0a19c0489bc22ede944" \
+            "ccf4ecbab4cc618ef3ed01eeffffffef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ff" \
+            "ffffff02202cb206000000001976a9148280b37df378db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42" \
+            "dbee7e4dbe6a21b2d50ce2f0167faa815988ac000247304402203609e17b84f6a7d30c80bfa610b5b4542f32a8a0d5447a12fb1366" \
+            "d7f01cc44a0220573a954c4518331561406f90300e8f3358f51928d43c212a8caed02de67eebee0121025476c2e83188368da1ff3e" \
+            "292e7acafcdb3566bb0ad253f62fc70f07aeee635711000000"
+
+p2pk = OutputScript.from_hex("2103c9f4836b9a4f77fc0d81f7bcb01b7f1b35916864b9476c241ce9fc198bd25432ac")
+p2wpkh = OutputScript.P2WPKH("1d0f172a0ecb48aee1be1f2687d2963ae33f71a1")
+amount = 600000000
+
+tx = TX.deserialize(unsigned_tx)
+sighash = tx.get_segwit_sighash(1, "76a9141d0f172a0ecb48aee1be1f2687d2963ae33f71a188ac", amount)
+print "P2WPKH sighash: " + hexlify(sighash)
+assert hexlify(sighash) == "c37af31116d1b27caf68aae9e3ac82f1477929014d5b917657d0eb49478cb670"
+
+# Parse the signed transaction, check both inputs and serialize it back.
+tx = TX.deserialize(signed_tx)
+assert tx.has_witness() and tx.serialize() == signed_tx
+# Without witness data, neither the marker and flag (right after the version) nor the witnesses (right before nLockTime)
+# are serialized.
+w = signed_tx.index("000247304402203609")
+assert tx.serialize(witness=False) == signed_tx[:8] + signed_tx[12:w] + signed_tx[-8:]
+print "txid: " + tx.get_txid(endianness="BE")
+print "wtxid: " + tx.get_wtxid(endianness="BE")
+assert tx.get_txid() != tx.get_wtxid()
+assert tx.verify(prevouts={0: p2pk, 1: p2wpkh}, amounts={1: amount})
+assert not tx.verify(prevouts={0: p2pk, 1: p2wpkh}, amounts={1: amount + 1})
+
+# Signatures with an unsupported hash type (SIGHASH_ANYONECANPAY for legacy inputs, or an unknown one) are not valid.
+legacy_sig_end, segwit_sig_end = signed_tx.index("ef3ed01eeffffff") + 4, signed_tx.index("eebee0121025476") + 4
+for flag in ["81", "04"]:
+    bad_tx = TX.deserialize(signed_tx[:legacy_sig_end] + flag + signed_tx[legacy_sig_end + 2:])
+    assert not bad_tx.verify(0, prevouts={0: p2pk}) and bad_tx.verify(1, prevouts={1: p2wpkh}, amounts={1: amount})
+    bad_tx = TX.deserialize(signed_tx[:segwit_sig_end] + flag + signed_tx[segwit_sig_end + 2:])
+    assert bad_tx.verify(0, prevouts={0: p2pk}) and not bad_tx.verify(1, prevouts={1: p2wpkh}, amounts={1: amount})
+
+# Sign input 1 again (deterministic k).
+sk = SigningKey.from_string(unhexlify("619c335025c7f4012e556c2a58b2506e30b8511b53ade95ea316fd8c3286feb9"),
+                            curve=SECP256k1)
+tx = TX.deserialize(unsigned_tx)
+tx.sign(sk, 1, orphan={1: p2wpkh}, amounts={1: amount})
+assert tx.witness[1] == TX.deserialize(signed_tx).witness[1]
+assert tx.verify(1, prevouts={1: p2wpkh}, amounts={1: amount})
+print tx.serialize()
+
+# Signature hashes of every hash type, from the P2SH-P2WSH example of BIP143.
+# https://github.com/bitcoin/bips/blob/master/bip-0143.mediawiki#p2sh-p2wsh
+
+tx = TX.deserialize("010000000136641869ca081e70f394c6948e8af409e18b619df2ed74aa106c1ca29787b96e0100000000ffffffff0200e9"
+                    "a435000000001976a914389ffce9cd9ae88dcc0631e88a821ffdbe9bfe2688acc0832f05000000001976a9147480a33f95"
+                    "0689af511e6e84c138dbbd3c3ee41588ac00000000")
+witness_script = "56210307b8ae49ac90a048e9b53357a2354b3334e9c8bee813ecb98e99a7e07e8c3ba32103b28f0c28bfab54554ae8c658ac5c" \
+                 "3e0ce6e79ad336331f78c428dd43eea8449b21034b8113d703413d57761b8b9781957b8c0ac1dfe69f492580ca4195f50376" \
+                 "ba4a21033400f6afecb833092a9a21cfdf1ed1376e58c5d1f47de74683123987e967a8f42103a6d48b1131e94ba04d9737d6" \
+                 "1acdaa1322008af9602b3b14862c07a1789aac162102d8b661b0b3302ee2f162b09e07a55ad5dfbe673a9f01d9f0c1961768" \
+                 "1024306b56ae"
+sighashes = [(SIGHASH_ALL, "185c0be5263dce5b4bb50a047973c1b6272bfbd0103a89444597dc40b248ee7c"),
+             (SIGHASH_NONE, "e9733bc60ea13c95c6527066bb975a2ff29a925e80aa14c213f686cbae5d2f36"),
+             (SIGHASH_SINGLE, "1e1f1c303dc025bd664acb72e583e933fae4cff9148bf78c157d1e8f78530aea"),
+             (SIGHASH_ALL | SIGHASH_ANYONECANPAY, "2a67f03e63a6a422125878b40b82da593be8d4efaafe88ee528af6e5a9955c6e"),
+             (SIGHASH_NONE | SIGHASH_ANYONECANPAY, "781ba15f3779d5542ce8ecb5c18716733a5ee42a6f51488ec96154934e2c890a"),
+             (SIGHASH_SINGLE | SIGHASH_ANYONECANPAY, "511e8e52ed574121fc1b654970395502128263f62662e076dc6baf05c2e6a99b")]
+
+for hashflag, expected in sighashes:
+    sighash = hexlify(tx.get_segwit_sighash(0, witness_script, 987654321, hashflag))
+    print hex(hashflag) + ": " + sighash
+    assert sighash == expected